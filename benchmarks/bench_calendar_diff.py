@@ -0,0 +1,111 @@
+# Measures calendar_diff's notification throughput against a local SNS stand-in with a fixed round trip time, compared
+# to publishing one notification per request as the handler did before it used PublishBatch.
+#
+# Usage: python benchmarks/bench_calendar_diff.py [number of changed events] [round trip ms]
+from os import environ
+import contextlib
+import io
+import threading
+import json
+import time
+import sys
+
+from handlers import load_handler, get_clients
+
+
+class LocalSns:
+    # Accepts publish and publish_batch calls like boto3's SNS client, and waits one round trip per request
+
+    def __init__(self, round_trip_seconds: float):
+        self.round_trip_seconds: float = round_trip_seconds
+        self.lock = threading.Lock()
+        self.requests: int = 0
+        self.messages: int = 0
+
+    def publish(self, **kwargs):
+        time.sleep(self.round_trip_seconds)
+        with self.lock:
+            self.requests += 1
+            self.messages += 1
+        return {"MessageId": str(self.messages)}
+
+    def publish_batch(self, TopicArn: str, PublishBatchRequestEntries: list):
+        time.sleep(self.round_trip_seconds)
+        with self.lock:
+            self.requests += 1
+            self.messages += len(PublishBatchRequestEntries)
+        return {"Successful": [{"Id": entry["Id"]} for entry in PublishBatchRequestEntries], "Failed": []}
+
+
+def calendar_event(i: int, location: str = "Oslo") -> dict:
+    return {
+        "uid": f"event-{i}@google.com",
+        "start": "2026-11-20T18:00:00+01:00",
+        "end": "2026-11-20T20:00:00+01:00",
+        "duration": "P0DT2H0M0S",
+        "created": "2026-01-01T00:00:00+00:00",
+        "name": f"Arrangement {i}",
+        "summary": f"Arrangement {i}",
+        "description": "<p>Velkommen!</p>" * 10,
+        "location": location,
+        "rrule": "",
+        "status": "CONFIRMED"
+    }
+
+
+def change_set(changes: int) -> dict:
+    third: int = changes // 3
+    return {
+        "added": [calendar_event(i) for i in range(third)],
+        "removed": [calendar_event(i) for i in range(third, 2 * third)],
+        "modified": [{
+            "old": calendar_event(i),
+            "new": calendar_event(i, location="Bergen"),
+            "changed-fields": ["location"]
+        } for i in range(2 * third, changes)]
+    }
+
+
+def publish_one_by_one(calendar_diff, sns: LocalSns, changes: dict):
+    # The handler's behaviour before batching: one request per notification, one after another
+    notifications: [dict] = [calendar_diff.new_event_notification(event) for event in changes["added"]] \
+        + [calendar_diff.updated_event_notification(changed["old"], changed["new"]) for changed in changes["modified"]] \
+        + [calendar_diff.deleted_event_notification(event) for event in changes["removed"]]
+    for notification in notifications:
+        sns.publish(
+            TopicArn=environ[notification["topic"]],
+            Message=json.dumps(notification["message"], ensure_ascii=False),
+            MessageGroupId=notification["message_group_id"]
+        )
+
+
+def main(changes: int, round_trip_ms: float):
+    environ.update(
+        NEW_EVENT_TOPIC_ARN="new", UPDATED_EVENT_TOPIC_ARN="updated", DELETED_EVENT_TOPIC_ARN="deleted"
+    )
+    calendar_diff = load_handler("calendar_diff")
+    record: dict = {
+        "messageId": "benchmark",
+        "body": json.dumps({"Message": json.dumps(change_set(changes))})
+    }
+    print(f"{changes} changed events, {round_trip_ms} ms round trip")
+    print(f"{'mode':>12} {'seconds':>9} {'requests':>9} {'notifications/s':>16}")
+    for mode in ["one-by-one", "batched"]:
+        sns: LocalSns = LocalSns(round_trip_ms / 1000)
+        get_clients()["sns"] = sns
+        started: float = time.perf_counter()
+        if mode == "batched":
+            with contextlib.redirect_stdout(io.StringIO()):
+                response: dict = calendar_diff.handler({"Records": [record]}, None)
+            assert len(response["batchItemFailures"]) == 0
+        else:
+            publish_one_by_one(calendar_diff, sns, json.loads(json.loads(record["body"])["Message"]))
+        seconds: float = time.perf_counter() - started
+        print(f"{mode:>12} {seconds:>9.2f} {sns.requests:>9} {sns.messages / seconds:>16.0f}")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 300,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 20
+    )
@@ -0,0 +1,110 @@
+# Compares the memory footprint and comparison throughput of CalendarEvent with the dict backed class it replaced.
+#
+# Usage: python benchmarks/bench_calendar_event.py [number of events]
+from datetime import datetime, timedelta
+from os import path
+import tracemalloc
+import timeit
+import sys
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "calendar_sync"))
+
+from model.calendar import CalendarEvent
+
+
+class LegacyCalendarEvent:
+    # CalendarEvent before it got __slots__ and a fingerprint, without the pandas duration
+
+    def __init__(
+            self, uid: str, start: datetime, end: datetime, created: datetime,
+            summary: str, description: str, location: str, rrule: str, status: str
+    ):
+        self.uid = uid
+        self.start: datetime = start
+        self.end: datetime = end
+        self.duration: timedelta = end - start
+        self.created: datetime = created
+        self.summary: str = summary
+        self.description: str = description
+        self.location: str = location
+        self.rrule: str = rrule
+        self.status: str = status
+
+    def __eq__(self, other):
+        return all([
+            self.uid == other.uid,
+            self.start == other.start,
+            self.end == other.end,
+            self.created == other.created,
+            self.summary == other.summary,
+            self.description == other.description,
+            self.location == other.location,
+            self.rrule == other.rrule,
+            self.status == other.status
+        ])
+
+
+def event_fields(i: int) -> dict:
+    start: datetime = datetime(2026, 1, 1, 18) + timedelta(days=i % 365)
+    return {
+        "uid": f"event-{i}@google.com",
+        "start": start,
+        "end": start + timedelta(hours=2),
+        "created": datetime(2025, 1, 1),
+        "summary": f"Arrangement {i}",
+        "description": "<p>Velkommen!</p>" * 20,
+        "location": "Oslo",
+        "rrule": "FREQ=WEEKLY;BYDAY=FR" if i % 10 == 0 else "",
+        "status": "CONFIRMED",
+    }
+
+
+def copy_fields(fields: dict, **changes) -> dict:
+    # Old and new events are parsed from different sources, so their strings are equal but not the same objects
+    return dict({key: "".join(list(value)) if type(value) == str else value for key, value in fields.items()}, **changes)
+
+
+def bytes_per_event(event_class, fields: [dict]) -> float:
+    # The field values are created up front and shared, so only the event objects themselves are measured.
+    # Cached fingerprints are included, as every event gets one once it has been compared.
+    tracemalloc.start()
+    before: int = tracemalloc.get_traced_memory()[0]
+    events: list = [event_class(**event) for event in fields]
+    for event in events:
+        getattr(event, "fingerprint", None)
+    after: int = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / len(events)
+
+
+def comparisons_per_second(first: list, second: list) -> float:
+    pairs: list = list(zip(first, second))
+    seconds: float = min(timeit.repeat(lambda: [a == b for a, b in pairs], number=5, repeat=3)) / 5
+    return len(pairs) / seconds
+
+
+def main(count: int):
+    fields: [dict] = [event_fields(i) for i in range(count)]
+    copied_fields: [dict] = [copy_fields(event) for event in fields]
+    changed_fields: [dict] = [copy_fields(event, location="Bergen") for event in fields]
+    print(f"{count} events")
+    print(f"{'class':>20} {'bytes/event':>12} {'equal cmp/s':>14} {'unequal cmp/s':>14} {'set build s':>12}")
+    for event_class in [LegacyCalendarEvent, CalendarEvent]:
+        memory: float = bytes_per_event(event_class, fields)
+        events: list = [event_class(**event) for event in fields]
+        copies: list = [event_class(**event) for event in copied_fields]
+        changed: list = [event_class(**event) for event in changed_fields]
+        equal_throughput: float = comparisons_per_second(events, copies)
+        unequal_throughput: float = comparisons_per_second(events, changed)
+        if event_class.__hash__ is None:
+            set_build: str = "unhashable"
+        else:
+            set_build = f"{min(timeit.repeat(lambda: set(copies), number=1, repeat=3)):.4f}"
+        print(
+            f"{event_class.__name__:>20} {memory:>12.0f} {equal_throughput:>14.0f} {unequal_throughput:>14.0f} "
+            f"{set_build:>12}"
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
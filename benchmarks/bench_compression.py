@@ -0,0 +1,67 @@
+# Compares the size of index.json and the pages of a synthetic calendar as published by the calendar sync, serialized
+# with default or minified separators and stored uncompressed or gzip encoded. The throughput of the encoding is
+# measured as well.
+#
+# Usage: python benchmarks/bench_compression.py [number of events] [events per page]
+from os import path, environ
+import time
+import sys
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "calendar_sync"))
+
+from handlers import load_handler
+from synthetic_calendar import generate_ical
+from model.calendar import Calendar
+
+
+def measure(calendar_sync, artifacts: [dict], minify: bool, encoding: str) -> dict:
+    environ["MINIFY_JSON"] = str(minify)
+    started: float = time.perf_counter()
+    json_bodies: [bytes] = [calendar_sync.serialize_json(artifact) for artifact in artifacts]
+    serialized: float = time.perf_counter()
+    bodies: [bytes] = [calendar_sync.encode_body(body, encoding) for body in json_bodies]
+    encoded: float = time.perf_counter()
+    json_bytes: int = sum([len(body) for body in json_bodies])
+    return {
+        "json-bytes": json_bytes,
+        "stored-bytes": sum([len(body) for body in bodies]),
+        "encode-mb-per-second": json_bytes / (encoded - serialized) / 1e6 if encoding != "identity" else None,
+    }
+
+
+def main(events: int, per_page: int):
+    environ.update(CALENDAR_LINK="https://calendar.google.com/calendar/ical/benchmark/basic.ics",
+                   EVENTS_PER_PAGE=str(per_page))
+    calendar_sync = load_handler("calendar_sync")
+    calendar: Calendar = Calendar.from_ical(generate_ical(events, seed=0))
+    paginated: dict = calendar_sync.get_paginated_recurring_events(calendar)
+    artifacts: dict = {
+        "index.json": [{
+            "source-url": environ["CALENDAR_LINK"],
+            "total-events": len(calendar.recurring_events),
+            "events": [event.to_dict() for event in calendar.recurring_events]
+        }],
+        "pages": list(paginated.values()),
+    }
+
+    encodings: [str] = calendar_sync.ARTIFACT_ENCODINGS
+    print(f"{events} events, {len(calendar.recurring_events)} occurrences, {len(paginated)} pages")
+    print(f"{'artifact':>11} {'json':>9} {'encoding':>9} {'bytes':>10} {'of default':>11} {'encode MB/s':>12}")
+    for name, objects in artifacts.items():
+        default: int = measure(calendar_sync, objects, False, "identity")["stored-bytes"]
+        for minify in [False, True]:
+            for encoding in encodings:
+                result: dict = measure(calendar_sync, objects, minify, encoding)
+                throughput: str = f"{result['encode-mb-per-second']:.1f}" \
+                    if result["encode-mb-per-second"] is not None else "-"
+                print(
+                    f"{name:>11} {'minified' if minify else 'default':>9} {encoding:>9} "
+                    f"{result['stored-bytes']:>10} {result['stored-bytes'] / default:>11.1%} {throughput:>12}"
+                )
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 2000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    )
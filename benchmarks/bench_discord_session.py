@@ -0,0 +1,76 @@
+# Measures the time of each Discord request of discord_notify against a local HTTPS stand-in of the webhook, with the
+# session kept between invocations as in a warm container, compared to a new session for each message as the handler
+# did before it pooled its connections. Each new connection waits two round trips for the TCP and TLS handshakes, on
+# top of the local TLS handshake itself.
+#
+# Usage: python benchmarks/bench_discord_session.py [number of messages] [round trip ms]
+from os import environ
+import contextlib
+import tempfile
+import json
+import io
+import sys
+
+from handlers import load_handler
+from stand_ins import LocalDiscord, create_self_signed_context
+
+
+def record(i: int) -> dict:
+    # Long enough descriptions that each notification is sent as a message of its own
+    event: dict = {
+        "uid": f"event-{i}@google.com",
+        "start": "2026-11-20T18:00:00+01:00",
+        "end": "2026-11-20T20:00:00+01:00",
+        "summary": f"Arrangement {i}",
+        "description": "<p>Velkommen til arrangementet!</p>" * 40,
+        "location": "Oslo",
+        "rrule": ""
+    }
+    return {
+        "messageId": f"message-{i}",
+        "body": json.dumps({"Message": json.dumps({"event": event})}),
+        "attributes": {"MessageGroupId": "new_calendar_event"}
+    }
+
+
+def percentile(values: [float], share: float) -> float:
+    ordered: [float] = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def main(messages: int, round_trip_ms: float):
+    with tempfile.TemporaryDirectory() as directory:
+        ssl_context, certificate_path = create_self_signed_context(directory)
+        environ["REQUESTS_CA_BUNDLE"] = certificate_path
+        print(f"{messages} messages, {round_trip_ms} ms round trip")
+        print(f"{'mode':>12} {'connections':>12} {'p50 ms':>8} {'p95 ms':>8} {'mean ms':>8}")
+        for mode in ["new-session", "pooled"]:
+            discord: LocalDiscord = LocalDiscord(
+                round_trip_ms / 1000, ssl_context=ssl_context, connect_latency_seconds=2 * round_trip_ms / 1000
+            ).start()
+            environ["DISCORD_WEBHOOK_URL"] = discord.url
+            discord_notify = load_handler("discord_notify")
+            discord_notify.webhook_url = discord.url
+            discord_notify.session = None
+            request_milliseconds: [float] = []
+            for i in range(messages):
+                if mode == "new-session" and discord_notify.session is not None:
+                    discord_notify.session.close()
+                    discord_notify.session = None
+                with contextlib.redirect_stdout(io.StringIO()):
+                    response: dict = discord_notify.handler({"Records": [record(i)]}, None)
+                assert len(response["batchItemFailures"]) == 0, response["errors"]
+                request_milliseconds += response["request_milliseconds"]
+            discord.stop()
+            print(
+                f"{mode:>12} {discord.connections:>12} {percentile(request_milliseconds, 0.5):>8.1f} "
+                f"{percentile(request_milliseconds, 0.95):>8.1f} "
+                f"{sum(request_milliseconds) / len(request_milliseconds):>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 100,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 20
+    )
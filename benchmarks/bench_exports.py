@@ -0,0 +1,112 @@
+# Compares the exports of the calendar sync with the JSON document of index.json: size, encode and decode throughput,
+# and the peak memory of decoding. The JSON document is decoded as a whole, while the exports are read one record at a
+# time from a file.
+#
+# Usage: python benchmarks/bench_exports.py [number of occurrences]
+from os import path, environ
+import tempfile
+import tracemalloc
+import time
+import json
+import sys
+
+from handlers import load_handler
+
+
+def occurrence(i: int) -> dict:
+    return {
+        "uid": f"synthetic-{i % 5000}@google.com",
+        "start": f"2026-{11 + i % 2}-{1 + i % 28:02}T18:00:00+01:00",
+        "end": f"2026-{11 + i % 2}-{1 + i % 28:02}T20:00:00+01:00",
+        "duration": "P0DT2H0M0S",
+        "created": "2023-01-01T00:00:00+00:00",
+        "name": f"Arrangement {i}",
+        "summary": f"Arrangement {i}",
+        "description": f"<p>Velkommen til arrangement nummer {i}!</p><p>{'Lorem ipsum dolor sit amet. ' * (i % 8)}</p>",
+        "location": f"Lokale {i % 20}, Oslo",
+        "rrule": "FREQ=WEEKLY;BYDAY=FR" if i % 10 == 0 else "",
+        "status": "CONFIRMED"
+    }
+
+
+def read_json_document(file) -> int:
+    return len(json.load(file)["events"])
+
+
+def read_ndjson(file) -> int:
+    return sum([1 for line in file if len(json.loads(line)) > 0])
+
+
+def read_msgpack(file) -> int:
+    import msgpack
+    return sum([1 for _ in msgpack.Unpacker(file, raw=False)])
+
+
+def read_cbor(file) -> int:
+    import cbor2
+    decoder = cbor2.CBORDecoder(file)
+    size: int = path.getsize(file.name)
+    count: int = 0
+    while file.tell() < size:
+        decoder.decode()
+        count += 1
+    return count
+
+
+def measure_decode(filename: str, read) -> dict:
+    tracemalloc.start()
+    started: float = time.perf_counter()
+    with open(filename, "rb") as file:
+        count: int = read(file)
+    seconds: float = time.perf_counter() - started
+    peak: int = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"count": count, "seconds": seconds, "peak-bytes": peak}
+
+
+def main(occurrences: int):
+    calendar_sync = load_handler("calendar_sync")
+    environ["ARTIFACT_ENCODINGS"] = ""
+    readers: dict = {"ndjson": read_ndjson, "msgpack": read_msgpack, "cbor": read_cbor}
+    print(f"{occurrences} occurrences")
+    print(f"{'format':>8} {'bytes':>11} {'encode s':>9} {'decode s':>9} {'decode peak MB':>15}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename: str = path.join(directory, "index.json")
+        # Building the records is part of the encode time of every format, as the calendar sync builds them with to_dict
+        started: float = time.perf_counter()
+        records: [dict] = [occurrence(i) for i in range(occurrences)]
+        with open(filename, "wb") as file:
+            file.write(calendar_sync.serialize_json({"events": records}))
+        encode_seconds: float = time.perf_counter() - started
+        del records
+        decoded: dict = measure_decode(filename, read_json_document)
+        print(
+            f"{'json':>8} {path.getsize(filename):>11} {encode_seconds:>9.2f} {decoded['seconds']:>9.2f} "
+            f"{decoded['peak-bytes'] / 1e6:>15.1f}"
+        )
+
+        for extension, read in readers.items():
+            try:
+                encode = calendar_sync.EXPORT_FORMATS[f".{extension}"]["encode"]
+                encode({})
+            except ImportError as error:
+                print(f"{extension:>8} skipped, {error.name} is not installed")
+                continue
+            filename = path.join(directory, f"occurrences.{extension}")
+            started = time.perf_counter()
+            # Written from a generator like the calendar sync does, so only one record exists at a time
+            with open(filename, "wb") as file:
+                for record in (occurrence(i) for i in range(occurrences)):
+                    file.write(encode(record))
+            encode_seconds = time.perf_counter() - started
+            decoded = measure_decode(filename, read)
+            assert decoded["count"] == occurrences
+            print(
+                f"{extension:>8} {path.getsize(filename):>11} {encode_seconds:>9.2f} {decoded['seconds']:>9.2f} "
+                f"{decoded['peak-bytes'] / 1e6:>15.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
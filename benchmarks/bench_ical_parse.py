@@ -0,0 +1,62 @@
+# Compares Calendar.from_ical with the streaming Calendar.from_ical_stream.
+# Each measurement runs in a fresh interpreter, so the peak RSS is not shared between runs.
+#
+# Usage: python benchmarks/bench_ical_parse.py [event counts...]
+from os import path
+import subprocess
+import resource
+import tempfile
+import json
+import time
+import sys
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "calendar_sync"))
+
+CHUNK_SIZE = 64 * 1024
+
+
+def measure(mode: str, filename: str) -> dict:
+    from model.calendar import Calendar
+    from model.ical_stream import decode_chunks
+    baseline_rss: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started: float = time.perf_counter()
+    if mode == "buffered":
+        with open(filename, "rb") as file:
+            calendar = Calendar.from_ical(file.read().decode("utf-8"))
+    else:
+        with open(filename, "rb") as file:
+            calendar = Calendar.from_ical_stream(decode_chunks(iter(lambda: file.read(CHUNK_SIZE), b"")))
+    return {
+        "seconds": time.perf_counter() - started,
+        "baseline_rss_kb": baseline_rss,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "events": len(calendar.events),
+        "occurrences": len(calendar.recurring_events),
+    }
+
+
+def main(sizes: [int]):
+    from synthetic_calendar import generate_ical
+    print(f"{'events':>8} {'mode':>9} {'seconds':>9} {'peak MB':>9} {'delta MB':>9} {'occurrences':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            filename: str = path.join(directory, f"{size}.ics")
+            with open(filename, "w", encoding="utf-8") as file:
+                file.write(generate_ical(size))
+            for mode in ["buffered", "streaming"]:
+                output: str = subprocess.run(
+                    [sys.executable, __file__, "--child", mode, filename],
+                    check=True, capture_output=True, text=True
+                ).stdout
+                result: dict = json.loads(output.strip().splitlines()[-1])
+                print(
+                    f"{size:>8} {mode:>9} {result['seconds']:>9.2f} {result['peak_rss_kb'] / 1024:>9.1f} "
+                    f"{(result['peak_rss_kb'] - result['baseline_rss_kb']) / 1024:>9.1f} {result['occurrences']:>12}"
+                )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        print(json.dumps(measure(sys.argv[2], sys.argv[3])))
+    else:
+        main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000])
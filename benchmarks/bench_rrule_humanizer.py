@@ -0,0 +1,68 @@
+# Measures the RRULE humanizer of discord_notify over a corpus of rules like those of a community calendar: most events
+# repeat one of a handful of weekly and monthly rules, and the rest are rules of their own, e.g. with an UNTIL date.
+# The uncached humanizer, as from_ical was before it was memoized, is compared to from_ical with an empty cache and to
+# humanize_many.
+#
+# Usage: python benchmarks/bench_rrule_humanizer.py [number of rules] [share of unique rules]
+from datetime import date, timedelta
+from os import environ
+import random
+import time
+import sys
+
+from handlers import load_handler
+
+COMMON_RULES = [
+    "FREQ=WEEKLY;BYDAY=MO", "FREQ=WEEKLY;BYDAY=TU", "FREQ=WEEKLY;BYDAY=WE", "FREQ=WEEKLY;BYDAY=TH",
+    "FREQ=WEEKLY;BYDAY=FR", "FREQ=WEEKLY;BYDAY=SA", "FREQ=WEEKLY;BYDAY=SU", "FREQ=WEEKLY;INTERVAL=2;BYDAY=WE",
+    "FREQ=WEEKLY;INTERVAL=2;BYDAY=TH", "FREQ=WEEKLY;WKST=MO;BYDAY=TU,TH", "FREQ=MONTHLY;BYDAY=1FR",
+    "FREQ=MONTHLY;BYDAY=-1SU", "FREQ=MONTHLY;BYDAY=2TU", "FREQ=MONTHLY;BYMONTHDAY=15", "FREQ=MONTHLY;BYMONTHDAY=1",
+    "FREQ=YEARLY;BYMONTH=6;BYMONTHDAY=28", "FREQ=DAILY;COUNT=5", "FREQ=WEEKLY;BYDAY=MO,WE,FR",
+]
+WEEK_DAYS = ["MO", "TU", "WE", "TH", "FR", "SA", "SU"]
+
+
+def generate_rules(count: int, unique_share: float, seed: int = 0) -> [str]:
+    # The common rules are drawn with a long tail, the first ones being the most frequent
+    rand: random.Random = random.Random(seed)
+    weights: [float] = [1 / (rank + 1) for rank in range(len(COMMON_RULES))]
+    rules: [str] = []
+    for i in range(count):
+        if rand.random() < unique_share:
+            until: date = date(2026, 1, 1) + timedelta(days=i)
+            rules.append(
+                f"FREQ=WEEKLY;UNTIL={until.strftime('%Y%m%d')}T225959Z;BYDAY={rand.choice(WEEK_DAYS)}"
+            )
+        else:
+            rules.append(rand.choices(COMMON_RULES, weights)[0])
+    return rules
+
+
+def main(count: int, unique_share: float):
+    environ.setdefault("DISCORD_WEBHOOK_URL", "https://discord.com/api/webhooks/0/benchmark")
+    discord_notify = load_handler("discord_notify")
+    rrule_parser = discord_notify.rrule_parser
+    rules: [str] = generate_rules(count, unique_share)
+    print(f"{count} rules, {len(set(rules))} distinct, cache of {rrule_parser.RRULE_CACHE_SIZE} rules")
+    print(f"{'mode':>14} {'seconds':>9} {'rules/s':>10} {'hits':>7} {'misses':>7}")
+    expected: [str] = [rrule_parser.humanize(rule) for rule in rules]
+    for mode in ["uncached", "from_ical", "humanize_many"]:
+        rrule_parser.from_ical.cache_clear()
+        started: float = time.perf_counter()
+        if mode == "uncached":
+            result: [str] = [rrule_parser.humanize(rule) for rule in rules]
+        elif mode == "from_ical":
+            result = [rrule_parser.from_ical(rule) for rule in rules]
+        else:
+            result = rrule_parser.humanize_many(rules)
+        seconds: float = time.perf_counter() - started
+        assert result == expected
+        cache_info = rrule_parser.from_ical.cache_info()
+        print(f"{mode:>14} {seconds:>9.4f} {count / seconds:>10.0f} {cache_info.hits:>7} {cache_info.misses:>7}")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 10000,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    )
@@ -0,0 +1,96 @@
+# Measures the cold start of each Lambda handler: the time to import the handler module, and the time spent on the
+# first invocation constructing the clients and parsers the handler defers until they are used.
+# Each handler is measured in a fresh interpreter, as a cold Lambda container would be.
+#
+# Usage: python benchmarks/bench_startup.py [repeats]
+from os import path, environ
+import subprocess
+import statistics
+import json
+import time
+import sys
+
+ROOT = path.join(path.dirname(path.abspath(__file__)), "..")
+
+# Modules whose presence after the import phase means something heavy is loaded eagerly again
+HEAVY_MODULES = ["boto3", "botocore", "pandas", "numpy", "requests", "discord_webhook", "html2text"]
+
+
+def first_use_calendar_sync(handler):
+    handler.get_client("s3")
+    handler.get_client("sns")
+    handler.get_client("cloudfront")
+
+
+def first_use_calendar_diff(handler):
+    handler.get_client("sns")
+
+
+def first_use_daily_event(handler):
+    handler.get_client("sns")
+    handler.get_client("s3")
+
+
+def first_use_discord_notify(handler):
+    handler.get_html_parser().handle("<p>Warm up</p>")
+    import requests
+    requests.Request("POST", environ["DISCORD_WEBHOOK_URL"], json={"content": ""}).prepare()
+
+
+first_use = {
+    "calendar_sync": first_use_calendar_sync,
+    "calendar_diff": first_use_calendar_diff,
+    "daily_event": first_use_daily_event,
+    "discord_notify": first_use_discord_notify,
+}
+
+
+def measure(handler_name: str) -> dict:
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, path.join(ROOT, handler_name))
+    started: float = time.perf_counter()
+    import handler
+    imported: float = time.perf_counter()
+    loaded_heavy_modules: [str] = [module for module in HEAVY_MODULES if module in sys.modules]
+    first_use[handler_name](handler)
+    return {
+        "import_ms": (imported - started) * 1000,
+        "first_use_ms": (time.perf_counter() - imported) * 1000,
+        "heavy_modules_at_import": loaded_heavy_modules,
+    }
+
+
+def main(repeats: int):
+    child_environ: dict = dict(
+        environ,
+        AWS_DEFAULT_REGION=environ.get("AWS_DEFAULT_REGION", "eu-north-1"),
+        DISCORD_WEBHOOK_URL="https://discord.com/api/webhooks/0/benchmark",
+    )
+    results: dict = {}
+    print(f"{'handler':>15} {'import ms':>10} {'first use ms':>13}  heavy modules at import")
+    for handler_name in first_use.keys():
+        runs: [dict] = []
+        for _ in range(repeats):
+            output: str = subprocess.run(
+                [sys.executable, __file__, "--child", handler_name],
+                check=True, capture_output=True, text=True, env=child_environ
+            ).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        results[handler_name] = {
+            "import_ms": statistics.median([run["import_ms"] for run in runs]),
+            "first_use_ms": statistics.median([run["first_use_ms"] for run in runs]),
+            "heavy_modules_at_import": runs[-1]["heavy_modules_at_import"],
+        }
+        result: dict = results[handler_name]
+        print(
+            f"{handler_name:>15} {result['import_ms']:>10.1f} {result['first_use_ms']:>13.1f}  "
+            f"{', '.join(result['heavy_modules_at_import']) or '-'}"
+        )
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        print(json.dumps(measure(sys.argv[2])))
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
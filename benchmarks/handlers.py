@@ -0,0 +1,28 @@
+from os import path
+import importlib.util
+import sys
+
+ROOT = path.join(path.dirname(path.abspath(__file__)), "..")
+
+
+def load_handler(name: str):
+    # Every Lambda has a module named handler, so each is loaded under its own name. The Lambda's directory is added
+    # to the path for the modules it imports, e.g. model for calendar_sync and rrule_parser for discord_notify, and the
+    # root of the repository for the packages copied into several Lambdas when they are built, e.g. storage.
+    directory: str = path.join(ROOT, name)
+    for module_path in [ROOT, directory]:
+        if module_path not in sys.path:
+            sys.path.insert(0, module_path)
+    spec = importlib.util.spec_from_file_location(f"{name}_handler", path.join(directory, "handler.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def get_clients() -> dict:
+    # The AWS clients of every handler loaded, by service name. They share the storage package, so a stand-in put here
+    # is used by all of them.
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    from storage.clients import clients
+    return clients
@@ -0,0 +1,312 @@
+# Runs the whole pipeline offline: calendar_sync, calendar_diff, discord_notify and daily_event are wired to the
+# in-process stand-ins of stand_ins.py in place of S3, the FIFO SNS topics and SQS queues, CloudFront, Google Calendar
+# and the Discord webhook, with the topics, queues and event source mappings configured like the CDK stacks.
+#
+# After an initial sync of the calendar, a share of its events are renamed, removed and added, and the time from the
+# edit to each Discord message is measured while the messages flow through the queues. The daily event check is run
+# last, measuring the time from its invocation to the reminders.
+#
+# With --storage-path, the published files are written to a directory through the filesystem backend of storage
+# instead of the S3 stand-in, where they can be inspected after the run.
+#
+# Usage: python benchmarks/local_pipeline.py [--events 50000 | --ical calendar.ics] [--changes 30] [--output run.json]
+#                                           [--storage-path /tmp/events]
+from os import environ, devnull
+import contextlib
+import argparse
+import random
+import time
+import json
+import sys
+
+from handlers import load_handler, get_clients
+from stand_ins import LocalS3, LocalSns, LocalCloudFront, LocalFifoTopic, LocalFifoQueue, LocalEventSource, \
+    LocalCalendar, LocalDiscord
+from synthetic_calendar import generate_ical
+
+
+def unfold(ical_string: str) -> [str]:
+    lines: [str] = []
+    for line in ical_string.splitlines():
+        if line.startswith((" ", "\t")) and len(lines) > 0:
+            lines[-1] += line[1:]
+        elif line != "":
+            lines.append(line)
+    return lines
+
+
+def edit_calendar(ical_string: str, changes: int, seed: int) -> str:
+    # Renames, removes and adds changes events each. Only events without recurrences are edited, so each edit is
+    # exactly one change of one uid.
+    header: [str] = []
+    footer: [str] = []
+    vevents: [[str]] = []
+    current: [str] = None
+    for line in unfold(ical_string):
+        if line == "BEGIN:VEVENT":
+            current = [line]
+        elif current is not None:
+            current.append(line)
+            if line == "END:VEVENT":
+                vevents.append(current)
+                current = None
+        elif len(vevents) == 0:
+            header.append(line)
+        else:
+            footer.append(line)
+
+    single: [int] = [
+        i for i, vevent in enumerate(vevents)
+        if not any([line.startswith(("RRULE", "RECURRENCE-ID")) for line in vevent])
+    ]
+    if len(single) < 2 * changes:
+        raise ValueError(f"The calendar has {len(single)} events without recurrences, {2 * changes} are needed")
+    chosen: [int] = random.Random(seed).sample(single, 2 * changes)
+    renamed, removed = set(chosen[:changes]), set(chosen[changes:])
+
+    edited: [[str]] = []
+    for i, vevent in enumerate(vevents):
+        if i in removed:
+            continue
+        if i in renamed:
+            vevent = [line.replace("SUMMARY:", "SUMMARY:(Endret) ", 1) if line.startswith("SUMMARY") else line
+                      for line in vevent]
+        edited.append(vevent)
+    for i in sorted(removed):
+        edited.append([line.replace("UID:", f"UID:added-{i}-", 1) if line.startswith("UID") else line
+                       for line in vevents[i]])
+    return "\r\n".join(header + [line for vevent in edited for line in vevent] + footer) + "\r\n"
+
+
+def build_pipeline(
+        ical_string: str, aws_latency_seconds: float, discord_latency_seconds: float, discord_rate_limit: int = 0,
+        discord_rate_limit_seconds: float = 2.0
+) -> dict:
+    # Topics and queues as in cdk/calendar_diff_stack.py and cdk/discord_notify_stack.py
+    topics: dict = {
+        name: LocalFifoTopic(name) for name in [
+            "EventsChangedTopic", "NewEventTopic", "UpdatedEventTopic", "DeletedEventTopic", "DailyEventTopic"
+        ]
+    }
+    diff_queue: LocalFifoQueue = LocalFifoQueue("CalendarDiffQueue.fifo")
+    notify_queue: LocalFifoQueue = LocalFifoQueue("DiscordNotifyQueue.fifo", max_receive_count=5)
+    topics["EventsChangedTopic"].subscribe(diff_queue)
+    for name in ["NewEventTopic", "UpdatedEventTopic", "DeletedEventTopic", "DailyEventTopic"]:
+        topics[name].subscribe(notify_queue)
+
+    calendar: LocalCalendar = LocalCalendar(ical_string).start()
+    discord: LocalDiscord = LocalDiscord(
+        discord_latency_seconds, discord_rate_limit, discord_rate_limit_seconds
+    ).start()
+    environ.update(
+        CALENDAR_LINK=calendar.url,
+        BUCKET_NAME="local-events-bucket",
+        DISTRIBUTION_ID="LOCALDISTRIBUTION",
+        EVENTS_CHANGED_TOPIC_ARN=topics["EventsChangedTopic"].arn,
+        NEW_EVENT_TOPIC_ARN=topics["NewEventTopic"].arn,
+        UPDATED_EVENT_TOPIC_ARN=topics["UpdatedEventTopic"].arn,
+        DELETED_EVENT_TOPIC_ARN=topics["DeletedEventTopic"].arn,
+        DAILY_EVENT_TOPIC_ARN=topics["DailyEventTopic"].arn,
+        DISCORD_WEBHOOK_URL=discord.url
+    )
+    environ.setdefault("EVENTS_PER_PAGE", "10")
+
+    s3: LocalS3 = LocalS3(aws_latency_seconds)
+    sns: LocalSns = LocalSns(list(topics.values()), aws_latency_seconds)
+    cloudfront: LocalCloudFront = LocalCloudFront(aws_latency_seconds)
+    functions: dict = {
+        name: load_handler(name) for name in ["calendar_sync", "calendar_diff", "discord_notify", "daily_event"]
+    }
+    get_clients().update(s3=s3, sns=sns, cloudfront=cloudfront)
+
+    # Event source mappings as in the stacks. Messages of a FIFO queue are processed one message group at a time, so
+    # more pollers than groups would only wait.
+    event_sources: [LocalEventSource] = [
+        LocalEventSource(
+            diff_queue, functions["calendar_diff"].handler, batch_size=10, report_batch_item_failures=True
+        ),
+        LocalEventSource(
+            notify_queue, functions["discord_notify"].handler, batch_size=10, report_batch_item_failures=True,
+            concurrency=4
+        ),
+    ]
+    return {
+        "functions": functions,
+        "s3": s3,
+        "sns": sns,
+        "cloudfront": cloudfront,
+        "topics": topics,
+        "queues": [diff_queue, notify_queue],
+        "event_sources": event_sources,
+        "calendar": calendar,
+        "discord": discord,
+    }
+
+
+def wait_for_messages(pipeline: dict, expected_messages: int, timeout_seconds: float) -> bool:
+    # Returns when the expected number of Discord messages has arrived and every queue is empty, or False on timeout
+    deadline: float = time.perf_counter() + timeout_seconds
+    while time.perf_counter() < deadline:
+        with pipeline["discord"].lock:
+            received: int = len(pipeline["discord"].messages)
+        if received >= expected_messages and all([queue.is_idle() for queue in pipeline["queues"]]):
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def percentile(values: [float], share: float) -> float:
+    ordered: [float] = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))] if len(ordered) > 0 else None
+
+
+def measure_messages(pipeline: dict, started: float, first_message: int) -> dict:
+    # Latencies of the Discord messages received since message number first_message, from started
+    with pipeline["discord"].lock:
+        received: [float] = [message["received"] for message in pipeline["discord"].messages[first_message:]]
+    latencies: [float] = [seconds - started for seconds in received]
+    span: float = max(received) - min(received) if len(received) > 1 else 0
+    return {
+        "messages": len(received),
+        "first-message-seconds": min(latencies) if len(latencies) > 0 else None,
+        "p50-message-seconds": percentile(latencies, 0.5),
+        "p95-message-seconds": percentile(latencies, 0.95),
+        "last-message-seconds": max(latencies) if len(latencies) > 0 else None,
+        "messages-per-second": (len(received) - 1) / span if span > 0 else None,
+    }
+
+
+def run(args) -> dict:
+    if args.ical is not None:
+        with open(args.ical, "r", encoding="utf-8") as file:
+            ical_string: str = file.read()
+    else:
+        ical_string = generate_ical(
+            args.events, recurring_share=args.recurring_share, seed=args.seed, rrule_complexity=1,
+            description_size=args.description_size
+        )
+    if args.storage_path is not None:
+        environ["STORAGE_PATH"] = args.storage_path
+    pipeline: dict = build_pipeline(
+        ical_string, args.aws_latency_ms / 1000, args.discord_latency_ms / 1000, args.discord_rate_limit,
+        args.discord_rate_limit_seconds
+    )
+    functions: dict = pipeline["functions"]
+    result: dict = {"calendar-bytes": len(ical_string.encode("utf-8")), "changes": args.changes}
+
+    with open(args.log, "w", encoding="utf-8") as log, contextlib.redirect_stdout(log):
+        for event_source in pipeline["event_sources"]:
+            event_source.start()
+        try:
+            # The first sync publishes the calendar, and has no previous events.json to notify changes against
+            started: float = time.perf_counter()
+            initial: dict = functions["calendar_sync"].handler({}, None)
+            result["initial-sync"] = {"seconds": time.perf_counter() - started, "response": initial["body"]}
+
+            pipeline["calendar"].set_calendar(edit_calendar(ical_string, args.changes, args.seed))
+            started = time.perf_counter()
+            edited: dict = functions["calendar_sync"].handler({}, None)
+            sync_seconds: float = time.perf_counter() - started
+            completed: bool = wait_for_messages(pipeline, 3 * args.changes, args.timeout)
+            result["edit"] = dict(measure_messages(pipeline, started, 0), **{
+                "sync-seconds": sync_seconds,
+                "expected-messages": 3 * args.changes,
+                "completed": completed,
+                "response": edited["body"]
+            })
+
+            messages_before: int = len(pipeline["discord"].messages)
+            started = time.perf_counter()
+            functions["daily_event"].handler({}, None)
+            daily_seconds: float = time.perf_counter() - started
+            published: int = pipeline["topics"]["DailyEventTopic"].published
+            completed = wait_for_messages(pipeline, messages_before + published, args.timeout)
+            result["daily-event"] = dict(measure_messages(pipeline, started, messages_before), **{
+                "handler-seconds": daily_seconds,
+                "expected-messages": published,
+                "completed": completed
+            })
+        finally:
+            for event_source in pipeline["event_sources"]:
+                event_source.stop()
+            pipeline["calendar"].stop()
+            pipeline["discord"].stop()
+
+    result["aws-calls"] = {
+        "s3": pipeline["s3"].calls, "sns": pipeline["sns"].calls, "cloudfront": pipeline["cloudfront"].calls
+    }
+    result["topics"] = {
+        name: {"published": topic.published, "deduplicated": topic.deduplicated}
+        for name, topic in pipeline["topics"].items()
+    }
+    result["queues"] = {
+        queue.name: {"received": queue.received, "deleted": queue.deleted, "dead-letters": len(queue.dead_letters)}
+        for queue in pipeline["queues"]
+    }
+    result["discord"] = {
+        "requests": pipeline["discord"].requests,
+        "rate-limited": pipeline["discord"].rate_limited,
+        "notifications": len(pipeline["discord"].messages)
+    }
+    result["handler-errors"] = [error for source in pipeline["event_sources"] for error in source.errors]
+    return result
+
+
+def print_summary(result: dict):
+    def seconds(value) -> str:
+        return f"{value:.3f}" if value is not None else "-"
+
+    print(f"calendar of {result['calendar-bytes']} bytes, {result['changes']} events renamed, removed and added",
+          file=sys.stderr)
+    print(f"initial sync: {seconds(result['initial-sync']['seconds'])} s", file=sys.stderr)
+    print(f"{'stage':>12} {'trigger s':>10} {'messages':>9} {'first s':>8} {'p50 s':>8} {'p95 s':>8} {'last s':>8} "
+          f"{'messages/s':>11}", file=sys.stderr)
+    for stage, trigger in [("edit", "sync-seconds"), ("daily-event", "handler-seconds")]:
+        measured: dict = result[stage]
+        throughput: str = f"{measured['messages-per-second']:.1f}" \
+            if measured["messages-per-second"] is not None else "-"
+        print(
+            f"{stage:>12} {seconds(measured[trigger]):>10} {measured['messages']:>4}/{measured['expected-messages']:<4} "
+            f"{seconds(measured['first-message-seconds']):>8} {seconds(measured['p50-message-seconds']):>8} "
+            f"{seconds(measured['p95-message-seconds']):>8} {seconds(measured['last-message-seconds']):>8} "
+            f"{throughput:>11}",
+            file=sys.stderr
+        )
+        if not measured["completed"]:
+            print(f"{stage} timed out before all messages were received", file=sys.stderr)
+    print(f"{result['discord']['notifications']} notifications in {result['discord']['requests']} Discord requests, "
+          f"{result['discord']['rate-limited']} of them rate limited", file=sys.stderr)
+    for queue, counts in result["queues"].items():
+        if counts["dead-letters"] > 0:
+            print(f"{queue}: {counts['dead-letters']} messages were moved to the dead-letter queue", file=sys.stderr)
+    for error in result["handler-errors"]:
+        print(f"handler error: {error}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the Lambda functions end to end against local stand-ins")
+    parser.add_argument("--events", type=int, default=5000, help="events of the synthetic calendar")
+    parser.add_argument("--ical", help="iCal file to use instead of a synthetic calendar")
+    parser.add_argument("--changes", type=int, default=10, help="events renamed, removed and added by the edit")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--recurring-share", type=float, default=0.1)
+    parser.add_argument("--description-size", type=int, default=600)
+    parser.add_argument("--aws-latency-ms", type=float, default=0, help="round trip of each S3, SNS and CloudFront call")
+    parser.add_argument("--discord-latency-ms", type=float, default=0, help="round trip of each Discord message")
+    parser.add_argument("--discord-rate-limit", type=int, default=5, help="Discord messages per window, 0 for none")
+    parser.add_argument("--discord-rate-limit-seconds", type=float, default=2.0, help="window of the rate limit")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for the messages of each stage")
+    parser.add_argument("--storage-path", help="directory to publish to instead of the S3 stand-in")
+    parser.add_argument("--log", default=devnull, help="file to write the output of the handlers to")
+    parser.add_argument("--output", help="file to write the results to as JSON")
+    args = parser.parse_args()
+
+    result: dict = run(args)
+    print_summary(result)
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(result, file, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
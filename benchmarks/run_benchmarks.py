@@ -0,0 +1,208 @@
+# Runs a benchmark of every stage of the pipeline over synthetic calendars of growing size, and writes the results as
+# JSON, so runs can be compared as the calendar grows or the code changes. A table is printed to stderr as well.
+#
+# Usage: python benchmarks/run_benchmarks.py [--sizes 100,1000,10000] [--output results.json] [--compare old.json]
+# See --help for the parameters of the synthetic calendar.
+from datetime import datetime
+from os import environ
+import subprocess
+import argparse
+import platform
+import time
+import json
+import sys
+
+from handlers import load_handler, ROOT
+from synthetic_calendar import generate_ical
+
+# Discord messages are rendered for a sample of the events, as each one is rendered the same way
+DISCORD_SAMPLE_SIZE = 200
+# Share of the events added, removed and modified between the old and new events of the diff benchmarks
+CHANGED_SHARE = 0.01
+
+
+def get_git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, check=True, capture_output=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(case: str, events: int, items: int, function, repeat: int, setup=None) -> dict:
+    # setup creates the arguments of each run outside of the measured time, e.g. events without cached fingerprints
+    times: [float] = []
+    for _ in range(repeat):
+        arguments: tuple = setup() if setup is not None else ()
+        started: float = time.perf_counter()
+        function(*arguments)
+        times.append(time.perf_counter() - started)
+    return {
+        "case": case,
+        "events": events,
+        "items": items,
+        "seconds": min(times),
+        "mean-seconds": sum(times) / len(times),
+        "items-per-second": items / min(times) if min(times) > 0 else None,
+    }
+
+
+def changed_events(event_dicts: [dict]) -> [dict]:
+    # Modifies, removes and adds a share of the events, as a sync after an edit of the calendar would see them
+    changed: int = max(1, int(len(event_dicts) * CHANGED_SHARE))
+    modified: [dict] = [dict(event, summary=f"{event['summary']} (endret)") for event in event_dicts[:changed]]
+    added: [dict] = [dict(event, uid=f"added-{i}-{event['uid']}") for i, event in enumerate(event_dicts[:changed])]
+    return modified + event_dicts[changed:len(event_dicts) - changed] + added
+
+
+def run_size(modules: dict, events: int, generator_args: dict, repeat: int) -> [dict]:
+    import icalendar
+    import recurring_ical_events
+    from model.calendar import Calendar, CalendarEvent, get_recurrence_window
+    calendar_sync, calendar_diff, discord_notify = \
+        modules["calendar_sync"], modules["calendar_diff"], modules["discord_notify"]
+
+    ical_string: str = generate_ical(events, **generator_args)
+    calendar: Calendar = Calendar.from_ical(ical_string)
+    parsed: icalendar.Calendar = icalendar.Calendar.from_ical(ical_string)
+    window_start, window_end = get_recurrence_window()
+    occurrences: int = len(calendar.recurring_events)
+    event_dicts: [dict] = [event.to_dict() for event in calendar.events]
+    occurrence_dicts: [dict] = [event.to_dict() for event in calendar.recurring_events]
+    new_event_dicts: [dict] = changed_events(event_dicts)
+    rrules: [str] = [event.rrule for event in calendar.events if event.rrule != ""]
+    sample: [dict] = occurrence_dicts[:DISCORD_SAMPLE_SIZE]
+
+    def render_discord_messages():
+        for event in sample:
+            discord_notify.render_new_event_message({"event": event})
+            discord_notify.render_deleted_event_message({"event": event})
+            discord_notify.render_event_is_tomorrow_message({"event": event})
+            discord_notify.render_updated_event_message({
+                "old_event": event, "new_event": dict(event, summary=f"{event['summary']} (endret)")
+            })
+
+    def paginate_by_bytes() -> dict:
+        environ["PAGE_BYTES"] = "16384"
+        try:
+            return calendar_sync.get_paginated_recurring_events(calendar)
+        finally:
+            del environ["PAGE_BYTES"]
+
+    def parse_old_and_new_events() -> tuple:
+        return [CalendarEvent.from_dict(event) for event in event_dicts], \
+            [CalendarEvent.from_dict(event) for event in new_event_dicts]
+
+    cases: [tuple] = [
+        ("icalendar.from_ical", events, lambda: icalendar.Calendar.from_ical(ical_string)),
+        ("recurring_ical_events.between", occurrences, lambda: [
+            CalendarEvent.from_ical_component(event)
+            for event in recurring_ical_events.of(parsed).between(window_start, window_end)
+        ]),
+        ("Calendar.from_ical", events, lambda: Calendar.from_ical(ical_string)),
+        ("get_paginated_recurring_events", occurrences, lambda: calendar_sync.get_paginated_recurring_events(calendar)),
+        ("get_paginated_recurring_events PAGE_BYTES", occurrences, paginate_by_bytes),
+        ("CalendarEvent.to_dict", occurrences, lambda: [event.to_dict() for event in calendar.recurring_events]),
+        ("CalendarEvent.from_dict", occurrences, lambda: [
+            CalendarEvent.from_dict(event) for event in occurrence_dicts
+        ]),
+        ("calendar_sync.get_change_set", events, calendar_sync.get_change_set, parse_old_and_new_events),
+        ("calendar_diff.get_changes_from_snapshots", events, lambda: calendar_diff.get_changes_from_snapshots({
+            "old_events": event_dicts, "new_events": new_event_dicts
+        })),
+        ("rrule_parser.humanize", len(rrules), lambda: [
+            discord_notify.rrule_parser.humanize(rrule) for rrule in rrules
+        ]),
+        ("rrule_parser.from_ical", len(rrules), lambda: [
+            discord_notify.rrule_parser.from_ical(rrule) for rrule in rrules
+        ]),
+        ("discord_notify.render", len(sample) * 4, render_discord_messages),
+    ]
+    return [measure(case[0], events, case[1], case[2], repeat, *case[3:]) for case in cases]
+
+
+def print_table(results: [dict], baseline: dict):
+    print(
+        f"{'case':>42} {'events':>7} {'items':>7} {'seconds':>9} {'items/s':>11} {'vs baseline':>12}",
+        file=sys.stderr
+    )
+    for result in results:
+        previous: dict = baseline.get((result["case"], result["events"]))
+        ratio: str = f"{result['seconds'] / previous['seconds']:.2f}x" \
+            if previous is not None and previous["seconds"] > 0 else "-"
+        items_per_second: str = f"{result['items-per-second']:.0f}" \
+            if result["items-per-second"] is not None else "-"
+        print(
+            f"{result['case']:>42} {result['events']:>7} {result['items']:>7} {result['seconds']:>9.4f} "
+            f"{items_per_second:>11} {ratio:>12}",
+            file=sys.stderr
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the pipeline over synthetic calendars")
+    parser.add_argument("--sizes", default="100,1000,10000", help="comma separated event counts")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each case, of which the fastest is reported")
+    parser.add_argument("--output", help="file to write the results to, instead of stdout")
+    parser.add_argument("--compare", help="results of a previous run to compare with")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--recurring-share", type=float, default=0.1)
+    parser.add_argument("--rrule-complexity", type=int, default=1, choices=[0, 1, 2])
+    parser.add_argument("--exdate-share", type=float, default=0.2)
+    parser.add_argument("--override-share", type=float, default=0.1)
+    parser.add_argument("--description-size", type=int, default=600, help="approximate characters per description")
+    parser.add_argument("--timezones", default="Europe/Oslo", help="comma separated time zones of the events")
+    parser.add_argument("--all-day-share", type=float, default=0.05)
+    args = parser.parse_args()
+
+    environ.setdefault("CALENDAR_LINK", "https://calendar.google.com/calendar/ical/benchmark/basic.ics")
+    environ.setdefault("EVENTS_PER_PAGE", "10")
+    environ.setdefault("DISCORD_WEBHOOK_URL", "https://discord.com/api/webhooks/0/benchmark")
+    modules: dict = {name: load_handler(name) for name in ["calendar_sync", "calendar_diff", "discord_notify"]}
+
+    # The start is fixed for the whole run, so every size is generated relative to the same day
+    start: datetime = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    generator_args: dict = {
+        "recurring_share": args.recurring_share,
+        "seed": args.seed,
+        "start": start,
+        "rrule_complexity": args.rrule_complexity,
+        "exdate_share": args.exdate_share,
+        "override_share": args.override_share,
+        "description_size": args.description_size,
+        "timezones": args.timezones.split(","),
+        "all_day_share": args.all_day_share,
+    }
+
+    baseline: dict = {}
+    if args.compare is not None:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            baseline = {(result["case"], result["events"]): result for result in json.load(file)["results"]}
+
+    results: [dict] = []
+    for size in [int(size) for size in args.sizes.split(",")]:
+        size_results: [dict] = run_size(modules, size, generator_args, args.repeat)
+        print_table(size_results, baseline)
+        results += size_results
+
+    document: dict = {
+        "metadata": {
+            "created": datetime.now().isoformat(),
+            "git-commit": get_git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+        },
+        "generator": dict(generator_args, start=start.isoformat()),
+        "results": results,
+    }
+    if args.output is None:
+        print(json.dumps(document, indent=2))
+    else:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(document, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,609 @@
+# In-process stand-ins for the services the Lambda functions talk to: S3, FIFO SNS topics, FIFO SQS queues with their
+# Lambda event source mappings, CloudFront, the source calendar and the Discord webhook. They implement the calls the
+# handlers make, with the same request and response shapes and limits as boto3 and the real services, so the real
+# handler functions can be wired together without an AWS account.
+from datetime import datetime, timezone
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import subprocess
+import threading
+import hashlib
+import math
+import ssl
+import gzip
+import json
+import time
+import io
+import uuid
+
+from botocore.exceptions import ClientError
+
+# S3 returns at most 1000 keys per ListObjectsV2 request, and DeleteObjects accepts at most 1000 keys
+MAX_S3_KEYS = 1000
+MAX_SNS_BATCH_SIZE = 10
+MAX_SNS_MESSAGE_BYTES = 256 * 1024
+# SNS FIFO topics drop a message with the same deduplication id as one published within the last 5 minutes
+SNS_DEDUPLICATION_SECONDS = 5 * 60
+# discord_notify packs several notifications into one message, separated by a line holding a zero width space
+NOTIFICATION_SEPARATOR = "\n\u200b\n"
+
+
+def client_error(operation_name: str, code: str, message: str, status_code: int) -> ClientError:
+    return ClientError({
+        "Error": {"Code": code, "Message": message},
+        "ResponseMetadata": {"HTTPStatusCode": status_code}
+    }, operation_name)
+
+
+class ClientEvents:
+    # Stands in for client.meta.events, calling the handlers registered for before-call with the same event name
+
+    def __init__(self, service_name: str):
+        self.service_name: str = service_name
+        self.handlers: list = []
+
+    def register(self, event_name: str, handler):
+        if event_name == "before-call" or event_name.startswith(f"before-call.{self.service_name}"):
+            self.handlers.append(handler)
+
+    def before_call(self, operation_name: str):
+        for handler in self.handlers:
+            handler(event_name=f"before-call.{self.service_name}.{operation_name}", model=None, params={})
+
+
+class ClientMeta:
+
+    def __init__(self, service_name: str):
+        self.events: ClientEvents = ClientEvents(service_name)
+
+
+class LocalClient:
+    # Base of the service stand-ins. Each call waits latency_seconds, as a request to the service would.
+
+    def __init__(self, service_name: str, latency_seconds: float = 0.0):
+        self.meta: ClientMeta = ClientMeta(service_name)
+        self.latency_seconds: float = latency_seconds
+        self.lock = threading.Lock()
+        self.calls: dict = {}
+
+    def call(self, operation_name: str):
+        self.meta.events.before_call(operation_name)
+        with self.lock:
+            self.calls[operation_name] = self.calls.get(operation_name, 0) + 1
+        if self.latency_seconds > 0:
+            time.sleep(self.latency_seconds)
+
+
+class NoSuchKey(ClientError):
+
+    def __init__(self, key: str):
+        super().__init__({
+            "Error": {"Code": "NoSuchKey", "Message": f"The specified key does not exist: {key}"},
+            "ResponseMetadata": {"HTTPStatusCode": 404}
+        }, "GetObject")
+
+
+class LocalS3Exceptions:
+    NoSuchKey = NoSuchKey
+
+
+class LocalS3(LocalClient):
+    # A single bucket held in memory. Bucket names are accepted but not checked.
+    exceptions = LocalS3Exceptions
+
+    def __init__(self, latency_seconds: float = 0.0):
+        super().__init__("s3", latency_seconds)
+        self.objects: dict = {}
+
+    def get_object(self, Bucket: str, Key: str, IfNoneMatch: str = None) -> dict:
+        self.call("GetObject")
+        with self.lock:
+            stored: dict = self.objects.get(Key)
+        if stored is None:
+            raise NoSuchKey(Key)
+        if IfNoneMatch is not None and IfNoneMatch == stored["ETag"]:
+            raise client_error("GetObject", "304", "Not Modified", 304)
+        response: dict = dict(stored, Body=io.BytesIO(stored["Body"]), ContentLength=len(stored["Body"]))
+        return {key: value for key, value in response.items() if value is not None}
+
+    def put_object(
+            self, Bucket: str, Key: str, Body, ContentType: str = None, Metadata: dict = None,
+            ContentEncoding: str = None, CacheControl: str = None
+    ) -> dict:
+        self.call("PutObject")
+        body: bytes = Body if isinstance(Body, bytes) else Body.read()
+        etag: str = f"\"{hashlib.md5(body).hexdigest()}\""
+        with self.lock:
+            self.objects[Key] = {
+                "Body": body,
+                "ETag": etag,
+                "ContentType": ContentType,
+                "ContentEncoding": ContentEncoding,
+                "CacheControl": CacheControl,
+                "Metadata": Metadata or {},
+                "LastModified": datetime.now(timezone.utc)
+            }
+        return {"ETag": etag, "ResponseMetadata": {"HTTPStatusCode": 200}}
+
+    def list_objects_v2(
+            self, Bucket: str, Prefix: str = "", ContinuationToken: str = None, MaxKeys: int = MAX_S3_KEYS
+    ) -> dict:
+        # Keys are listed in order, and the continuation token is the last key of the previous page
+        self.call("ListObjectsV2")
+        with self.lock:
+            keys: [str] = sorted([
+                key for key in self.objects.keys()
+                if key.startswith(Prefix) and (ContinuationToken is None or key > ContinuationToken)
+            ])
+            page: [str] = keys[:min(MaxKeys, MAX_S3_KEYS)]
+            contents: [dict] = [{
+                "Key": key,
+                "ETag": self.objects[key]["ETag"],
+                "Size": len(self.objects[key]["Body"]),
+                "LastModified": self.objects[key]["LastModified"]
+            } for key in page]
+        response: dict = {"KeyCount": len(contents), "IsTruncated": len(keys) > len(page), "Prefix": Prefix}
+        if len(contents) > 0:
+            response["Contents"] = contents
+        if response["IsTruncated"]:
+            response["NextContinuationToken"] = page[-1]
+        return response
+
+    def delete_objects(self, Bucket: str, Delete: dict) -> dict:
+        self.call("DeleteObjects")
+        if len(Delete["Objects"]) > MAX_S3_KEYS:
+            raise client_error(
+                "DeleteObjects", "MalformedXML", f"At most {MAX_S3_KEYS} keys may be deleted at once", 400
+            )
+        with self.lock:
+            for deleted in Delete["Objects"]:
+                self.objects.pop(deleted["Key"], None)
+        return {"Deleted": [{"Key": deleted["Key"]} for deleted in Delete["Objects"]]}
+
+
+class LocalFifoQueue:
+    # A FIFO queue: messages of a message group are received in order, and not before the previously received messages
+    # of the group are deleted. Messages received max_receive_count times without being deleted are moved to the
+    # dead-letter queue.
+
+    def __init__(self, name: str, max_receive_count: int = 2):
+        self.name: str = name
+        self.max_receive_count: int = max_receive_count
+        self.condition = threading.Condition()
+        self.messages: [dict] = []
+        self.in_flight_groups: dict = {}
+        self.dead_letters: [dict] = []
+        self.sequence_number: int = 0
+        self.received: int = 0
+        self.deleted: int = 0
+
+    def send_message(self, body: str, message_group_id: str, message_deduplication_id: str):
+        with self.condition:
+            self.sequence_number += 1
+            self.messages.append({
+                "messageId": str(uuid.uuid4()),
+                "receiptHandle": str(uuid.uuid4()),
+                "body": body,
+                "attributes": {
+                    "ApproximateReceiveCount": "0",
+                    "SentTimestamp": str(int(time.time() * 1000)),
+                    "SequenceNumber": str(self.sequence_number).zfill(20),
+                    "MessageGroupId": message_group_id,
+                    "MessageDeduplicationId": message_deduplication_id
+                },
+                "messageAttributes": {},
+                "eventSource": "aws:sqs",
+                "eventSourceARN": f"arn:aws:sqs:local:000000000000:{self.name}",
+                "sent": time.perf_counter()
+            })
+            self.condition.notify_all()
+
+    def receive_messages(self, max_messages: int) -> [dict]:
+        # Returns the first messages of the groups without messages in flight, or an empty list if there are none
+        with self.condition:
+            batch: [dict] = []
+            batch_groups: set = set()
+            for message in self.messages:
+                group: str = message["attributes"]["MessageGroupId"]
+                if group in self.in_flight_groups and group not in batch_groups:
+                    continue
+                batch.append(message)
+                batch_groups.add(group)
+                if len(batch) >= max_messages:
+                    break
+            for message in batch:
+                self.messages.remove(message)
+                group = message["attributes"]["MessageGroupId"]
+                self.in_flight_groups[group] = self.in_flight_groups.get(group, 0) + 1
+                message["attributes"]["ApproximateReceiveCount"] = \
+                    str(int(message["attributes"]["ApproximateReceiveCount"]) + 1)
+            self.received += len(batch)
+            return batch
+
+    def complete(self, batch: [dict], failed_message_ids: set):
+        # Deletes the processed messages, and returns the failed ones to the front of the queue in their order
+        with self.condition:
+            returned: [dict] = []
+            for message in batch:
+                group: str = message["attributes"]["MessageGroupId"]
+                self.in_flight_groups[group] -= 1
+                if self.in_flight_groups[group] == 0:
+                    del self.in_flight_groups[group]
+                if message["messageId"] not in failed_message_ids:
+                    self.deleted += 1
+                elif int(message["attributes"]["ApproximateReceiveCount"]) >= self.max_receive_count:
+                    self.dead_letters.append(message)
+                else:
+                    returned.append(message)
+            self.messages = returned + self.messages
+            self.condition.notify_all()
+
+    def is_idle(self) -> bool:
+        with self.condition:
+            return len(self.messages) == 0 and len(self.in_flight_groups) == 0
+
+
+class LocalFifoTopic:
+    # A FIFO topic delivering each message to its subscribed queues wrapped in an SNS notification, as without raw
+    # message delivery
+
+    def __init__(self, name: str, content_based_deduplication: bool = True):
+        self.name: str = name
+        self.arn: str = f"arn:aws:sns:local:000000000000:{name}"
+        self.content_based_deduplication: bool = content_based_deduplication
+        self.subscriptions: [LocalFifoQueue] = []
+        self.deduplication_ids: dict = {}
+        self.published: int = 0
+        self.deduplicated: int = 0
+
+    def subscribe(self, queue: LocalFifoQueue):
+        self.subscriptions.append(queue)
+
+    def publish(self, operation_name: str, message: str, message_group_id: str, message_deduplication_id: str) -> str:
+        if message_group_id is None:
+            raise client_error(operation_name, "InvalidParameter", "MessageGroupId is required for FIFO topics", 400)
+        if len(message.encode("utf-8")) > MAX_SNS_MESSAGE_BYTES:
+            raise client_error(operation_name, "InvalidParameter", "Message too long", 400)
+        if message_deduplication_id is None:
+            if not self.content_based_deduplication:
+                raise client_error(
+                    operation_name, "InvalidParameter", "MessageDeduplicationId is required for this topic", 400
+                )
+            message_deduplication_id = hashlib.sha256(message.encode("utf-8")).hexdigest()
+
+        message_id: str = str(uuid.uuid4())
+        now: float = time.monotonic()
+        previous: float = self.deduplication_ids.get(message_deduplication_id)
+        if previous is not None and now - previous < SNS_DEDUPLICATION_SECONDS:
+            # Accepted, but not delivered again
+            self.deduplicated += 1
+            return message_id
+        self.deduplication_ids[message_deduplication_id] = now
+        self.published += 1
+        notification: str = json.dumps({
+            "Type": "Notification",
+            "MessageId": message_id,
+            "SequenceNumber": str(self.published).zfill(20),
+            "TopicArn": self.arn,
+            "Message": message,
+            "Timestamp": datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z"),
+            "UnsubscribeURL": f"https://sns.local/?Action=Unsubscribe&TopicArn={self.arn}"
+        })
+        for queue in self.subscriptions:
+            queue.send_message(notification, message_group_id, message_deduplication_id)
+        return message_id
+
+
+class LocalSns(LocalClient):
+
+    def __init__(self, topics: [LocalFifoTopic], latency_seconds: float = 0.0):
+        super().__init__("sns", latency_seconds)
+        self.topics: dict = {topic.arn: topic for topic in topics}
+
+    def get_topic(self, operation_name: str, topic_arn: str) -> LocalFifoTopic:
+        if topic_arn not in self.topics:
+            raise client_error(operation_name, "NotFound", f"Topic does not exist: {topic_arn}", 404)
+        return self.topics[topic_arn]
+
+    def publish(
+            self, TopicArn: str, Message: str, MessageGroupId: str = None, MessageDeduplicationId: str = None
+    ) -> dict:
+        self.call("Publish")
+        topic: LocalFifoTopic = self.get_topic("Publish", TopicArn)
+        # Messages of one topic are published in the order they are received, as the topic orders them
+        with self.lock:
+            return {"MessageId": topic.publish("Publish", Message, MessageGroupId, MessageDeduplicationId)}
+
+    def publish_batch(self, TopicArn: str, PublishBatchRequestEntries: [dict]) -> dict:
+        self.call("PublishBatch")
+        topic: LocalFifoTopic = self.get_topic("PublishBatch", TopicArn)
+        if len(PublishBatchRequestEntries) > MAX_SNS_BATCH_SIZE:
+            raise client_error("PublishBatch", "TooManyEntriesInBatchRequest", "Too many entries", 400)
+        if sum([len(entry["Message"].encode("utf-8")) for entry in PublishBatchRequestEntries]) \
+                > MAX_SNS_MESSAGE_BYTES:
+            raise client_error("PublishBatch", "BatchRequestTooLong", "Batch request too long", 400)
+        with self.lock:
+            return {"Successful": [{
+                "Id": entry["Id"],
+                "MessageId": topic.publish(
+                    "PublishBatch", entry["Message"], entry.get("MessageGroupId"),
+                    entry.get("MessageDeduplicationId")
+                )
+            } for entry in PublishBatchRequestEntries], "Failed": []}
+
+
+class LocalCloudFront(LocalClient):
+
+    def __init__(self, latency_seconds: float = 0.0):
+        super().__init__("cloudfront", latency_seconds)
+        self.invalidations: [dict] = []
+
+    def create_invalidation(self, DistributionId: str, InvalidationBatch: dict) -> dict:
+        self.call("CreateInvalidation")
+        if InvalidationBatch["Paths"]["Quantity"] != len(InvalidationBatch["Paths"]["Items"]):
+            raise client_error("CreateInvalidation", "InconsistentQuantities", "Quantity does not match Items", 400)
+        invalidation_id: str = str(uuid.uuid4())
+        with self.lock:
+            self.invalidations.append({"Id": invalidation_id, "Paths": InvalidationBatch["Paths"]["Items"]})
+        return {"Invalidation": {"Id": invalidation_id, "Status": "InProgress", "InvalidationBatch": InvalidationBatch}}
+
+
+class LocalEventSource:
+    # Polls a queue and invokes a handler with batches of records on a pool of threads, like a Lambda event source
+    # mapping. A batch fails as a whole when the handler raises, and only the reported items fail when
+    # report_batch_item_failures is set.
+
+    def __init__(
+            self, queue: LocalFifoQueue, function, batch_size: int, report_batch_item_failures: bool = False,
+            concurrency: int = 1
+    ):
+        self.queue: LocalFifoQueue = queue
+        self.function = function
+        self.batch_size: int = batch_size
+        self.report_batch_item_failures: bool = report_batch_item_failures
+        self.concurrency: int = concurrency
+        self.stopped: bool = False
+        self.threads: [threading.Thread] = []
+        self.invocations: int = 0
+        self.errors: [str] = []
+
+    def invoke(self, batch: [dict]) -> set:
+        # Returns the ids of the failed messages
+        records: [dict] = [{key: value for key, value in message.items() if key != "sent"} for message in batch]
+        try:
+            response = self.function({"Records": records}, None)
+        except Exception as error:
+            self.errors.append(repr(error))
+            return set([message["messageId"] for message in batch])
+        if self.report_batch_item_failures and isinstance(response, dict):
+            return set([failure["itemIdentifier"] for failure in response.get("batchItemFailures", [])])
+        return set()
+
+    def poll(self):
+        while True:
+            with self.queue.condition:
+                batch: [dict] = self.queue.receive_messages(self.batch_size)
+                while len(batch) == 0:
+                    if self.stopped:
+                        return
+                    self.queue.condition.wait(0.05)
+                    batch = self.queue.receive_messages(self.batch_size)
+                self.invocations += 1
+            self.queue.complete(batch, self.invoke(batch))
+
+    def start(self):
+        self.threads = [threading.Thread(target=self.poll, daemon=True) for _ in range(self.concurrency)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.stopped = True
+        with self.queue.condition:
+            self.queue.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+
+
+def create_self_signed_context(directory: str) -> (ssl.SSLContext, str):
+    # Returns a server context with a new certificate for 127.0.0.1, and the path of the certificate for clients to
+    # trust, e.g. as REQUESTS_CA_BUNDLE
+    certificate_path: str = f"{directory}/certificate.pem"
+    key_path: str = f"{directory}/key.pem"
+    subprocess.run([
+        "openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1", "-nodes", "-days", "1",
+        "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1", "-keyout", key_path, "-out",
+        certificate_path
+    ], check=True, capture_output=True)
+    context: ssl.SSLContext = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certificate_path, key_path)
+    return context, certificate_path
+
+
+class LocalHttpServer:
+    # Serves a request handler class on a free port of localhost from a background thread, over HTTPS when given an
+    # SSL context, e.g. of create_self_signed_context
+
+    def __init__(self, request_handler, ssl_context: ssl.SSLContext = None):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), request_handler)
+        self.server.daemon_threads = True
+        self.server.stand_in = self
+        # The TLS handshake is made by the thread of each connection rather than when the connection is accepted
+        self.scheme: str = "http"
+        if ssl_context is not None:
+            self.server.socket = ssl_context.wrap_socket(
+                self.server.socket, server_side=True, do_handshake_on_connect=False
+            )
+            self.scheme = "https"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"{self.scheme}://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class CalendarRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        calendar: LocalCalendar = self.server.stand_in
+        with calendar.lock:
+            body, etag, last_modified = calendar.body, calendar.etag, calendar.last_modified
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        encoded: bool = "gzip" in self.headers.get("Accept-Encoding", "")
+        if encoded:
+            body = gzip.compress(body, mtime=0)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/calendar; charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        if encoded:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args):
+        pass
+
+
+class LocalCalendar(LocalHttpServer):
+    # Serves an iCal document like Google Calendar does, with an ETag and gzip encoding
+
+    def __init__(self, ical_string: str):
+        super().__init__(CalendarRequestHandler)
+        self.lock = threading.Lock()
+        self.set_calendar(ical_string)
+
+    @property
+    def url(self) -> str:
+        return f"{super().url}/calendar/ical/local/basic.ics"
+
+    def set_calendar(self, ical_string: str):
+        body: bytes = ical_string.encode("utf-8")
+        with self.lock:
+            self.body = body
+            self.etag = f"\"{hashlib.md5(body).hexdigest()}\""
+            self.last_modified = formatdate(usegmt=True)
+
+
+class DiscordRequestHandler(BaseHTTPRequestHandler):
+    # Keeps connections alive like Discord does
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        discord: LocalDiscord = self.server.stand_in
+        if isinstance(self.request, ssl.SSLSocket):
+            self.request.do_handshake()
+        if discord.connect_latency_seconds > 0:
+            time.sleep(discord.connect_latency_seconds)
+        with discord.lock:
+            discord.connections += 1
+        super().setup()
+
+    def do_POST(self):
+        discord: LocalDiscord = self.server.stand_in
+        received: float = time.perf_counter()
+        payload: dict = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        retry_after, rate_limit_headers = discord.take_request(received)
+        if retry_after > 0:
+            body: bytes = json.dumps({
+                "message": "You are being rate limited.", "retry_after": round(retry_after, 3), "global": False
+            }).encode("utf-8")
+            self.send_response(429)
+            self.send_header("Retry-After", str(math.ceil(retry_after)))
+            self.send_rate_limit_headers(rate_limit_headers)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if discord.latency_seconds > 0:
+            time.sleep(discord.latency_seconds)
+        message_id: str = str(uuid.uuid4().int >> 64)
+        with discord.lock:
+            discord.messages += [
+                {"received": received, "content": content}
+                for content in payload.get("content", "").split(NOTIFICATION_SEPARATOR)
+            ]
+        # Without wait, Discord responds before the message is created, with no content
+        if parse_qs(urlparse(self.path).query).get("wait", ["false"])[0].lower() not in ["true", "1"]:
+            self.send_response(204)
+            self.send_rate_limit_headers(rate_limit_headers)
+            self.end_headers()
+            return
+        body = json.dumps({"id": message_id, "content": payload.get("content", "")}).encode("utf-8")
+        self.send_response(200)
+        self.send_rate_limit_headers(rate_limit_headers)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_rate_limit_headers(self, headers: dict):
+        for name, value in headers.items():
+            self.send_header(name, value)
+
+    def log_message(self, format: str, *args):
+        pass
+
+
+class LocalDiscord(LocalHttpServer):
+    # Accepts messages posted to a webhook, and records when each notification was received. With a rate limit, at most
+    # rate_limit messages are accepted in each window of rate_limit_seconds, and the others are answered with 429 like
+    # Discord does, with the X-RateLimit headers on every response.
+
+    def __init__(
+            self, latency_seconds: float = 0.0, rate_limit: int = 0, rate_limit_seconds: float = 2.0,
+            ssl_context: ssl.SSLContext = None, connect_latency_seconds: float = 0.0
+    ):
+        super().__init__(DiscordRequestHandler, ssl_context)
+        self.latency_seconds: float = latency_seconds
+        # Added to each new connection, as the round trips of the TCP and TLS handshakes over a network
+        self.connect_latency_seconds: float = connect_latency_seconds
+        self.connections: int = 0
+        self.rate_limit: int = rate_limit
+        self.rate_limit_seconds: float = rate_limit_seconds
+        self.lock = threading.Lock()
+        self.messages: [dict] = []
+        self.requests: int = 0
+        self.rate_limited: int = 0
+        self.window_reset: float = 0.0
+        self.window_requests: int = 0
+
+    def take_request(self, now: float) -> (float, dict):
+        # Returns the seconds to retry after, which is 0 when the message is accepted, and the rate limit headers
+        with self.lock:
+            self.requests += 1
+            if self.rate_limit == 0:
+                return 0, {}
+            if now >= self.window_reset:
+                self.window_reset = now + self.rate_limit_seconds
+                self.window_requests = 0
+            reset_after: float = self.window_reset - now
+            accepted: bool = self.window_requests < self.rate_limit
+            if accepted:
+                self.window_requests += 1
+            else:
+                self.rate_limited += 1
+            return 0 if accepted else reset_after, {
+                "X-RateLimit-Limit": str(self.rate_limit),
+                "X-RateLimit-Remaining": str(self.rate_limit - self.window_requests),
+                "X-RateLimit-Reset-After": f"{reset_after:.3f}",
+                "X-RateLimit-Bucket": "local"
+            }
+
+    @property
+    def url(self) -> str:
+        return f"{super().url}/api/webhooks/0/local"
@@ -0,0 +1,145 @@
+from datetime import datetime, timedelta
+import random
+
+WEEKDAYS = ["MO", "TU", "WE", "TH", "FR", "SA", "SU"]
+
+WORDS = [
+    "velkommen", "til", "kveld", "med", "quiz", "musikk", "og", "god", "stemning", "alle", "er", "hjertelig",
+    "inviterte", "vi", "møtes", "på", "huset", "ta", "gjerne", "med", "venner", "gratis", "inngang", "brettspill",
+    "film", "samtale", "workshop", "for", "nye", "medlemmer", "tilgjengelig", "rullestol", "alkoholfritt",
+    "arrangement",
+]
+
+
+def fold(line: str) -> [str]:
+    # Fold content lines at 75 octets as Google Calendar does (RFC 5545 section 3.1)
+    folded: [str] = []
+    encoded: bytes = line.encode("utf-8")
+    while len(encoded) > 75:
+        cut: int = 75 if not folded else 74
+        while cut > 0 and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        folded.append(encoded[:cut].decode("utf-8"))
+        encoded = encoded[cut:]
+    folded.append(encoded.decode("utf-8"))
+    return [folded[0]] + [f" {part}" for part in folded[1:]]
+
+
+def format_time(value: datetime, timezone: str, all_day: bool) -> str:
+    # Returns the parameters and value of a DTSTART, DTEND, EXDATE or RECURRENCE-ID property
+    if all_day:
+        return f";VALUE=DATE:{value.strftime('%Y%m%d')}"
+    if timezone == "UTC":
+        return f":{value.strftime('%Y%m%dT%H%M%SZ')}"
+    return f";TZID={timezone}:{value.strftime('%Y%m%dT%H%M%S')}"
+
+
+def get_rrule(rand: random.Random, complexity: int, event_start: datetime, all_day: bool) -> str:
+    # complexity 0 is a plain weekly rule, 1 adds intervals, counts, end dates and monthly rules, and 2 adds rules with
+    # several weekdays, positions in the month and yearly rules
+    weekday: str = WEEKDAYS[event_start.weekday()]
+    until: datetime = event_start + timedelta(days=rand.choice([30, 60, 90, 180]))
+    until_value: str = until.strftime("%Y%m%d") if all_day else until.strftime("%Y%m%dT%H%M%SZ")
+    rules: [str] = [f"FREQ=WEEKLY;BYDAY={weekday}"]
+    if complexity >= 1:
+        rules += [
+            f"FREQ=WEEKLY;INTERVAL=2;BYDAY={weekday}",
+            "FREQ=DAILY;COUNT=5",
+            f"FREQ=WEEKLY;BYDAY={weekday};UNTIL={until_value}",
+            f"FREQ=MONTHLY;BYMONTHDAY={event_start.day}",
+        ]
+    if complexity >= 2:
+        rules += [
+            f"FREQ=MONTHLY;BYDAY=-1{weekday}",
+            f"FREQ=MONTHLY;BYDAY=1{weekday},3{weekday}",
+            "FREQ=WEEKLY;BYDAY=MO,WE,FR;COUNT=20",
+            f"FREQ=YEARLY;BYMONTH={event_start.month};BYMONTHDAY={event_start.day}",
+            f"FREQ=DAILY;INTERVAL=3;UNTIL={until_value}",
+        ]
+    return rand.choice(rules)
+
+
+def get_description(rand: random.Random, i: int, size: int) -> str:
+    paragraphs: [str] = [f"<p>Velkommen til arrangement nummer {i}!</p>"]
+    length: int = len(paragraphs[0])
+    while length < size:
+        words: [str] = [rand.choice(WORDS) for _ in range(rand.randrange(8, 30))]
+        paragraph: str = f"<p>{' '.join(words).capitalize()}.</p>"
+        paragraphs.append(paragraph)
+        length += len(paragraph)
+    return "".join(paragraphs)
+
+
+def generate_ical(
+        events: int, recurring_share: float = 0.1, seed: int = 0, start: datetime = None,
+        rrule_complexity: int = 0, exdate_share: float = 0.0, override_share: float = 0.0,
+        description_size: int = None, timezones: [str] = None, all_day_share: float = 0.0
+) -> str:
+    # The calendar is fully determined by the arguments. start defaults to today, so the events fall in the window of
+    # the calendar sync, and must be given explicitly to get the same calendar on another day.
+    # The tunables draw from their own random generator, so the defaults generate the same calendar as before they
+    # were added.
+    rand: random.Random = random.Random(seed)
+    tunables_rand: random.Random = random.Random(f"{seed}:tunables")
+    timezones = timezones or ["Europe/Oslo"]
+    start = start or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    lines: [str] = [
+        "BEGIN:VCALENDAR",
+        "PRODID:-//Google Inc//Google Calendar 70.9054//EN",
+        "VERSION:2.0",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        "X-WR-CALNAME:Synthetic calendar",
+        f"X-WR-TIMEZONE:{timezones[0]}",
+        "X-WR-CALDESC:Generated for benchmarks",
+    ]
+    for i in range(events):
+        event_start: datetime = start + timedelta(days=rand.randrange(-30, 120), hours=rand.randrange(10, 21))
+        event_end: datetime = event_start + timedelta(minutes=rand.choice([60, 90, 120, 180]))
+        timezone: str = timezones[0] if len(timezones) == 1 else tunables_rand.choice(timezones)
+        all_day: bool = all_day_share > 0 and tunables_rand.random() < all_day_share
+        if all_day:
+            event_start = event_start.replace(hour=0)
+            event_end = event_start + timedelta(days=1)
+        description: str = f"<p>Velkommen til arrangement nummer {i}!</p>" \
+                           f"<p>{' '.join(['Lorem ipsum dolor sit amet.'] * rand.randrange(1, 20))}</p>"
+        if description_size is not None:
+            description = get_description(tunables_rand, i, description_size)
+        event_lines: [str] = [
+            f"DTSTART{format_time(event_start, timezone, all_day)}",
+            f"DTEND{format_time(event_end, timezone, all_day)}",
+            "DTSTAMP:20230101T000000Z",
+            f"UID:synthetic-{seed}-{i}@google.com",
+            "CREATED:20230101T000000Z",
+            f"DESCRIPTION:{description}",
+            f"LOCATION:Lokale {rand.randrange(20)}\\, Oslo",
+            f"SUMMARY:Arrangement {i}",
+            "STATUS:CONFIRMED",
+        ]
+        lines += ["BEGIN:VEVENT"] + event_lines
+        if rand.random() < recurring_share:
+            rrule: str = f"FREQ=WEEKLY;BYDAY={WEEKDAYS[event_start.weekday()]}"
+            if rrule_complexity > 0:
+                rrule = get_rrule(tunables_rand, rrule_complexity, event_start, all_day)
+            lines.append(f"RRULE:{rrule}")
+            if exdate_share > 0 and tunables_rand.random() < exdate_share:
+                for week in sorted(tunables_rand.sample(range(1, 8), tunables_rand.randrange(1, 4))):
+                    lines.append(f"EXDATE{format_time(event_start + timedelta(weeks=week), timezone, all_day)}")
+            lines.append("END:VEVENT")
+            if override_share > 0 and tunables_rand.random() < override_share:
+                # Moves the occurrence of the second week an hour later, or a day for all day events, and renames it
+                recurrence_id: datetime = event_start + timedelta(weeks=2)
+                moved: timedelta = timedelta(days=1) if all_day else timedelta(hours=1)
+                lines += ["BEGIN:VEVENT"] + [
+                    line.replace(f"Arrangement {i}", f"Arrangement {i} (flyttet)")
+                    for line in event_lines if not line.startswith(("DTSTART", "DTEND"))
+                ] + [
+                    f"DTSTART{format_time(recurrence_id + moved, timezone, all_day)}",
+                    f"DTEND{format_time(recurrence_id + moved + (event_end - event_start), timezone, all_day)}",
+                    f"RECURRENCE-ID{format_time(recurrence_id, timezone, all_day)}",
+                    "END:VEVENT",
+                ]
+            continue
+        lines.append("END:VEVENT")
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(folded for line in lines for folded in fold(line)) + "\r\n"
@@ -1,6 +1,14 @@
 import os
+import shutil
 
-def build_lambda(path: str):
+def copy_shared_packages(path: str, packages: [str]):
+    # Docker only sees the directory of the function, so packages shared by several functions are copied into it
+    for package in packages:
+        shutil.rmtree(os.path.join(path, package), ignore_errors=True)
+        shutil.copytree(package, os.path.join(path, package), ignore=shutil.ignore_patterns("__pycache__"))
+
+def build_lambda(path: str, shared_packages: [str] = None):
     print(f"Starting build: {path}")
+    copy_shared_packages(path, shared_packages or [])
     os.system(f"source build_utils/build.sh && build {path}")
     return
\ No newline at end of file
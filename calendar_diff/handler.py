@@ -1,8 +1,12 @@
+from concurrent.futures import ThreadPoolExecutor
 import json
-import boto3
 from os import environ
+from storage.clients import get_client
 
-client = boto3.client('sns')
+# The maximum number of entries in an SNS PublishBatch request
+MAX_PUBLISH_BATCH_SIZE = 10
+# A modified event is only notified when one of these fields has changed
+NOTIFIED_FIELDS = ["start", "end", "summary", "description", "location", "rrule"]
 
 
 def events_list_to_dict(events_list: [dict]) -> dict:
@@ -12,82 +16,141 @@ def events_list_to_dict(events_list: [dict]) -> dict:
     return result
 
 
-def notify_new_event(calendar_event):
-    print(f"Notifying new event: {calendar_event['uid']}")
-    return client.publish(
-        TopicArn=environ["NEW_EVENT_TOPIC_ARN"],
-        Message=str(json.dumps({
+def new_event_notification(calendar_event: dict) -> dict:
+    return {
+        "topic": "NEW_EVENT_TOPIC_ARN",
+        "uid": calendar_event["uid"],
+        "message": {
             "event": calendar_event
-        }, ensure_ascii=False)),
-        MessageGroupId="new_calendar_event"
-    )
+        },
+        "message_group_id": "new_calendar_event"
+    }
 
 
-def notify_deleted_event(calendar_event):
-    print(f"Notifying deleted event: {calendar_event['uid']}")
-    return client.publish(
-        TopicArn=environ["DELETED_EVENT_TOPIC_ARN"],
-        Message=str(json.dumps({
+def deleted_event_notification(calendar_event: dict) -> dict:
+    return {
+        "topic": "DELETED_EVENT_TOPIC_ARN",
+        "uid": calendar_event["uid"],
+        "message": {
             "event": calendar_event
-        }, ensure_ascii=False)),
-        MessageGroupId="deleted_calendar_event"
-    )
+        },
+        "message_group_id": "deleted_calendar_event"
+    }
 
 
-def notify_updated_event(old_event, new_event):
-    print(f"Notifying updated event: {old_event['uid']}")
-    return client.publish(
-        TopicArn=environ["UPDATED_EVENT_TOPIC_ARN"],
-        Message=str(json.dumps({
+def updated_event_notification(old_event: dict, new_event: dict) -> dict:
+    return {
+        "topic": "UPDATED_EVENT_TOPIC_ARN",
+        "uid": old_event["uid"],
+        "message": {
             "old_event": old_event,
             "new_event": new_event
-        }, ensure_ascii=False)),
-        MessageGroupId="updated_calendar_event"
-    )
+        },
+        "message_group_id": "updated_calendar_event"
+    }
+
+
+def publish_to_topic(topic: str, notifications: [dict]):
+    # Batches are published one after another, so the order of the notifications is kept within each message group
+    for batch_start in range(0, len(notifications), MAX_PUBLISH_BATCH_SIZE):
+        batch: [dict] = notifications[batch_start:batch_start + MAX_PUBLISH_BATCH_SIZE]
+        print(f"Publishing {len(batch)} notifications to {topic}: {', '.join([n['uid'] for n in batch])}")
+        res = get_client("sns").publish_batch(
+            TopicArn=environ[topic],
+            PublishBatchRequestEntries=[{
+                "Id": str(i),
+                "Message": str(json.dumps(notification["message"], ensure_ascii=False)),
+                "MessageGroupId": notification["message_group_id"]
+            } for i, notification in enumerate(batch)]
+        )
+        if len(res.get("Failed", [])) > 0:
+            raise Exception(f"Failed to publish {len(res['Failed'])} notifications to {topic}: {res['Failed']}")
+
+
+def publish_notifications(notifications: [dict]):
+    notifications_by_topic: dict = {}
+    for notification in notifications:
+        notifications_by_topic.setdefault(notification["topic"], []).append(notification)
+
+    # The topics are independent of each other, so they are published to concurrently
+    with ThreadPoolExecutor(max_workers=max(1, len(notifications_by_topic))) as executor:
+        futures: list = [
+            executor.submit(publish_to_topic, topic, topic_notifications)
+            for topic, topic_notifications in notifications_by_topic.items()
+        ]
+    for future in futures:
+        future.result()
 
 
 def is_equal(old_event: dict, new_event: dict) -> bool:
-    for key in ["start", "end", "summary", "description", "location", "rrule"]:
+    for key in NOTIFIED_FIELDS:
         if old_event[key] != new_event[key]:
             return False
     return True
 
 
-def handler(event, _):
-    event_body: dict = json.loads(event['Records'][0]['body'])
-    message: dict = json.loads(event_body['Message'])
+def is_notified_change(changed: dict) -> bool:
+    # calendar_sync names the changed fields of each modified event. The modified events of old snapshot messages do
+    # not have them, so their fields are compared.
+    if "changed-fields" in changed:
+        return any([field in NOTIFIED_FIELDS for field in changed["changed-fields"]])
+    return not is_equal(changed["old"], changed["new"])
+
+
+def get_changes_from_snapshots(message: dict) -> dict:
+    # Messages containing every old and new event, as published by calendar_sync before it computed the changes itself
     old_events: dict = events_list_to_dict(message['old_events'])
     new_events: dict = events_list_to_dict(message['new_events'])
+    return {
+        "added": [new_events[uid] for uid in new_events.keys() if uid not in old_events],
+        "removed": [old_events[uid] for uid in old_events.keys() if uid not in new_events],
+        "modified": [
+            {"old": old_events[uid], "new": new_events[uid]} for uid in new_events.keys() if uid in old_events
+        ]
+    }
 
+
+def get_changes(message: dict) -> dict:
+    if 'old_events' in message:
+        return get_changes_from_snapshots(message)
+    return message
+
+
+def process_record(record: dict, response: dict):
+    event_body: dict = json.loads(record['body'])
+    message: dict = json.loads(event_body['Message'])
+    changes: dict = get_changes(message)
+
+    modified: list = [changed for changed in changes["modified"] if is_notified_change(changed)]
+    publish_notifications(
+        [new_event_notification(new_event) for new_event in changes["added"]]
+        + [updated_event_notification(changed["old"], changed["new"]) for changed in modified]
+        + [deleted_event_notification(deleted_event) for deleted_event in changes["removed"]]
+    )
+
+    response["new_events"] = response["new_events"] + [new_event["uid"] for new_event in changes["added"]]
+    response["updated_events"] = response["updated_events"] + [changed["new"]["uid"] for changed in modified]
+    response["deleted_events"] = response["deleted_events"] + [event["uid"] for event in changes["removed"]]
+
+
+def handler(event, _):
     response = {
         "new_events": [],
         "updated_events": [],
         "deleted_events": [],
-        "errors": []
+        "errors": [],
+        "batchItemFailures": []
     }
 
-    for event_uid in new_events.keys():
+    records: [dict] = event['Records']
+    for i in range(len(records)):
         try:
-            if event_uid not in old_events:
-                notify_new_event(new_events[event_uid])
-                response["new_events"] = response["new_events"] + [event_uid]
-            elif not is_equal(old_events[event_uid], new_events[event_uid]):
-                notify_updated_event(old_events[event_uid], new_events[event_uid])
-                response["updated_events"] = response["updated_events"] + [event_uid]
+            process_record(records[i], response)
         except Exception as error:
-            response['errors'] = response['errors'] + [error]
-
-    for event_uid in old_events.keys():
-        if event_uid not in new_events:
-            try:
-                notify_deleted_event(old_events[event_uid])
-                response["deleted_events"] = response["deleted_events"] + [event_uid]
-            except Exception as error:
-                response['errors'] = response['errors'] + [error]
+            # The queue is FIFO, so the records after a failed one must not be processed before it is retried
+            response['errors'] = response['errors'] + [str(error)]
+            response['batchItemFailures'] = [{"itemIdentifier": record["messageId"]} for record in records[i:]]
+            break
 
     print(response)
-
-    if len(response['errors']) > 0:
-        raise Exception("\n".join(response['errors']))
-
     return response
@@ -0,0 +1,115 @@
+# Behaviour of the batches and the failed records of calendar_diff, against a fake SNS client.
+#
+# Usage: python -m pytest calendar_diff
+from os import path
+import importlib.util
+import json
+import sys
+import threading
+
+# As when the function is built, the storage package is found next to the handler
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), ".."))
+
+import pytest
+
+import storage.clients
+
+# Every Lambda has a module named handler, so calendar_diff is loaded under its own name
+spec = importlib.util.spec_from_file_location(
+    "calendar_diff_handler", path.join(path.dirname(path.abspath(__file__)), "handler.py")
+)
+handler = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(handler)
+
+
+class FakeSns:
+    # Records each batch published, and fails the entries of events whose summary is "Failing"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.batches: [(str, [dict])] = []
+
+    def publish_batch(self, TopicArn: str, PublishBatchRequestEntries: [dict]) -> dict:
+        with self.lock:
+            self.batches.append((TopicArn, PublishBatchRequestEntries))
+        return {"Failed": [
+            {"Id": entry["Id"], "Code": "InternalError"} for entry in PublishBatchRequestEntries
+            if "\"Failing\"" in entry["Message"]
+        ]}
+
+    def published_uids(self) -> [str]:
+        return [
+            uid for _, entries in self.batches for entry in entries
+            for uid in [json.loads(entry["Message"]).get("event", {}).get("uid")] if uid is not None
+        ]
+
+
+@pytest.fixture()
+def sns(monkeypatch) -> FakeSns:
+    monkeypatch.setenv("NEW_EVENT_TOPIC_ARN", "new")
+    monkeypatch.setenv("UPDATED_EVENT_TOPIC_ARN", "updated")
+    monkeypatch.setenv("DELETED_EVENT_TOPIC_ARN", "deleted")
+    sns: FakeSns = FakeSns()
+    monkeypatch.setitem(storage.clients.clients, "sns", sns)
+    return sns
+
+
+def create_event(uid: str, summary: str = None) -> dict:
+    return {
+        "uid": uid, "start": "2026-01-05T18:00:00", "end": "2026-01-05T20:00:00", "summary": summary or f"Event {uid}",
+        "description": "", "location": "", "rrule": ""
+    }
+
+
+def create_record(message_id: str, added: [dict], removed: [dict] = None, modified: [dict] = None) -> dict:
+    message: dict = {"added": added, "removed": removed or [], "modified": modified or []}
+    return {"messageId": message_id, "body": json.dumps({"Message": json.dumps(message)})}
+
+
+def test_failed_record_fails_the_records_after_it(sns: FakeSns):
+    records: [dict] = [
+        create_record("0", [create_event("a")]),
+        create_record("1", [create_event("b"), create_event("c", "Failing")]),
+        create_record("2", [create_event("d")]),
+        create_record("3", [create_event("e")]),
+    ]
+    response: dict = handler.handler({"Records": records}, None)
+
+    # The queue is FIFO, so the records after the failed one are failed without being processed
+    assert response["batchItemFailures"] == [{"itemIdentifier": message_id} for message_id in ["1", "2", "3"]]
+    assert response["new_events"] == ["a"]
+    assert len(response["errors"]) == 1
+    assert sns.published_uids() == ["a", "b", "c"]
+
+
+def test_unreadable_record_fails_the_records_after_it(sns: FakeSns):
+    records: [dict] = [
+        create_record("0", [create_event("a")]),
+        {"messageId": "1", "body": "not json"},
+        create_record("2", [create_event("b")]),
+    ]
+    response: dict = handler.handler({"Records": records}, None)
+    assert response["batchItemFailures"] == [{"itemIdentifier": "1"}, {"itemIdentifier": "2"}]
+    assert sns.published_uids() == ["a"]
+
+
+def test_notifications_are_batched_in_order(sns: FakeSns):
+    added: [dict] = [create_event(f"added-{i:0>2}") for i in range(23)]
+    unchanged: dict = create_event("unchanged")
+    records: [dict] = [create_record("0", added, [create_event("removed")], [
+        {"old": create_event("renamed"), "new": create_event("renamed", "Renamed"), "changed-fields": ["summary"]},
+        {"old": unchanged, "new": dict(unchanged, status="CANCELLED"), "changed-fields": ["status"]},
+    ])]
+    response: dict = handler.handler({"Records": records}, None)
+
+    assert response["batchItemFailures"] == []
+    assert response["updated_events"] == ["renamed"]
+    batches: dict = {}
+    for topic, entries in sns.batches:
+        batches.setdefault(topic, []).append(entries)
+    assert [len(entries) for entries in batches["new"]] == [10, 10, 3]
+    assert [
+        json.loads(entry["Message"])["event"]["uid"] for entries in batches["new"] for entry in entries
+    ] == [event["uid"] for event in added]
+    assert set([entry["MessageGroupId"] for entries in batches["new"] for entry in entries]) == {"new_calendar_event"}
+    assert len(batches["updated"]) == 1 and len(batches["deleted"]) == 1
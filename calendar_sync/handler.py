@@ -1,219 +1,1422 @@
-from model.calendar import Calendar, CalendarEvent
-from datetime import datetime, timezone
+from model.calendar import Calendar, CalendarEvent, get_recurrence_window, get_sort_key
+from model.expansion import RecurrenceExpander
+from model.ical_stream import decode_chunks
+from metrics import Metrics
+from storage.object_store import ObjectStore, NoSuchKey, NotModified, decode_body, open_object_store
+import storage.clients as aws_clients
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from fnmatch import fnmatch
+from urllib.error import HTTPError
 import urllib.request as request
-from os import environ
-import boto3
+from os import environ, path, replace
+import hashlib
 import json
+import gzip
 import math
+import tempfile
+import threading
+import time
+import unicodedata
+import re
+import zlib
 
-s3_client = boto3.client('s3')
 fetch_time = None
+# The last events.json read or written by this container, reused by warm invocations while its ETag is unchanged
+snapshot: dict = None
+# Metrics of the current invocation. Disabled outside of the handler, e.g. when the functions are benchmarked.
+metrics: Metrics = Metrics(False)
 
+# Files only read by the sync itself, which the distribution does not serve
+PRIVATE_PREFIX = "private/"
+SYNC_STATE_FILENAME = f"{PRIVATE_PREFIX}sync-state.json"
+MONTHS_MANIFEST_FILENAME = "months/manifest.json"
+PAGES_MANIFEST_FILENAME = "pages/manifest.json"
+LOCATIONS_INDEX_FILENAME = "indexes/locations.json"
+UIDS_INDEX_FILENAME = "indexes/uids.json"
+EXPANSION_CACHE_FILENAME = f"{PRIVATE_PREFIX}expansion-cache.json"
+ROOT_MANIFEST_FILENAME = "manifest.json"
+VERSION_MANIFEST_FILENAME = "version.json"
+# Objects in the versioned layout are stored under a key derived from their content, so they are never overwritten
+VERSIONED_PREFIX = "objects/"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+PUBLISH_LAYOUTS = ["paths", "versioned", "both"]
+PAGINATION_MODES = ["offset", "keyset"]
+MAX_INVALIDATION_PATHS = 15
+# SNS messages may be up to 256 KiB, leaving some room for the message envelope
+MAX_CHANGE_SET_MESSAGE_BYTES = 240 * 1024
+# The files are served with the encoding they are stored with, whatever the Accept-Encoding of the request, so only
+# gzip is supported, which browsers and common HTTP libraries decode
+ARTIFACT_ENCODINGS = ["identity", "gzip"]
+SNAPSHOT_CACHE_MODES = ["memory", "tmp", "off"]
+CHANGE_SET_FIELDS = ["start", "end", "created", "summary", "description", "location", "rrule", "status"]
+# Letters which NFKD does not decompose into an ASCII letter and a combining mark
+LOCATION_TRANSLITERATIONS: dict = str.maketrans({
+    "æ": "ae", "ø": "o", "å": "a", "đ": "d", "ł": "l", "þ": "th", "œ": "oe"
+})
+# Settings which change the published files of the same calendar, so the sync is not skipped when one of them changes
+PUBLISH_SETTINGS = [
+    "PUBLISH_LAYOUT", "PAGINATION", "EVENTS_PER_PAGE", "PAGE_BYTES", "PAGE_MIN_EVENTS", "ARTIFACT_ENCODINGS", "EXPORTS",
+    "MINIFY_JSON"
+]
 
-def fetch_ical_string() -> str:
-    calendar_link = environ["CALENDAR_LINK"]
+
+def get_client(service_name: str):
+    # Enough connections for the concurrent requests of the sync, and each call is counted in the metrics
+    return aws_clients.get_client(service_name, max(10, get_concurrency()), count_api_call)
+
+
+def count_api_call(event_name: str, **kwargs):
+    # Registered on every client, counting the calls of each operation, e.g. before-call.s3.PutObject as PutObjectCalls
+    service_name, operation_name = event_name.split(".")[1:3]
+    metrics.add(f"{operation_name}Calls", 1)
+    if service_name == "s3":
+        metrics.add("S3Calls", 1)
+
+
+def get_metrics() -> Metrics:
+    return Metrics(
+        environ.get("METRICS", str(False)) == str(True),
+        dimensions={"FunctionName": environ.get("AWS_LAMBDA_FUNCTION_NAME", "calendar-sync")}
+    )
+
+
+def get_storage() -> ObjectStore:
+    return open_object_store(lambda: get_client("s3"), metrics)
+
+
+def get_concurrency() -> int:
+    concurrency: int = int(environ.get("SYNC_CONCURRENCY", 8))
+    if concurrency < 1:
+        raise ValueError("SYNC_CONCURRENCY must be a positive integer")
+    return concurrency
+
+
+def get_publish_layout() -> str:
+    # "paths" overwrites each file at its own path. "versioned" writes each file once under a key derived from its
+    # content, and swaps manifest.json to point at the keys of the new version. "both" does both, while clients move
+    # over to manifest.json.
+    layout: str = environ.get("PUBLISH_LAYOUT", "paths")
+    if layout not in PUBLISH_LAYOUTS:
+        raise ValueError(f"PUBLISH_LAYOUT must be one of: {', '.join(PUBLISH_LAYOUTS)}")
+    return layout
+
+
+def get_version_retention() -> timedelta:
+    # Must be longer than manifest.json is cached, so clients holding an old manifest can still read its files
+    return timedelta(hours=float(environ.get("VERSION_RETENTION_HOURS", 24)))
+
+
+def get_pagination_mode() -> str:
+    # "offset" numbers the pages from the first event, "keyset" keeps the boundaries of the pages between syncs
+    mode: str = environ.get("PAGINATION", "offset")
+    if mode not in PAGINATION_MODES:
+        raise ValueError(f"PAGINATION must be one of: {', '.join(PAGINATION_MODES)}")
+    return mode
+
+
+def get_sync_state() -> dict:
+    try:
+        return json.loads(get_storage().read(SYNC_STATE_FILENAME))
+    except NoSuchKey:
+        print(f"{SYNC_STATE_FILENAME} was not found. Fetching calendar unconditionally.")
+        return {}
+
+
+def get_expansion_cache():
+    if environ.get("EXPANSION_CACHE", str(True)) != str(True):
+        return None
+    try:
+        return json.loads(get_storage().read(EXPANSION_CACHE_FILENAME))
+    except NoSuchKey:
+        print(f"{EXPANSION_CACHE_FILENAME} was not found. Expanding all recurring events.")
+        return None
+
+
+def get_recurrence_expander(expansion_cache: dict):
+    if environ.get("EXPANSION_CACHE", str(True)) != str(True):
+        return None
+    return RecurrenceExpander(*get_recurrence_window(), expansion_cache)
+
+
+def get_lazy_expander():
+    # Returns a function building the expander on its first call, so the expansion cache is only read once a calendar
+    # has to be parsed. Calendars parsed concurrently wait for the same expander.
+    lock = threading.Lock()
+    expanders: list = []
+
+    def get_expander() -> RecurrenceExpander:
+        with lock:
+            if len(expanders) == 0:
+                expanders.append(get_recurrence_expander(get_expansion_cache()))
+            return expanders[0]
+    return get_expander
+
+
+def get_calendar_sources() -> [dict]:
+    # CALENDAR_LINK is a comma separated list of calendars, each optionally named as name=link. A calendar without a
+    # name is named by its X-WR-CALNAME when several calendars are merged.
+    sources: [dict] = []
+    for source in environ["CALENDAR_LINK"].split(","):
+        name, link = "", source.strip()
+        if link == "":
+            continue
+        if "=" in link and "://" not in link.split("=", 1)[0]:
+            name, link = [part.strip() for part in link.split("=", 1)]
+        sources.append({"name": name, "url": link})
+    if len(sources) == 0:
+        raise ValueError("CALENDAR_LINK must contain at least one link")
+    if len(set([source["url"] for source in sources])) != len(sources):
+        raise ValueError("CALENDAR_LINK contains the same link more than once")
+    return sources
+
+
+def get_source_url() -> str:
+    return ",".join([source["url"] for source in get_calendar_sources()])
+
+
+def window_is_current(sync_state: dict) -> bool:
+    # The recurring events window starts at midnight of the day of the sync, so a snapshot published on an earlier day
+    # is stale even if the source calendar is unchanged
+    return sync_state.get("published-date") == datetime.now().date().isoformat()
+
+
+def get_settings_hash() -> str:
+    return hashlib.sha256(bytes(
+        json.dumps({name: environ.get(name) for name in PUBLISH_SETTINGS}, sort_keys=True), "utf-8"
+    )).hexdigest()
+
+
+def settings_are_current(sync_state: dict) -> bool:
+    # The files were published with the same settings, e.g. not with another page size or encoding
+    return sync_state.get("settings-hash") == get_settings_hash()
+
+
+def open_ical(calendar_link: str, source_state: dict):
+    # Returns None when the server responds with 304 Not Modified
     print(f"Fetching ical at {calendar_link}")
     global fetch_time
     fetch_time = str(datetime.now(timezone.utc).isoformat())
-    with request.urlopen(url=calendar_link, timeout=10) as response:
-        body = response.read().decode('utf-8')
-    return body
 
+    headers: dict = {"Accept-Encoding": "gzip"}
+    if source_state.get("etag"):
+        headers["If-None-Match"] = source_state["etag"]
+    if source_state.get("last-modified"):
+        headers["If-Modified-Since"] = source_state["last-modified"]
 
-def get_paginated_recurring_events(calendar: Calendar) -> dict:
+    try:
+        return request.urlopen(request.Request(url=calendar_link, headers=headers), timeout=10)
+    except HTTPError as error:
+        if error.code != 304:
+            raise
+        print(f"Calendar was not modified since the last sync: {calendar_link}")
+        return None
+
+
+def get_source_state(response, content_hash: str) -> dict:
+    return {
+        "etag": response.headers.get("ETag"),
+        "last-modified": response.headers.get("Last-Modified"),
+        "content-hash": content_hash
+    }
+
+
+def fetch_ical_string(calendar_link: str, source_state: dict) -> dict:
+    response = open_ical(calendar_link, source_state)
+    if response is None:
+        return {"body": None, "modified": False, "source-state": source_state}
+
+    with response:
+        raw_body: bytes = response.read()
+    metrics.add("DownloadBytes", len(raw_body), "Bytes")
+    if response.headers.get("Content-Encoding", "") == "gzip":
+        raw_body = gzip.decompress(raw_body)
+    metrics.add("CalendarBytes", len(raw_body), "Bytes")
+    content_hash: str = hashlib.sha256(raw_body).hexdigest()
+
+    return {
+        "body": raw_body.decode('utf-8'),
+        "modified": content_hash != source_state.get("content-hash"),
+        "source-state": get_source_state(response, content_hash)
+    }
+
+
+def fetch_ical_stream(calendar_link: str, source_state: dict, get_expander=None) -> dict:
+    # Parses the calendar while it is being downloaded, so the whole body is never held in memory
+    response = open_ical(calendar_link, source_state)
+    if response is None:
+        return {"calendar": None, "modified": False, "source-state": source_state}
+
+    chunk_size: int = int(environ.get("ICAL_STREAM_CHUNK_SIZE", 64 * 1024))
+    content_hash = hashlib.sha256()
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) \
+        if response.headers.get("Content-Encoding", "") == "gzip" else None
+
+    def read_chunks():
+        while True:
+            chunk: bytes = response.read(chunk_size)
+            if not chunk:
+                break
+            metrics.add("DownloadBytes", len(chunk), "Bytes")
+            if decompressor is not None:
+                chunk = decompressor.decompress(chunk)
+            metrics.add("CalendarBytes", len(chunk), "Bytes")
+            content_hash.update(chunk)
+            yield chunk
+        if decompressor is not None:
+            tail: bytes = decompressor.flush()
+            metrics.add("CalendarBytes", len(tail), "Bytes")
+            content_hash.update(tail)
+            yield tail
+
+    with response:
+        calendar: Calendar = Calendar.from_ical_stream(
+            decode_chunks(read_chunks()), get_expander() if get_expander is not None else None
+        )
+
+    return {
+        "calendar": calendar,
+        "modified": content_hash.hexdigest() != source_state.get("content-hash"),
+        "source-state": get_source_state(response, content_hash.hexdigest())
+    }
+
+
+def parse_ical(ical_string: str, expander: RecurrenceExpander) -> Calendar:
+    parse_started: float = time.perf_counter()
+    calendar: Calendar = Calendar.from_ical(ical_string, expander)
+    metrics.add_seconds("Parse", time.perf_counter() - parse_started - calendar.expansion_seconds)
+    metrics.add_seconds("Expansion", calendar.expansion_seconds)
+    return calendar
+
+
+def fetch_source(source: dict, source_state: dict, streaming: bool, get_expander) -> dict:
+    # Downloads a calendar, and parses it if it was modified since the last sync. An unmodified calendar is only parsed
+    # by get_source_calendar when another calendar was modified. get_expander is only called to parse a calendar.
+    download_started: float = time.perf_counter()
+    if streaming:
+        fetch_result: dict = fetch_ical_stream(source["url"], source_state, get_expander)
+    else:
+        fetch_result = fetch_ical_string(source["url"], source_state)
+    download_seconds: float = time.perf_counter() - download_started
+    if streaming and fetch_result["calendar"] is not None:
+        # The calendar is parsed and expanded while it is downloaded, so the download includes the parsing, but not the
+        # expansion which is timed by itself
+        download_seconds -= fetch_result["calendar"].expansion_seconds
+        metrics.add_seconds("Expansion", fetch_result["calendar"].expansion_seconds)
+    metrics.add_seconds("Download", download_seconds)
+
+    if not streaming:
+        fetch_result["calendar"] = parse_ical(fetch_result["body"], get_expander()) \
+            if fetch_result["modified"] else None
+    return dict(fetch_result, source=source)
+
+
+def get_source_calendar(fetch_result: dict, streaming: bool, get_expander) -> Calendar:
+    if fetch_result["calendar"] is not None:
+        return fetch_result["calendar"]
+    if fetch_result.get("body") is not None:
+        return parse_ical(fetch_result["body"], get_expander())
+    # The server responded 304 Not Modified, so the calendar is downloaded again without validators
+    return fetch_source(fetch_result["source"], {}, streaming, get_expander)["calendar"]
+
+
+def merge_sources(fetch_results: [dict], calendars: [Calendar]) -> Calendar:
+    if len(calendars) == 1:
+        return calendars[0]
+    return Calendar.merge(calendars, [
+        fetch_result["source"]["name"] or calendar.name for fetch_result, calendar in zip(fetch_results, calendars)
+    ])
+
+
+def get_page_budget() -> dict:
+    # Pages hold at most EVENTS_PER_PAGE events. When PAGE_BYTES is set, pages are also filled up to that many
+    # serialized bytes, but hold at least PAGE_MIN_EVENTS events whatever their size.
     per_page: int = int(environ['EVENTS_PER_PAGE'])
-    if per_page < 0 or type(per_page) != int:
+    if per_page < 1:
         raise ValueError("per_page must be a positive integer")
+    page_bytes: int = int(environ.get("PAGE_BYTES", "0"))
+    if page_bytes < 0:
+        raise ValueError("PAGE_BYTES must be zero or a positive integer")
+    min_events: int = int(environ.get("PAGE_MIN_EVENTS", "1"))
+    if min_events < 1 or min_events > per_page:
+        raise ValueError("PAGE_MIN_EVENTS must be between 1 and EVENTS_PER_PAGE")
+    return {"max-events": per_page, "min-events": min_events, "bytes": page_bytes}
+
+
+def get_event_sizes(event_dicts: [dict], budget: dict) -> [int]:
+    # Only measured for a byte budget, counting the separator between the events of a page
+    if budget["bytes"] == 0:
+        return [0] * len(event_dicts)
+    return [len(serialize_json(event_dict)) + 2 for event_dict in event_dicts]
+
+
+def get_events_budget(budget: dict, page_header: dict) -> dict:
+    # The bytes left for the events once the fields of the page are serialized
+    if budget["bytes"] == 0:
+        return budget
+    header_bytes: int = len(serialize_json(dict(page_header, events=[])))
+    return dict(budget, bytes=max(1, budget["bytes"] - header_bytes))
 
-    result: dict = {}
-    total_pages: int = math.ceil(len(calendar.recurring_events) / per_page)
 
-    for page_number in range(total_pages):
-        events_in_page = [event.to_dict() for event in calendar.recurring_events[
-                                                       page_number * per_page: min((page_number + 1) * per_page,
-                                                                                   len(calendar.recurring_events))
-                                                       ]]
+def get_page_bounds(sizes: [int], budget: dict) -> [(int, int)]:
+    # Fills each page in order until the next event would exceed the budget, returning the start and end of each page
+    bounds: [(int, int)] = []
+    start: int = 0
+    page_bytes: int = 0
+    for i, size in enumerate(sizes):
+        events_in_page: int = i - start
+        if events_in_page >= budget["max-events"] or (
+                events_in_page >= budget["min-events"] and budget["bytes"] > 0 and page_bytes + size > budget["bytes"]
+        ):
+            bounds.append((start, i))
+            start, page_bytes = i, 0
+        page_bytes += size
+    if start < len(sizes):
+        bounds.append((start, len(sizes)))
+    return bounds
+
+
+def get_paginated_recurring_events(calendar: Calendar) -> dict:
+    budget: dict = get_page_budget()
+    event_dicts: [dict] = [event.to_dict() for event in calendar.recurring_events]
+    # The fields of a page at their widest, so the bytes left for the events are not overestimated
+    page_header: dict = {
+        "source-url": get_source_url(),
+        "last-updated": fetch_time,
+        "events-in-page": budget["max-events"],
+        "total-events": len(event_dicts),
+        "page": len(event_dicts),
+        "total-pages": len(event_dicts),
+        "per-page": budget["max-events"],
+        "has-more": False
+    }
+    bounds: [(int, int)] = get_page_bounds(
+        get_event_sizes(event_dicts, budget), get_events_budget(budget, page_header)
+    )
+
+    result: dict = {}
+    total_pages: int = len(bounds)
+    for page_number, (start, end) in enumerate(bounds):
         result[page_number] = {
-            "source-url": environ['CALENDAR_LINK'],
+            "source-url": get_source_url(),
             "last-updated": fetch_time,
-            "events-in-page": len(events_in_page),
-            "total-events": len(calendar.recurring_events),
+            "events-in-page": end - start,
+            "total-events": len(event_dicts),
             "page": page_number,
             "total-pages": total_pages,
-            "per-page": per_page,
+            "per-page": budget["max-events"],
             "has-more": page_number + 1 < total_pages,
-            "events": events_in_page
+            "events": event_dicts[start:end]
+        }
+    return result
+
+
+def get_page_id(anchor: list) -> str:
+    # Named by the boundary of the page rather than its position, so pages before it can split and merge without
+    # renaming it
+    return hashlib.sha256(bytes(f"{anchor[0]!r}:{anchor[1]}", "utf-8")).hexdigest()[:16]
+
+
+def is_underfull(events_in_page: int, page_bytes: int, budget: dict) -> bool:
+    return events_in_page < budget["max-events"] / 2 and (budget["bytes"] == 0 or page_bytes < budget["bytes"] / 2)
+
+
+def get_keyset_pages(events: [CalendarEvent], sizes: [int], anchors: [list], budget: dict) -> [dict]:
+    # Returns the pages in order as {"anchor", "start", "end"}, where the anchor is the sort key the page starts at and
+    # the events of the page are events[start:end]. The events are assigned to the pages of the previous sync by their
+    # sort key, empty pages are dropped, the pages over the budget are split evenly, and the pages filled less than half
+    # are merged with the page before them when both fit in one. An edit of the calendar thereby only changes the
+    # pages around the edited events.
+    if len(events) == 0:
+        return []
+    if len(anchors) == 0:
+        return [
+            {"anchor": list(get_sort_key(events[start])), "start": start, "end": end}
+            for start, end in get_page_bounds(sizes, budget)
+        ]
+
+    assigned: [dict] = [{"anchor": anchor, "start": 0, "end": 0} for anchor in anchors]
+    page_index: int = 0
+    for i, event in enumerate(events):
+        key: list = list(get_sort_key(event))
+        while page_index + 1 < len(assigned) and key >= assigned[page_index + 1]["anchor"]:
+            page_index += 1
+            assigned[page_index]["start"] = i
+        assigned[page_index]["end"] = i + 1
+
+    split: [dict] = []
+    for page in [page for page in assigned if page["end"] > page["start"]]:
+        page_sizes: [int] = sizes[page["start"]:page["end"]]
+        pieces: int = len(get_page_bounds(page_sizes, budget))
+        even_budget: dict = {
+            "max-events": math.ceil(len(page_sizes) / pieces),
+            "min-events": budget["min-events"],
+            "bytes": math.ceil(sum(page_sizes) / pieces) if budget["bytes"] > 0 else 0
+        }
+        for i, (start, end) in enumerate(get_page_bounds(page_sizes, even_budget)):
+            split.append({
+                "anchor": page["anchor"] if i == 0 else list(get_sort_key(events[page["start"] + start])),
+                "start": page["start"] + start,
+                "end": page["start"] + end
+            })
+
+    merged: [dict] = []
+    for page in split:
+        if len(merged) > 0:
+            previous: dict = merged[-1]
+            previous_bytes: int = sum(sizes[previous["start"]:previous["end"]])
+            page_bytes: int = sum(sizes[page["start"]:page["end"]])
+            fits: bool = page["end"] - previous["start"] <= budget["max-events"] \
+                and (budget["bytes"] == 0 or previous_bytes + page_bytes <= budget["bytes"])
+            if fits and (is_underfull(previous["end"] - previous["start"], previous_bytes, budget)
+                         or is_underfull(page["end"] - page["start"], page_bytes, budget)):
+                previous["end"] = page["end"]
+                continue
+        merged.append(page)
+    return merged
+
+
+def get_keyset_paginated_recurring_events(calendar: Calendar, anchors: [list]) -> (dict, [list]):
+    # Returns the pages by id along with their anchors, to be kept for the next sync. Pages hold no totals and link
+    # their neighbours by id, so a page is only rewritten when its own events or neighbours change.
+    budget: dict = get_page_budget()
+    event_dicts: [dict] = [event.to_dict() for event in calendar.recurring_events]
+    page_header: dict = {
+        "source-url": get_source_url(),
+        "last-updated": fetch_time,
+        "events-in-page": budget["max-events"],
+        "page": get_page_id(["", ""]),
+        "per-page": budget["max-events"],
+        "prev": get_page_id(["", ""]),
+        "next": get_page_id(["", ""])
+    }
+    pages: [dict] = get_keyset_pages(
+        calendar.recurring_events, get_event_sizes(event_dicts, budget), anchors,
+        get_events_budget(budget, page_header)
+    )
+    page_ids: [str] = [get_page_id(page["anchor"]) for page in pages]
+    result: dict = {}
+    for i, page in enumerate(pages):
+        result[page_ids[i]] = {
+            "source-url": get_source_url(),
+            "last-updated": fetch_time,
+            "events-in-page": page["end"] - page["start"],
+            "page": page_ids[i],
+            "per-page": budget["max-events"],
+            "prev": page_ids[i - 1] if i > 0 else None,
+            "next": page_ids[i + 1] if i + 1 < len(pages) else None,
+            "events": event_dicts[page["start"]:page["end"]]
         }
+    return result, [page["anchor"] for page in pages]
+
+
+def get_pages_manifest(paginated: dict, total_events: int) -> dict:
+    return {
+        "source-url": get_source_url(),
+        "last-updated": fetch_time,
+        "total-events": total_events,
+        "total-pages": len(paginated.keys()),
+        "pages": [{
+            "page": page_id,
+            "file": f"pages/{page_id}.json",
+            "events-in-page": page["events-in-page"],
+            "first-start": page["events"][0]["start"]
+        } for page_id, page in paginated.items()]
+    }
+
+
+def get_event_day(event: CalendarEvent) -> str:
+    return (event.start.date() if isinstance(event.start, datetime) else event.start).isoformat()
+
+
+def get_monthly_recurring_events(calendar: Calendar) -> dict:
+    # Events are sharded by the month and day they start in, so a client only fetches the months it shows
+    result: dict = {}
+    for event in calendar.recurring_events:
+        day: str = get_event_day(event)
+        month: dict = result.setdefault(day[:7], {
+            "source-url": get_source_url(),
+            "last-updated": fetch_time,
+            "month": day[:7],
+            "total-events": 0,
+            "days": {}
+        })
+        month["days"].setdefault(day, []).append(event.to_dict())
+        month["total-events"] += 1
+    return result
+
+
+def get_months_manifest(monthly: dict, content_hashes: dict) -> dict:
+    return {
+        "source-url": get_source_url(),
+        "last-updated": fetch_time,
+        "total-months": len(monthly.keys()),
+        "months": [{
+            "month": month,
+            "file": f"months/{month}.json",
+            "total-events": monthly[month]["total-events"],
+            "content-hash": content_hashes[month]
+        } for month in sorted(monthly.keys())]
+    }
+
+
+def normalize_location(location: str) -> str:
+    # Different spellings of a venue, e.g. with other casing, accents or punctuation, share the same key. Only an empty
+    # location has no key.
+    folded: str = unicodedata.normalize("NFKC", location).casefold().translate(LOCATION_TRANSLITERATIONS)
+    ascii_location: str = unicodedata.normalize("NFKD", folded).encode("ascii", "ignore").decode("ascii")
+    key: str = re.sub(r"[^a-z0-9]+", "-", ascii_location).strip("-")
+    if key == "" and folded.strip() != "":
+        # A name without Latin letters or digits, e.g. in another script, is keyed by a hash of its folded spelling
+        return "location-" + hashlib.sha256(" ".join(folded.split()).encode("utf-8")).hexdigest()[:16]
+    return key
+
+
+def get_index_header() -> dict:
+    return {
+        "source-url": get_source_url(),
+        "last-updated": fetch_time
+    }
+
+
+def get_day_index(calendar: Calendar) -> dict:
+    # Every day in the window gets a file, so a missing file means the indexes are missing rather than an empty day
+    window_start, window_end = get_recurrence_window()
+    result: dict = {}
+    day: datetime = window_start
+    while day.date() <= window_end.date():
+        result[day.date().isoformat()] = []
+        day += timedelta(days=1)
+    for event in calendar.recurring_events:
+        result.setdefault(get_event_day(event), []).append(event)
+    return result
+
+
+def get_location_index(calendar: Calendar) -> dict:
+    result: dict = {}
+    for event in calendar.recurring_events:
+        location: str = normalize_location(event.location)
+        if location != "":
+            result.setdefault(location, []).append(event)
     return result
 
 
-def get_file_from_s3(filename: str):
-    return s3_client.get_object(
-        Bucket=environ['BUCKET_NAME'],
-        Key=filename,
-    )['Body'].read().decode("utf-8")
+def get_locations_manifest(location_index: dict) -> dict:
+    return dict(get_index_header(), **{
+        "total-locations": len(location_index.keys()),
+        "locations": {
+            location: {
+                "file": f"indexes/locations/{location}.json",
+                "names": sorted(set([event.location for event in events])),
+                "total-events": len(events)
+            } for location, events in sorted(location_index.items())
+        }
+    })
+
 
+def get_uid_index(paginated: dict) -> dict:
+    uids: dict = {}
+    for page_number, page in paginated.items():
+        for offset, event in enumerate(page["events"]):
+            uids.setdefault(event["uid"], []).append({"page": page_number, "offset": offset})
+    return dict(get_index_header(), **{"total-uids": len(uids.keys()), "uids": uids})
 
-def get_old_events() -> [CalendarEvent]:
-    old_events_json = get_file_from_s3("events.json")
-    old_events = json.loads(old_events_json)
+
+def get_snapshot_cache_mode() -> str:
+    # "memory" keeps the parsed events between invocations, "tmp" keeps the file in /tmp instead
+    mode: str = environ.get("SNAPSHOT_CACHE", "memory")
+    if mode not in SNAPSHOT_CACHE_MODES:
+        raise ValueError(f"SNAPSHOT_CACHE must be one of: {', '.join(SNAPSHOT_CACHE_MODES)}")
+    return mode
+
+
+def get_snapshot_path() -> str:
+    # The ETag is on the first line, followed by the events as JSON, so the ETag is read without parsing the events
+    return path.join(tempfile.gettempdir(), "events-snapshot")
+
+
+def load_snapshot_etag() -> str:
+    mode: str = get_snapshot_cache_mode()
+    if mode == "memory":
+        return snapshot["etag"] if snapshot is not None else None
+    if mode == "tmp":
+        try:
+            with open(get_snapshot_path(), "rb") as file:
+                return file.readline().decode("utf-8").rstrip("\n")
+        except FileNotFoundError:
+            return None
+    return None
+
+
+def load_snapshot_events() -> [CalendarEvent]:
+    # Only called once events.json is known to be unchanged since the snapshot was stored
+    if get_snapshot_cache_mode() == "memory":
+        return snapshot["events"]
+    with open(get_snapshot_path(), "rb") as file:
+        file.readline()
+        return get_old_events(json.load(file))
+
+
+def store_snapshot(etag: str, events: [CalendarEvent]):
+    global snapshot
+    mode: str = get_snapshot_cache_mode()
+    if mode == "memory":
+        snapshot = {"etag": etag, "events": events}
+    elif mode == "tmp":
+        # Written next to the snapshot and renamed, so a failed write never leaves a partial snapshot behind
+        with open(f"{get_snapshot_path()}.partial", "wb") as file:
+            file.write(f"{etag}\n".encode("utf-8"))
+            file.write(serialize_json([event.to_dict() for event in events]))
+        replace(f"{get_snapshot_path()}.partial", get_snapshot_path())
+
+
+def get_old_snapshot(key: str):
+    with metrics.phase("OldEvents"):
+        return read_old_snapshot(key)
+
+
+def get_old_events_key(sync_state: dict) -> str:
+    # Without paths, events.json is only published under the key of the last version
+    current_version: dict = sync_state.get("versions", {}).get("current")
+    if get_publish_layout() == "versioned" and current_version is not None:
+        return current_version["events"]
+    return "events.json"
+
+
+def read_old_snapshot(key: str):
+    # Returns the events of the published events.json, or None if it does not exist. A snapshot kept by a previous
+    # invocation is validated with a conditional GET, so the file is only downloaded and parsed when it has changed,
+    # and the snapshot is only read when it has not.
+    try:
+        stored: dict = get_storage().get(key, load_snapshot_etag())
+    except NoSuchKey:
+        return None
+    except NotModified:
+        print("events.json is unchanged since the last invocation. Reusing its events.")
+        return {"events": load_snapshot_events(), "source": get_snapshot_cache_mode()}
+
+    events_json: str = decode_body(stored["Body"], stored.get("ContentEncoding") or "").decode("utf-8")
+    events: [CalendarEvent] = get_old_events(json.loads(events_json))
+    if get_snapshot_cache_mode() != "off":
+        store_snapshot(stored["ETag"], events)
+    return {"events": events, "source": "s3"}
+
+
+def get_old_events(old_events: [dict]) -> [CalendarEvent]:
     return [CalendarEvent.from_dict(event) for event in old_events]
 
 
-def save_as_json(obj, filename: str):
+def serialize_json(obj) -> bytes:
+    if environ.get("MINIFY_JSON", str(False)) == str(True):
+        return bytes(json.dumps(obj, ensure_ascii=False, separators=(",", ":")), "utf-8")
+    return bytes(json.dumps(obj, ensure_ascii=False), "utf-8")
+
+
+def get_artifact_encoding(filename: str) -> str:
+    # ARTIFACT_ENCODINGS is a comma separated list of pattern=encoding, e.g. "index.json=gzip,pages/*=gzip".
+    # The first pattern matching the filename is used, and files matching no pattern are stored uncompressed.
+    for rule in environ.get("ARTIFACT_ENCODINGS", "").split(","):
+        if rule.strip() == "":
+            continue
+        pattern, encoding = [part.strip() for part in rule.split("=")]
+        if encoding not in ARTIFACT_ENCODINGS:
+            raise ValueError(f"ARTIFACT_ENCODINGS has an unknown encoding: {encoding}")
+        if fnmatch(filename, pattern):
+            return encoding
+    return "identity"
+
+
+def encode_ndjson_record(record: dict) -> bytes:
+    return bytes(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n", "utf-8")
+
+
+def encode_msgpack_record(record: dict) -> bytes:
+    import msgpack
+    return msgpack.packb(record, use_bin_type=True)
+
+
+def encode_cbor_record(record: dict) -> bytes:
+    import cbor2
+    return cbor2.dumps(record)
+
+
+# Exports are a sequence of records, one per occurrence, so they can be read one record at a time
+EXPORT_FORMATS = {
+    ".ndjson": {"content-type": "application/x-ndjson", "encode": encode_ndjson_record},
+    ".msgpack": {"content-type": "application/vnd.msgpack", "encode": encode_msgpack_record},
+    ".cbor": {"content-type": "application/cbor-seq", "encode": encode_cbor_record},
+}
+
+
+def get_export_filenames() -> [str]:
+    # EXPORTS is a comma separated list of filenames in exports/, whose extension is the format of the export
+    filenames: [str] = [
+        f"exports/{name.strip()}" for name in environ.get("EXPORTS", "").split(",") if name.strip() != ""
+    ]
+    for filename in filenames:
+        get_export_format(filename)
+    return filenames
+
+
+def get_export_format(filename: str) -> dict:
+    extension: str = path.splitext(filename)[1]
+    if extension not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {extension}. Must be one of: {', '.join(EXPORT_FORMATS.keys())}")
+    return EXPORT_FORMATS[extension]
+
+
+def get_stream_compressor(encoding: str):
+    # Returns functions to compress a chunk and to flush what is left, matching encode_body for the whole body
+    if encoding == "gzip":
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress, compressor.flush
+    return (lambda chunk: chunk), (lambda: b"")
+
+
+def encode_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "gzip":
+        # mtime is fixed, so the same content is always encoded to the same bytes
+        return gzip.compress(body, compresslevel=9, mtime=0)
+    return body
+
+
+def get_content_hash(obj) -> str:
+    # "last-updated" changes on every sync, so it is left out to only detect changes in the content itself
+    if type(obj) == dict:
+        obj = {key: value for key, value in obj.items() if key != "last-updated"}
+    return hashlib.sha256(serialize_json(obj)).hexdigest()
+
+
+def get_cache_control(key: str) -> str:
+    if key.startswith(VERSIONED_PREFIX):
+        return IMMUTABLE_CACHE_CONTROL
+    return environ.get("CACHE_CONTROL", "")
+
+
+def get_versioned_key(filename: str, content_hash: str) -> str:
+    # The key changes with the content and with the encoding it is stored with, so an object is never overwritten
+    encoding: str = get_artifact_encoding(filename)
+    digest: str = hashlib.sha256(bytes(f"{encoding}:{content_hash}", "utf-8")).hexdigest()
+    return f"{VERSIONED_PREFIX}{digest[:32]}{path.splitext(filename)[1]}"
+
+
+def save_as_json(obj, filename: str, sizes: list = None, keys: [str] = None):
+    # The object is serialized and encoded once and written to each of the keys, which default to the filename
     if type(obj) != list and type(obj) != dict:
         raise ValueError(f"Failed to save object as json. Object must be of type list or dict.")
-    print(f"Writing file to S3: {filename}")
-    return s3_client.put_object(
-        Bucket=environ['BUCKET_NAME'],
-        Key=filename,
-        Body=bytes(json.dumps(obj, ensure_ascii=False), "utf-8"),
-        ContentType="application/json"
-    )
+    with metrics.phase("Serialize"):
+        json_body: bytes = serialize_json(obj)
+        encoding: str = get_artifact_encoding(filename)
+        body: bytes = encode_body(json_body, encoding)
+
+    responses: list = []
+    for key in keys or [filename]:
+        print(f"Writing file to S3: {key} ({len(json_body)} bytes, {len(body)} bytes {encoding})")
+        if sizes is not None:
+            sizes.append({"filename": key, "json-bytes": len(json_body), "stored-bytes": len(body)})
+        responses.append(get_storage().put(key, body, "application/json", None, encoding, get_cache_control(key)))
+    return responses[0]
+
+
+def is_published(filename: str, content_hash: str, publish_state: dict) -> bool:
+    # A file must also be written again when its encoding is changed
+    encoding: str = get_artifact_encoding(filename)
+    if encoding != "identity":
+        content_hash = f"{encoding}:{content_hash}"
+    publish_state["objects"][filename] = content_hash
+    return publish_state["published-objects"].get(filename) == content_hash
+
+
+def get_publish_keys(filename: str, content_hash: str, publish_state: dict, layout: str = None) -> [str]:
+    # Returns the keys the file must be written to, which is its path unless it is unchanged, and its versioned key
+    # unless an object with the same content already exists. layout overrides PUBLISH_LAYOUT for files which are
+    # always published the same way.
+    layout = layout or get_publish_layout()
+    keys: [str] = []
+    if layout != "versioned" and not is_published(filename, content_hash, publish_state):
+        keys.append(filename)
+    if layout != "paths":
+        key: str = get_versioned_key(filename, content_hash)
+        publish_state["files"][filename] = key
+        if key not in publish_state["versioned-objects"]:
+            publish_state["versioned-objects"].add(key)
+            keys.append(key)
+    if len(keys) == 0:
+        publish_state["skipped"].append(filename)
+    return keys
+
+
+def mark_written(filename: str, keys: [str], response: dict, publish_state: dict):
+    # The path of a file comes first in its keys, so response is the one of the path when the path was written. Its
+    # ETag is recorded, so the next sync can tell whether the file was deleted or overwritten since.
+    if filename in keys:
+        publish_state["etags"][filename] = response["ETag"]
+    publish_state["written"].extend(keys)
+
+
+def publish_json(obj, filename: str, publish_state: dict, content_hash: str = None, layout: str = None):
+    # Only writes the object if its content hash differs from the one recorded when it was last published
+    if content_hash is None:
+        content_hash = get_content_hash(obj)
+    keys: [str] = get_publish_keys(filename, content_hash, publish_state, layout)
+    if len(keys) == 0:
+        return None
+    res = save_as_json(obj, filename, publish_state["sizes"], keys)
+    mark_written(filename, keys, res, publish_state)
+    return res
+
+
+def publish_events(header: dict, events: [CalendarEvent], filename: str, publish_state: dict):
+    # The hash is computed from the fingerprints of the events, so files whose events are unchanged are skipped before
+    # any of them are serialized
+    hasher = hashlib.sha256(serialize_json({key: value for key, value in header.items() if key != "last-updated"}))
+    for event in events:
+        hasher.update(event.fingerprint)
+    content_hash: str = hasher.hexdigest()
+    keys: [str] = get_publish_keys(filename, content_hash, publish_state)
+    if len(keys) == 0:
+        return None
+    res = save_as_json(dict(header, **{
+        "total-events": len(events),
+        "events": [event.to_dict() for event in events]
+    }), filename, publish_state["sizes"], keys)
+    mark_written(filename, keys, res, publish_state)
+    return res
+
+
+def publish_export(records, filename: str, publish_state: dict):
+    # records is a generator, and each record is written to a temporary file as soon as it is encoded, so the export is
+    # never held in memory
+    export_format: dict = get_export_format(filename)
+    encoding: str = get_artifact_encoding(filename)
+    compress, flush = get_stream_compressor(encoding)
+    content_hash = hashlib.sha256()
+    record_bytes: int = 0
+    responses: list = []
+    with tempfile.TemporaryFile() as file:
+        serialize_started: float = time.perf_counter()
+        for record in records:
+            chunk: bytes = export_format["encode"](record)
+            content_hash.update(chunk)
+            record_bytes += len(chunk)
+            file.write(compress(chunk))
+        file.write(flush())
+        metrics.add_seconds("Serialize", time.perf_counter() - serialize_started)
+        keys: [str] = get_publish_keys(filename, content_hash.hexdigest(), publish_state)
+        if len(keys) == 0:
+            return None
+
+        stored_bytes: int = file.tell()
+        for key in keys:
+            print(f"Writing file to S3: {key} ({record_bytes} bytes, {stored_bytes} bytes {encoding})")
+            responses.append(get_storage().put(
+                key, file, export_format["content-type"], None, encoding, get_cache_control(key)
+            ))
+            publish_state["sizes"].append({"filename": key, "json-bytes": record_bytes, "stored-bytes": stored_bytes})
+    mark_written(filename, keys, responses[0], publish_state)
+    return responses[0]
+
+
+def publish_version(publish_state: dict) -> dict:
+    # Called once all files of the version are written, so manifest.json never points at a key which does not exist.
+    # The version lists the key of each file, and manifest.json, the only file which is overwritten, points at it.
+    files: dict = dict(sorted(publish_state["files"].items()))
+    publish_json({
+        "source-url": get_source_url(),
+        "last-updated": fetch_time,
+        "files": files
+    }, VERSION_MANIFEST_FILENAME, publish_state, layout="versioned")
+    version_key: str = publish_state["files"][VERSION_MANIFEST_FILENAME]
+    publish_json({
+        "source-url": get_source_url(),
+        "last-updated": fetch_time,
+        "version": version_key
+    }, ROOT_MANIFEST_FILENAME, publish_state, layout="paths")
+    return {"manifest": version_key, "events": files["events.json"]}
+
+
+def get_events_by_uid(events: [CalendarEvent]) -> dict:
+    # Recurrence overrides share the uid of their event. As in calendar_diff, the last one in the list is kept.
+    return {event.uid: event for event in events}
 
 
-def notify_updates(old_events: [CalendarEvent], new_events: [CalendarEvent]):
-    print("Changes in calendar detected. Notifying diff...")
-    sns_client = boto3.client('sns')
-    msg_body = {
-        "old_events": [event.to_dict() for event in old_events],
-        "new_events": [event.to_dict() for event in new_events]
+def get_changed_fields(old_event: CalendarEvent, new_event: CalendarEvent) -> [str]:
+    old_dict: dict = old_event.to_dict()
+    new_dict: dict = new_event.to_dict()
+    return [field for field in CHANGE_SET_FIELDS if old_dict[field] != new_dict[field]]
+
+
+def get_change_set(old_events: [CalendarEvent], new_events: [CalendarEvent]) -> dict:
+    old_events_by_uid: dict = get_events_by_uid(old_events)
+    new_events_by_uid: dict = get_events_by_uid(new_events)
+    return {
+        "added": [event for uid, event in new_events_by_uid.items() if uid not in old_events_by_uid],
+        "removed": [event for uid, event in old_events_by_uid.items() if uid not in new_events_by_uid],
+        "modified": [
+            (old_events_by_uid[uid], event) for uid, event in new_events_by_uid.items()
+            if uid in old_events_by_uid and old_events_by_uid[uid].fingerprint != event.fingerprint
+        ]
     }
-    sns_client.publish(
-        TopicArn=environ["EVENTS_CHANGED_TOPIC_ARN"],
-        Message=str(json.dumps(msg_body, ensure_ascii=False)),
-        MessageGroupId="calendar_events_changed"
+
+
+def get_change_set_messages(change_set: dict) -> [dict]:
+    # Splits the change set into as few messages as possible below the SNS message size limit
+    messages: [dict] = []
+    message: dict = {"added": [], "removed": [], "modified": []}
+    message_size: int = 0
+    entries: list = [("added", event.to_dict()) for event in change_set["added"]] \
+        + [("removed", event.to_dict()) for event in change_set["removed"]] \
+        + [("modified", {
+            "old": old_event.to_dict(),
+            "new": new_event.to_dict(),
+            "changed-fields": get_changed_fields(old_event, new_event)
+        }) for old_event, new_event in change_set["modified"]]
+    for change_type, entry in entries:
+        entry_size: int = len(serialize_json(entry)) + 1
+        if message_size > 0 and message_size + entry_size > MAX_CHANGE_SET_MESSAGE_BYTES:
+            messages.append(message)
+            message = {"added": [], "removed": [], "modified": []}
+            message_size = 0
+        message[change_type].append(entry)
+        message_size += entry_size
+    if message_size > 0:
+        messages.append(message)
+    return messages
+
+
+def notify_updates(change_set: dict):
+    print(
+        f"Changes in calendar detected: {len(change_set['added'])} added, {len(change_set['removed'])} removed, "
+        f"{len(change_set['modified'])} modified. Notifying diff..."
     )
+    for message in get_change_set_messages(change_set):
+        get_client("sns").publish(
+            TopicArn=environ["EVENTS_CHANGED_TOPIC_ARN"],
+            Message=serialize_json(message).decode("utf-8"),
+            MessageGroupId="calendar_events_changed"
+        )
     print("Message sent successfully")
     return
 
 
-def check_for_updates(calendar: Calendar):
-    try:
-        old_events: [CalendarEvent] = get_old_events()
-        new_events: [CalendarEvent] = calendar.events
+def check_for_updates(calendar: Calendar, old_snapshot: dict):
+    with metrics.phase("Diff"):
+        return diff_and_notify(calendar, old_snapshot)
 
-        def notify():
-            return notify_updates(old_events, new_events)
 
-        return notify()
+def diff_and_notify(calendar: Calendar, old_snapshot: dict):
+    if old_snapshot is None:
+        print(f"events.json was not found. Skipping diff.")
+        return None
+    change_set: dict = get_change_set(old_snapshot["events"], calendar.events)
+    if len(change_set["added"]) + len(change_set["removed"]) + len(change_set["modified"]) == 0:
+        print("No changes in calendar detected. Skipping diff.")
+    else:
+        notify_updates(change_set)
+    return change_set
 
-        if len(old_events) != len(new_events):
-            return notify()
 
-        for i in range(len(old_events)):
-            if old_events[i] != new_events[i]:
-                return notify()
+def get_invalidation_paths(filenames: [str]) -> [str]:
+    paths: set = set([f"/{filename}" for filename in filenames])
+    if "/index.json" in paths:
+        # index.json is the distribution's default root object
+        paths.add("/")
+    if len(paths) <= MAX_INVALIDATION_PATHS:
+        return sorted(paths)
 
-    except s3_client.exceptions.NoSuchKey:
-        print(f"events.json was not found. Skipping diff.")
-        return False
+    # A wildcard path counts as a single path, so group the paths by directory when there are too many of them
+    grouped_paths: set = set([f"{path[:path.rindex('/')]}/*" if path.rindex("/") > 0 else path for path in paths])
+    if len(grouped_paths) <= MAX_INVALIDATION_PATHS:
+        return sorted(grouped_paths)
+    return ["/*"]
 
 
-def invalidate_cache():
+def invalidate_cache(paths: [str]):
     distribution_id: str = environ['DISTRIBUTION_ID']
-    cf_client = boto3.client("cloudfront")
+    if len(paths) == 0:
+        print(f"No files were changed. Skipping invalidation for distribution {distribution_id}")
+        return
 
-    print(f"Invalidating cache for distribution {distribution_id}")
-    cf_client.create_invalidation(
+    print(f"Invalidating cache for distribution {distribution_id}: {', '.join(paths)}")
+    get_client("cloudfront").create_invalidation(
         DistributionId=distribution_id,
         InvalidationBatch={
             "Paths": {
-                "Quantity": 1,
-                "Items": ["/*"]
+                "Quantity": len(paths),
+                "Items": paths
             },
             "CallerReference": str(datetime.now())
         }
     )
 
 
+def list_existing_objects(prefix: str) -> list:
+    return list(get_storage().list(prefix))
+
+
+def list_existing_files(filenames: [str]) -> list:
+    # Listing the root of the bucket would list every object, so the files at the root are listed one at a time
+    return [
+        existing for filename in filenames for existing in get_storage().list(filename) if existing["Key"] == filename
+    ]
+
+
 def list_existing_pages() -> list:
-    response = s3_client.list_objects_v2(
-        Bucket=environ['BUCKET_NAME'],
-        Prefix="pages/"
-    )
-    try:
-        contents = response["Contents"]
-    except KeyError:
-        contents = []
-    return contents
+    return list_existing_objects("pages/")
 
 
-def get_expired_pages(total_pages: int, existing_pages: list) -> list:
-    def file_is_expired(filename: str) -> bool:
-        start_i = filename.rindex("/")
-        end_i = filename.find(".")
-        i = int(filename[start_i + 1:end_i])
-        return i >= total_pages
+def list_existing_months() -> list:
+    return list_existing_objects("months/")
 
-    filenames = list(map(lambda file: file["Key"], list(existing_pages)))
-    expired_files = list(map(lambda filename: {"Key": filename}, filter(file_is_expired, filenames)))
-    return expired_files
+
+def list_existing_indexes() -> list:
+    return list_existing_objects("indexes/")
+
+
+def list_existing_exports() -> list:
+    return list_existing_objects("exports/")
+
+
+def get_expired_objects(current_filenames: [str], existing_objects: list) -> list:
+    current: set = set(current_filenames)
+    return [{"Key": existing["Key"]} for existing in existing_objects if existing["Key"] not in current]
 
 
 def delete_objects(objects_to_delete: [str]) -> dict:
-    total_deleted_pages: int = 0
-    deleted_objects: list = []
-    deletion_errors = []
-    if len(objects_to_delete) > 0:
-        print(f"Deleting {len(objects_to_delete)} files")
-        res = s3_client.delete_objects(
-            Bucket=environ['BUCKET_NAME'],
-            Delete={
-                "Objects": objects_to_delete
-            }
-        )
-        total_deleted_pages = len(res["Deleted"])
-        deleted_objects = res["Deleted"]
+    with metrics.phase("Delete"):
+        return delete_expired_objects(objects_to_delete)
 
-        try:
-            deletion_errors = res["Errors"]
-        except KeyError:
-            deletion_errors = []
+
+def delete_expired_objects(objects_to_delete: [dict]) -> dict:
+    if len(objects_to_delete) == 0:
+        return {"total-deleted-pages": 0, "deleted-objects": [], "errors": []}
+    print(f"Deleting {len(objects_to_delete)} files")
+    result: dict = get_storage().delete([deleted["Key"] for deleted in objects_to_delete])
     return {
-        "total-deleted-pages": total_deleted_pages,
-        "deleted-objects": deleted_objects,
-        "errors": deletion_errors
+        "total-deleted-pages": len(result["deleted"]),
+        "deleted-objects": [{"Key": key} for key in result["deleted"]],
+        "errors": result["errors"]
     }
 
 
+def get_retained_versions(sync_state: dict, current_version: dict) -> [dict]:
+    # Versions replaced less than VERSION_RETENTION_HOURS ago are retained, as clients may still hold a manifest.json
+    # pointing at them
+    now: datetime = datetime.now(timezone.utc)
+    versions: dict = sync_state.get("versions", {})
+    retired: [dict] = versions.get("retired", [])
+    previous_version: dict = versions.get("current")
+    if previous_version is not None and previous_version["manifest"] != current_version["manifest"]:
+        retired = retired + [dict(previous_version, replaced=now.isoformat())]
+    return [
+        version for version in retired
+        if version["manifest"] != current_version["manifest"]
+        and datetime.fromisoformat(version["replaced"]) > now - get_version_retention()
+    ]
+
+
+def get_version_keys(version: dict) -> set:
+    try:
+        files: dict = json.loads(get_storage().read(version["manifest"]))["files"]
+    except NoSuchKey:
+        return set()
+    return set(files.values()) | {version["manifest"]}
+
+
+def get_unreferenced_objects(existing_objects: list, referenced_keys: set) -> list:
+    # Objects written less than VERSION_RETENTION_HOURS ago are kept as well, as they may belong to a sync which has
+    # not yet swapped manifest.json
+    expiry: datetime = datetime.now(timezone.utc) - get_version_retention()
+    return [
+        {"Key": existing["Key"]} for existing in existing_objects
+        if existing["Key"] not in referenced_keys and existing["LastModified"] < expiry
+    ]
+
+
+def collect_garbage(existing_objects: list, referenced_keys: set) -> dict:
+    with metrics.phase("GarbageCollection"):
+        return delete_expired_objects(get_unreferenced_objects(existing_objects, referenced_keys))
+
+
+def save_sync_state(
+        source_states: dict, published_objects: dict, published_etags: dict, versions: dict = None,
+        page_anchors: [list] = None
+):
+    print(f"Writing file to S3: {SYNC_STATE_FILENAME}")
+    sync_state: dict = {
+        "sources": source_states,
+        "published-date": datetime.now().date().isoformat(),
+        "settings-hash": get_settings_hash(),
+        "objects": published_objects,
+        "etags": published_etags
+    }
+    if versions is not None:
+        sync_state["versions"] = versions
+    if page_anchors is not None:
+        sync_state["page-anchors"] = page_anchors
+    return get_storage().put(SYNC_STATE_FILENAME, serialize_json(sync_state), "application/json")
+
+
+def save_expansion_cache(expander: RecurrenceExpander):
+    # Not published through publish_json, as the cache is internal to the sync and never served or invalidated
+    if not expander.is_modified():
+        print(f"{EXPANSION_CACHE_FILENAME} is unchanged. Skipping upload.")
+        return None
+    print(f"Writing file to S3: {EXPANSION_CACHE_FILENAME}")
+    return get_storage().put(EXPANSION_CACHE_FILENAME, serialize_json(expander.to_dict()), "application/json")
+
+
+def submit_s3_reads(executor: ThreadPoolExecutor, sync_state: dict, layout: str) -> (list, Future, Future, Future):
+    # The S3 reads are independent of the calendar. Files at their paths are neither published nor deleted in the
+    # versioned layout, so they are not listed, except for manifest.json.
+    existing_futures: list = [
+        executor.submit(list_existing)
+        for list_existing in [list_existing_pages, list_existing_months, list_existing_indexes, list_existing_exports]
+    ] if layout != "versioned" else []
+    versioned_objects_future = executor.submit(list_existing_objects, VERSIONED_PREFIX) if layout != "paths" else None
+    root_files: [str] = (["events.json", "index.json"] if layout != "versioned" else []) \
+        + ([ROOT_MANIFEST_FILENAME] if layout != "paths" else [])
+    root_files_future = executor.submit(list_existing_files, root_files)
+    return existing_futures, versioned_objects_future, root_files_future, \
+        executor.submit(get_old_snapshot, get_old_events_key(sync_state))
+
+
 def handler(event, context):
-    ical_string: str = fetch_ical_string()
-    calendar: Calendar = Calendar.from_ical(ical_string)
+    global metrics
+    metrics = get_metrics()
+    try:
+        with metrics.phase("Total"):
+            with ThreadPoolExecutor(max_workers=get_concurrency()) as executor:
+                response: dict = sync(executor)
+    finally:
+        # Also emitted when the sync fails, to see how far it got
+        metrics.emit()
+    response["body"]["metrics"] = metrics.summary()
+    return response
 
-    check_for_updates(calendar)
 
-    save_as_json(
-        obj=[event.to_dict() for event in calendar.events],
-        filename="events.json"
-    )
+def sync(executor: ThreadPoolExecutor):
+    with metrics.phase("SyncState"):
+        sync_state: dict = get_sync_state()
+    published_current: bool = window_is_current(sync_state) and settings_are_current(sync_state)
+    get_expander = get_lazy_expander()
+    if not published_current:
+        # The sync can not be skipped, so the expansion cache is read while the calendars are downloaded
+        executor.submit(get_expander)
+    layout: str = get_publish_layout()
+    # The S3 reads are only needed when the sync is not skipped. When that is already known, they run while the
+    # calendars are downloaded, and otherwise while they are parsed.
+    s3_reads: tuple = submit_s3_reads(executor, sync_state, layout) if not published_current else None
 
-    paginated: dict = get_paginated_recurring_events(calendar)
-    total_updated_events: int = 0
-    total_updated_pages: int = 0
-    existing_pages: list = list_existing_pages()
+    sources: [dict] = get_calendar_sources()
+    streaming: bool = environ.get("ICAL_STREAMING", str(False)) == str(True)
+    # Only send validators when a 304 would let us skip the sync, since there is nothing to rebuild a stale window from
+    source_states: dict = sync_state.get("sources", {}) if published_current else {}
+    # The calendars are downloaded and parsed concurrently
+    fetch_started: float = time.perf_counter()
+    fetch_results: [dict] = [future.result() for future in [
+        executor.submit(fetch_source, source, source_states.get(source["url"], {}), streaming, get_expander)
+        for source in sources
+    ]]
+    if published_current and not any([fetch_result["modified"] for fetch_result in fetch_results]):
+        print("Calendar is unchanged and the published events are up to date. Skipping sync.")
+        return {
+            'statusCode': 200,
+            'body': {
+                'calendar_unchanged': True
+            }
+        }
 
-    for page_number in paginated.keys():
-        page_filename = f"pages/{page_number}.json"
-        page = paginated[page_number]
-        res = save_as_json(page, page_filename)
-        if res["ResponseMetadata"]["HTTPStatusCode"] == 200:
-            total_updated_pages += 1
-            total_updated_events += len(page["events"])
+    existing_futures, versioned_objects_future, root_files_future, old_snapshot_future = \
+        s3_reads if s3_reads is not None else submit_s3_reads(executor, sync_state, layout)
+
+    # Calendars which are unchanged are parsed as well, to publish the events of all calendars
+    calendars: [Calendar] = [future.result() for future in [
+        executor.submit(get_source_calendar, fetch_result, streaming, get_expander) for fetch_result in fetch_results
+    ]]
+    expander: RecurrenceExpander = get_expander()
+    calendar: Calendar = merge_sources(fetch_results, calendars)
+    # The expansion window starts at midnight, while the published occurrences start at the time of the sync
+    calendar.drop_ended_occurrences(datetime.now())
+    metrics.add_seconds("Fetch", time.perf_counter() - fetch_started)
+    metrics.add("Events", len(calendar.events))
+    metrics.add("Occurrences", len(calendar.recurring_events))
+
+    # The old events must be read before events.json is overwritten
+    old_snapshot: dict = old_snapshot_future.result()
+    notify_future = executor.submit(check_for_updates, calendar, old_snapshot)
 
-    save_as_json({
-        "source-url": environ["CALENDAR_LINK"],
+    existing_pages, existing_months, existing_indexes, existing_exports = [
+        existing_future.result() for existing_future in existing_futures
+    ] or [[], [], [], []]
+    versioned_objects: list = versioned_objects_future.result() if versioned_objects_future is not None else []
+    existing_etags: dict = {
+        existing["Key"]: existing["ETag"] for existing in
+        existing_pages + existing_months + existing_indexes + existing_exports + root_files_future.result()
+    }
+    recorded_etags: dict = sync_state.get("etags", {})
+    publish_state: dict = {
+        # Files which were deleted or overwritten since they were published must be written again. Their ETags are
+        # recorded when they are written, and compared with the ones listed.
+        "published-objects": {
+            filename: content_hash for filename, content_hash in sync_state.get("objects", {}).items()
+            if filename in existing_etags
+            and recorded_etags.get(filename, existing_etags[filename]) == existing_etags[filename]
+        },
+        "objects": {},
+        "etags": {},
+        # The versioned key of each file, and the versioned objects which exist
+        "files": {},
+        "versioned-objects": set([existing["Key"] for existing in versioned_objects]),
+        "written": [],
+        "skipped": [],
+        "sizes": []
+    }
+
+    build_started: float = time.perf_counter()
+    page_anchors: [list] = None
+    if get_pagination_mode() == "keyset":
+        paginated, page_anchors = get_keyset_paginated_recurring_events(calendar, sync_state.get("page-anchors", []))
+    else:
+        paginated = get_paginated_recurring_events(calendar)
+    monthly: dict = get_monthly_recurring_events(calendar)
+    objects_to_delete: list = get_expired_objects(
+        [f"pages/{page_number}.json" for page_number in paginated.keys()]
+        + ([PAGES_MANIFEST_FILENAME] if page_anchors is not None else []),
+        existing_pages
+    )
+    months_to_delete: list = get_expired_objects(
+        [f"months/{month}.json" for month in monthly.keys()] + [MONTHS_MANIFEST_FILENAME], existing_months
+    )
+    day_index: dict = get_day_index(calendar)
+    location_index: dict = get_location_index(calendar)
+    indexes_to_delete: list = get_expired_objects(
+        [f"indexes/days/{day}.json" for day in day_index.keys()]
+        + [f"indexes/locations/{location}.json" for location in location_index.keys()]
+        + [LOCATIONS_INDEX_FILENAME, UIDS_INDEX_FILENAME],
+        existing_indexes
+    )
+    export_filenames: [str] = get_export_filenames()
+    exports_to_delete: list = get_expired_objects(export_filenames, existing_exports)
+    metrics.add_seconds("Build", time.perf_counter() - build_started)
+    delete_future = executor.submit(
+        delete_objects, objects_to_delete + months_to_delete + indexes_to_delete + exports_to_delete
+    )
+    publish_started: float = time.perf_counter()
+
+    events_future = executor.submit(
+        publish_json,
+        obj=[event.to_dict() for event in calendar.events],
+        filename="events.json",
+        publish_state=publish_state
+    )
+    publish_futures: list = [events_future]
+    page_futures: list = [
+        executor.submit(publish_json, paginated[page_number], f"pages/{page_number}.json", publish_state)
+        for page_number in paginated.keys()
+    ]
+    if page_anchors is not None:
+        publish_futures.append(executor.submit(
+            publish_json, get_pages_manifest(paginated, len(calendar.recurring_events)), PAGES_MANIFEST_FILENAME,
+            publish_state
+        ))
+    publish_futures.append(executor.submit(publish_json, {
+        "source-url": get_source_url(),
         "last-updated": fetch_time,
-        "total-events": total_updated_events,
-        "total-pages": total_updated_pages,
+        "total-events": len(calendar.recurring_events),
+        "total-pages": len(paginated.keys()),
         "per-page": environ["EVENTS_PER_PAGE"],
         "events": [event.to_dict() for event in calendar.recurring_events]
-    }, "index.json")
+    }, "index.json", publish_state))
+    month_hashes: dict = {month: get_content_hash(monthly[month]) for month in monthly.keys()}
+    publish_futures += [
+        executor.submit(publish_json, monthly[month], f"months/{month}.json", publish_state, month_hashes[month])
+        for month in monthly.keys()
+    ]
+    publish_futures.append(executor.submit(
+        publish_json, get_months_manifest(monthly, month_hashes), MONTHS_MANIFEST_FILENAME, publish_state
+    ))
+    publish_futures += [
+        executor.submit(
+            publish_events, dict(get_index_header(), day=day), events, f"indexes/days/{day}.json", publish_state
+        ) for day, events in day_index.items()
+    ]
+    publish_futures += [
+        executor.submit(
+            publish_events, dict(get_index_header(), location=location), events,
+            f"indexes/locations/{location}.json", publish_state
+        ) for location, events in location_index.items()
+    ]
+    publish_futures.append(executor.submit(
+        publish_json, get_locations_manifest(location_index), LOCATIONS_INDEX_FILENAME, publish_state
+    ))
+    publish_futures.append(executor.submit(publish_json, get_uid_index(paginated), UIDS_INDEX_FILENAME, publish_state))
+    publish_futures += [
+        executor.submit(
+            publish_export, (event.to_dict() for event in calendar.recurring_events), filename, publish_state
+        ) for filename in export_filenames
+    ]
+    if expander is not None:
+        publish_futures.append(executor.submit(save_expansion_cache, expander))
+
+    total_updated_events: int = sum([len(page["events"]) for page in paginated.values()])
+    total_updated_pages: int = 0
+    for page_future in page_futures:
+        res = page_future.result()
+        if res is not None:
+            total_updated_pages += 1
+    for publish_future in publish_futures:
+        publish_future.result()
+    current_version: dict = publish_version(publish_state) if layout != "paths" else None
+    metrics.add_seconds("Publish", time.perf_counter() - publish_started)
+    events_response = events_future.result()
+    if events_response is not None and get_snapshot_cache_mode() != "off":
+        # The next warm invocation can reuse the events this one has just written
+        store_snapshot(events_response["ETag"], calendar.events)
+    delete_result: dict = delete_future.result()
+    change_set: dict = notify_future.result()
+
+    # Versioned objects are new keys, which have never been cached
+    changed_filenames: [str] = publish_state["written"] + [
+        deleted["Key"] for deleted in delete_result["deleted-objects"]
+    ]
+    invalidation_paths: [str] = get_invalidation_paths([
+        filename for filename in changed_filenames if not filename.startswith(VERSIONED_PREFIX)
+    ])
+    with metrics.phase("Invalidation"):
+        invalidate_cache(invalidation_paths)
 
-    objects_to_delete: list = get_expired_pages(len(paginated.keys()), existing_pages)
-    delete_result: dict = delete_objects(objects_to_delete)
+    retained_versions: [dict] = []
+    if current_version is not None:
+        retained_versions = get_retained_versions(sync_state, current_version)
+    save_sync_state({
+        fetch_result["source"]["url"]: fetch_result["source-state"] for fetch_result in fetch_results
+    }, publish_state["objects"], {
+        # Files which were skipped are unchanged since they were listed
+        filename: publish_state["etags"].get(filename, existing_etags.get(filename))
+        for filename in publish_state["objects"].keys()
+    }, {
+        "current": current_version,
+        "retired": retained_versions
+    } if current_version is not None else None, page_anchors)
 
-    invalidate_cache()
+    # Only collected once the sync state is saved, so a failed sync never forgets a version still being served
+    garbage_collection_result: dict = None
+    if current_version is not None:
+        referenced_keys: set = set(publish_state["files"].values())
+        for version_keys in executor.map(get_version_keys, retained_versions):
+            referenced_keys |= version_keys
+        garbage_collection_result = collect_garbage(versioned_objects, referenced_keys)
+
+    metrics.add("Pages", len(paginated.keys()))
+    metrics.add("ObjectsWritten", len(publish_state["written"]))
+    metrics.add("ObjectsSkipped", len(publish_state["skipped"]))
+    metrics.add("ObjectsDeleted", len(delete_result["deleted-objects"]))
+    metrics.add("JsonBytesWritten", sum([size["json-bytes"] for size in publish_state["sizes"]]), "Bytes")
+    metrics.add("StoredBytesWritten", sum([size["stored-bytes"] for size in publish_state["sizes"]]), "Bytes")
+    metrics.add("PathsInvalidated", len(invalidation_paths))
+    if garbage_collection_result is not None:
+        metrics.add("ObjectsCollected", len(garbage_collection_result["deleted-objects"]))
 
     return {
         'statusCode': 200,
@@ -224,6 +1427,33 @@ def handler(event, context):
             'pages_updated': total_updated_pages,
             'previously_existing_pages': len(existing_pages),
             'pages_to_be_deleted': len(objects_to_delete),
-            'deletion-result': delete_result
+            'months_detected': len(monthly.keys()),
+            'months_to_be_deleted': len(months_to_delete),
+            'indexes_to_be_deleted': len(indexes_to_delete),
+            'exports_to_be_deleted': len(exports_to_delete),
+            'deletion-result': delete_result,
+            'objects_written': len(publish_state["written"]),
+            'old_events_source': old_snapshot["source"] if old_snapshot is not None else None,
+            'sources': [{
+                "name": fetch_result["source"]["name"] or source_calendar.name,
+                "modified": fetch_result["modified"],
+                "events": len(source_calendar.events),
+                "occurrences": len(source_calendar.recurring_events)
+            } for fetch_result, source_calendar in zip(fetch_results, calendars)],
+            'duplicate_events': sum([len(source_calendar.events) for source_calendar in calendars])
+            - len(calendar.events),
+            'objects_skipped': len(publish_state["skipped"]),
+            'bytes_written': {
+                "json": sum([size["json-bytes"] for size in publish_state["sizes"]]),
+                "stored": sum([size["stored-bytes"] for size in publish_state["sizes"]])
+            },
+            'paths_invalidated': len(invalidation_paths),
+            'version': current_version["manifest"] if current_version is not None else None,
+            'versions_retained': len(retained_versions),
+            'garbage-collection-result': garbage_collection_result,
+            'recurrence_expansion': expander.stats if expander is not None else None,
+            'events_changed': {
+                change_type: len(changes) for change_type, changes in change_set.items()
+            } if change_set is not None else None
         }
     }
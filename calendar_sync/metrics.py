@@ -0,0 +1,76 @@
+from contextlib import contextmanager, nullcontext
+import threading
+import time
+import json
+
+# A metric directive of the Embedded Metric Format may hold at most 100 metrics
+MAX_METRICS_PER_DIRECTIVE = 100
+DISABLED_PHASE = nullcontext()
+
+
+class Metrics:
+    # Collects the timings, sizes and counts of one invocation, and prints them as a single CloudWatch Embedded Metric
+    # Format log line, from which CloudWatch extracts the metrics. Outside of Lambda it is an ordinary JSON log line.
+    # Values with the same name are summed, so a phase running once per file adds up to its total time. When disabled,
+    # nothing is collected or printed.
+
+    def __init__(self, enabled: bool, namespace: str = "CalendarSync", dimensions: dict = None):
+        self.enabled: bool = enabled
+        self.namespace: str = namespace
+        self.dimensions: dict = dimensions or {}
+        self.values: dict = {}
+        self.units: dict = {}
+        self.lock = threading.Lock()
+
+    def add(self, name: str, value: float, unit: str = "Count"):
+        if not self.enabled:
+            return
+        # Phases running on the executor's threads add to the same values
+        with self.lock:
+            self.values[name] = self.values.get(name, 0) + value
+            self.units[name] = unit
+
+    def add_seconds(self, name: str, seconds: float):
+        self.add(f"{name}Milliseconds", seconds * 1000, "Milliseconds")
+
+    def phase(self, name: str):
+        # Times the body of the with statement as <name>Milliseconds. The shared no-op context is returned when
+        # disabled, so phases around every written file cost next to nothing.
+        if not self.enabled:
+            return DISABLED_PHASE
+        return self.timed_phase(name)
+
+    @contextmanager
+    def timed_phase(self, name: str):
+        started: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_seconds(name, time.perf_counter() - started)
+
+    def summary(self):
+        if not self.enabled:
+            return None
+        with self.lock:
+            return {name: round(value, 1) for name, value in sorted(self.values.items())}
+
+    def to_emf(self) -> dict:
+        names: [str] = sorted(self.values.keys())
+        return dict({
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": self.namespace,
+                    "Dimensions": [sorted(self.dimensions.keys())],
+                    "Metrics": [
+                        {"Name": name, "Unit": self.units[name]}
+                        for name in names[i:i + MAX_METRICS_PER_DIRECTIVE]
+                    ]
+                } for i in range(0, len(names), MAX_METRICS_PER_DIRECTIVE)]
+            }
+        }, **self.dimensions, **self.summary())
+
+    def emit(self):
+        if not self.enabled:
+            return
+        print(json.dumps(self.to_emf()))
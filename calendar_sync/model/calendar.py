@@ -1,11 +1,52 @@
-import pandas
-from datetime import datetime
+from datetime import date, datetime, time, timedelta
 import recurring_ical_events
+import heapq
 from dateutil.relativedelta import relativedelta
+from model.ical_stream import IcalStream, is_recurring
 import icalendar
+import hashlib
+from time import perf_counter
+
+# Non-recurring events are expanded in batches of this size while streaming, so they can be released as we go
+STREAM_EXPANSION_BATCH_SIZE = 500
+
+
+def iso_duration(duration: timedelta) -> str:
+    # Same format as pandas.Timedelta.isoformat, e.g. P0DT1H30M0S
+    hours, remainder = divmod(duration.seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    seconds_str: str = f"{seconds}.{duration.microseconds:0>6}".rstrip("0").rstrip(".")
+    return f"P{duration.days}DT{hours}H{minutes}M{seconds_str}S"
+
+
+def get_sort_key(event) -> (float, str):
+    # All day events start at midnight local time, so they can be sorted along with events starting at a given time
+    start: datetime = event.start if isinstance(event.start, datetime) else datetime.combine(event.start, time.min)
+    return start.timestamp(), event.uid
+
+
+def parse_date_or_datetime(value: str):
+    # All day events are serialized as dates, and must stay dates to be serialized the same way again
+    return date.fromisoformat(value) if len(value) == 10 else datetime.fromisoformat(value)
+
+
+def get_content_key(event) -> tuple:
+    # An event copied to another calendar gets a new uid, but keeps its time, summary and location
+    return event.start, event.end, event.summary.strip(), event.location.strip()
+
+
+def get_recurrence_window() -> (datetime, datetime):
+    # Starts at midnight, so the window only moves once a day and the syncs of a day expand the same window
+    cal_start: datetime = datetime.combine(datetime.now().date(), time.min)
+    return cal_start, cal_start + relativedelta(months=3)
 
 
 class CalendarEvent:
+    # Events are immutable, so they can be used in sets and as dict keys, and their fingerprint can be cached
+    __slots__ = (
+        "uid", "start", "end", "created", "summary", "description", "location", "rrule", "status", "source",
+        "_fingerprint"
+    )
 
     @staticmethod
     def from_dict(event: dict):
@@ -39,14 +80,15 @@ class CalendarEvent:
 
         return CalendarEvent(
             uid=event["uid"],
-            start=datetime.fromisoformat(event["start"]),
-            end=datetime.fromisoformat(event["end"]),
-            created=datetime.fromisoformat(event["created"]),
+            start=parse_date_or_datetime(event["start"]),
+            end=parse_date_or_datetime(event["end"]),
+            created=parse_date_or_datetime(event["created"]),
             summary=event["summary"],
             description=event["description"],
             location=event["location"],
             rrule=event["rrule"],
             status=event["status"],
+            source=event.get("source", ""),
         )
 
     @staticmethod
@@ -81,38 +123,74 @@ class CalendarEvent:
 
     def __init__(
             self, uid: str, start: datetime, end: datetime, created: datetime,
-            summary: str, description: str, location: str, rrule: str, status: str
+            summary: str, description: str, location: str, rrule: str, status: str, source: str = ""
     ):
-        self.uid = uid
-        self.start: datetime = start
-        self.end: datetime = end
-        self.duration: pandas.Timedelta = pandas.Timedelta(end - start)
-        self.created: datetime = created
-        self.summary: str = summary
-        self.description: str = description
-        self.location: str = location
-        self.rrule: str = rrule
-        self.status: str = status
+        set_attribute = object.__setattr__
+        set_attribute(self, "uid", uid)
+        set_attribute(self, "start", start)
+        set_attribute(self, "end", end)
+        set_attribute(self, "created", created)
+        set_attribute(self, "summary", summary)
+        set_attribute(self, "description", description)
+        set_attribute(self, "location", location)
+        set_attribute(self, "rrule", rrule)
+        set_attribute(self, "status", status)
+        # Name of the calendar the event was read from, only set when several calendars are merged
+        set_attribute(self, "source", source)
+        set_attribute(self, "_fingerprint", None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"CalendarEvent is immutable. Can not set attribute: {name}")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"CalendarEvent is immutable. Can not delete attribute: {name}")
+
+    def with_source(self, source: str):
+        if source == self.source:
+            return self
+        return CalendarEvent(
+            uid=self.uid, start=self.start, end=self.end, created=self.created, summary=self.summary,
+            description=self.description, location=self.location, rrule=self.rrule, status=self.status, source=source
+        )
+
+    @property
+    def duration(self) -> timedelta:
+        return self.end - self.start
+
+    @property
+    def fingerprint(self) -> bytes:
+        # Stable hash of the fields compared by __eq__, as they are serialized by to_dict
+        if self._fingerprint is None:
+            content: str = "\x1f".join([
+                self.uid,
+                self.start.isoformat(),
+                self.end.isoformat(),
+                self.created.isoformat(),
+                self.summary,
+                self.description,
+                self.location,
+                self.rrule,
+                self.status
+            ] + ([self.source] if self.source != "" else []))
+            object.__setattr__(self, "_fingerprint", hashlib.blake2b(content.encode("utf-8"), digest_size=16).digest())
+        return self._fingerprint
 
     def __eq__(self, other):
-        return all([
-            self.uid == other.uid,
-            self.start == other.start,
-            self.end == other.end,
-            self.created == other.created,
-            self.summary == other.summary,
-            self.description == other.description,
-            self.location == other.location,
-            self.rrule == other.rrule,
-            self.status == other.status
-        ])
+        if self is other:
+            return True
+        if not isinstance(other, CalendarEvent):
+            return NotImplemented
+        return self.fingerprint == other.fingerprint
+
+    def __hash__(self):
+        return hash(self.fingerprint)
 
     def to_dict(self):
-        return {
+        event: dict = {
             "uid": self.uid,
             "start": str(self.start.isoformat()),
             "end": str(self.end.isoformat()),
-            "duration": str(self.duration.isoformat()),
+            "duration": iso_duration(self.duration),
             "created": str(self.created.isoformat()),
             "name": self.summary,
             "summary": self.summary,
@@ -121,35 +199,157 @@ class CalendarEvent:
             "rrule": self.rrule,
             "status": self.status
         }
+        if self.source != "":
+            event["source"] = self.source
+        return event
 
 
 class Calendar:
 
     @staticmethod
-    def from_ical(ical_string: str):
+    def from_ical(ical_string: str, expander=None):
+        # expander is an optional model.expansion.RecurrenceExpander, expanding the recurring events one uid at a time
         calendar_icalendar: icalendar.Calendar = icalendar.Calendar.from_ical(ical_string)
         properties: dict = dict(calendar_icalendar)
-        cal_start: datetime = datetime.now()
-        cal_end: datetime = cal_start + relativedelta(months=3)
+        components: list = calendar_icalendar.walk("vevent")
+
+        expansion_started: float = perf_counter()
+        if expander is None:
+            cal_start, cal_end = get_recurrence_window()
+            recurring_events: [CalendarEvent] = [
+                CalendarEvent.from_ical_component(event) for event in recurring_ical_events.of(calendar_icalendar)
+                .between(cal_start, cal_end)
+            ]
+        else:
+            calendar_properties: icalendar.Calendar = icalendar.Calendar()
+            calendar_properties.update(properties)
+            components_by_uid: dict = {}
+            for component in components:
+                components_by_uid.setdefault(str(component["UID"]), []).append(component)
+            recurring_events = [
+                event for uid_components in components_by_uid.values()
+                for event in expander.expand(calendar_properties, uid_components)
+            ]
+        expansion_seconds: float = perf_counter() - expansion_started
+
         return Calendar(
             events=[
-                CalendarEvent.from_ical_component(event) for event in calendar_icalendar.walk("vevent")
+                CalendarEvent.from_ical_component(event) for event in components
             ],
-            recurring_events=[
+            recurring_events=recurring_events,
+            prod_id=str(properties["PRODID"]),
+            version=str(properties["VERSION"]),
+            scale=str(properties["CALSCALE"]),
+            timezone=str(properties["X-WR-TIMEZONE"]),
+            name=str(properties["X-WR-CALNAME"]),
+            description=str(properties["X-WR-CALDESC"]),
+            expansion_seconds=expansion_seconds
+        )
+
+    @staticmethod
+    def from_ical_stream(chunks, expander=None):
+        # Parses the calendar one VEVENT at a time from an iterable of text chunks, e.g. a download in progress.
+        # Only recurring components are kept until the end, as their overrides may appear anywhere in the feed.
+        stream: IcalStream = IcalStream(chunks)
+        cal_start, cal_end = get_recurrence_window()
+        events: [CalendarEvent] = []
+        recurring_events: [CalendarEvent] = []
+        recurring_components: list = []
+        single_components: list = []
+        expansion_seconds: [float] = [0.0]
+
+        def expand(components: list) -> [CalendarEvent]:
+            started: float = perf_counter()
+            try:
+                return expand_components(components)
+            finally:
+                expansion_seconds[0] += perf_counter() - started
+
+        def expand_components(components: list) -> [CalendarEvent]:
+            if expander is not None:
+                calendar_properties: icalendar.Calendar = stream.properties()
+                components_by_uid: dict = {}
+                for component in components:
+                    components_by_uid.setdefault(str(component["UID"]), []).append(component)
+                return [
+                    event for uid_components in components_by_uid.values()
+                    for event in expander.expand(calendar_properties, uid_components)
+                ]
+            calendar_icalendar: icalendar.Calendar = stream.properties()
+            for component in components:
+                calendar_icalendar.add_component(component)
+            return [
                 CalendarEvent.from_ical_component(event) for event in recurring_ical_events.of(calendar_icalendar)
                 .between(cal_start, cal_end)
-            ],
+            ]
+
+        for component in stream.vevents():
+            events.append(CalendarEvent.from_ical_component(component))
+            if is_recurring(component):
+                recurring_components.append(component)
+                continue
+            single_components.append(component)
+            if len(single_components) >= STREAM_EXPANSION_BATCH_SIZE:
+                recurring_events += expand(single_components)
+                single_components = []
+        recurring_events += expand(single_components + recurring_components)
+
+        properties: dict = dict(stream.properties())
+        return Calendar(
+            events=events,
+            recurring_events=recurring_events,
             prod_id=str(properties["PRODID"]),
             version=str(properties["VERSION"]),
             scale=str(properties["CALSCALE"]),
             timezone=str(properties["X-WR-TIMEZONE"]),
             name=str(properties["X-WR-CALNAME"]),
-            description=str(properties["X-WR-CALDESC"])
+            description=str(properties["X-WR-CALDESC"]),
+            expansion_seconds=expansion_seconds[0]
+        )
+
+    @staticmethod
+    def merge(calendars: list, sources: [str]):
+        # Merges the calendars into one, tagging each event with the name of its calendar in sources. A uid belongs to
+        # the first calendar which has it, and a uid of a later calendar whose events all match the content of events of
+        # earlier calendars is left out as a copy, so an event shared by several calendars is only kept once.
+        owners: dict = {}
+        content_keys: set = set()
+        for i, calendar in enumerate(calendars):
+            events_by_uid: dict = {}
+            for event in calendar.events:
+                events_by_uid.setdefault(event.uid, []).append(event)
+            calendar_keys: set = set()
+            for uid, uid_events in events_by_uid.items():
+                keys: [tuple] = [get_content_key(event) for event in uid_events]
+                if uid in owners or all([key in content_keys for key in keys]):
+                    continue
+                owners[uid] = i
+                calendar_keys.update(keys)
+            content_keys |= calendar_keys
+
+        # The occurrences of each calendar are already sorted, so they are merged rather than sorted again
+        occurrences: iter = heapq.merge(*[
+            [event.with_source(sources[i]) for event in calendar.recurring_events if owners.get(event.uid) == i]
+            for i, calendar in enumerate(calendars)
+        ], key=get_sort_key)
+        return Calendar(
+            events=[
+                event.with_source(sources[i])
+                for i, calendar in enumerate(calendars) for event in calendar.events if owners.get(event.uid) == i
+            ],
+            recurring_events=list(occurrences),
+            prod_id=calendars[0].prod_id,
+            version=calendars[0].version,
+            scale=calendars[0].scale,
+            timezone=calendars[0].timezone,
+            name=", ".join(sources),
+            description=calendars[0].description,
+            expansion_seconds=sum([calendar.expansion_seconds for calendar in calendars])
         )
 
     def __init__(
             self, events: [CalendarEvent], recurring_events: [CalendarEvent], prod_id: str, version: str, scale: str,
-            name: str, timezone: str, description: str
+            name: str, timezone: str, description: str, expansion_seconds: float = 0.0
     ):
         self.events: [CalendarEvent] = events
         self.recurring_events: [CalendarEvent] = recurring_events
@@ -159,9 +359,21 @@ class Calendar:
         self.name: str = name
         self.timezone: str = timezone
         self.description: str = description
+        # Time spent expanding the recurring events into occurrences while parsing
+        self.expansion_seconds: float = expansion_seconds
+
+        # Ties are broken by uid, so the order does not depend on the order of the source calendar
+        self.events.sort(key=get_sort_key)
+        self.recurring_events.sort(key=get_sort_key)
 
-        self.events.sort(key=lambda event: event.start)
-        self.recurring_events.sort(key=lambda event: event.start)
+    def drop_ended_occurrences(self, now: datetime):
+        # The recurrence window starts at midnight, so the occurrences which ended earlier on the day of the sync are
+        # expanded as well. Only the occurrences which have not ended by now are kept.
+        window_end: datetime = get_recurrence_window()[1]
+        self.recurring_events = [
+            event for event in self.recurring_events
+            if recurring_ical_events.time_span_contains_event(now, window_end, event.start, event.end)
+        ]
 
     def to_dict(self) -> dict:
         return {
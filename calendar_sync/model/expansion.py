@@ -0,0 +1,147 @@
+from model.calendar import CalendarEvent
+from model.ical_stream import is_recurring
+from recurring_ical_events import time_span_contains_event
+from datetime import date, datetime, timedelta
+import recurring_ical_events
+import icalendar
+import hashlib
+import threading
+
+
+def get_master_hash(calendar_properties: icalendar.Calendar, components: [icalendar.cal.Component]) -> str:
+    # Hash of an event with all of its overrides. DTSTAMP is left out, as Google sets it to the time of the export.
+    component_digests: [bytes] = []
+    for component in components:
+        hasher = hashlib.sha256()
+        for name, value in component.property_items():
+            if name == "DTSTAMP":
+                continue
+            params = getattr(value, "params", None)
+            hasher.update(name.encode("utf-8"))
+            if params:
+                hasher.update(params.to_ical())
+            hasher.update(b":")
+            hasher.update(value.to_ical() if hasattr(value, "to_ical") else str(value).encode("utf-8"))
+            hasher.update(b"\n")
+        component_digests.append(hasher.digest())
+    hasher = hashlib.sha256(str(calendar_properties.get("X-WR-TIMEZONE", "")).encode("utf-8"))
+    for digest in sorted(component_digests):
+        hasher.update(digest)
+    return hasher.hexdigest()
+
+
+def to_date(value) -> date:
+    return value.date() if isinstance(value, datetime) else value
+
+
+def is_recurring_master(components: [icalendar.cal.Component]) -> bool:
+    return len(components) != 1 or is_recurring(components[0])
+
+
+class RecurrenceExpander:
+    # Expands the recurring events of a calendar one uid at a time, and keeps the occurrences of each uid along with a
+    # hash of its components. A uid whose hash matches the one of the previous sync reuses its occurrences, and only the
+    # part of the window which was not covered by the previous sync is expanded. Events without recurrences are cheap to
+    # expand, so they are not cached.
+
+    def __init__(self, window_start: datetime, window_end: datetime, cache: dict = None):
+        self.window_start: datetime = window_start
+        self.window_end: datetime = window_end
+        self.cached_masters: dict = {}
+        self.previous_window_start: datetime = None
+        self.previous_window_end: datetime = None
+        self.masters: dict = {}
+        self.stats: dict = {"single": 0, "expanded": 0, "advanced": 0, "reused": 0}
+        # Calendars fetched concurrently share the expander
+        self.stats_lock = threading.Lock()
+
+        if cache is not None:
+            previous_window_start: datetime = datetime.fromisoformat(cache["window-start"])
+            previous_window_end: datetime = datetime.fromisoformat(cache["window-end"])
+            # The cache can only be used while the window moves forward and overlaps the previous one
+            if previous_window_start <= window_start < previous_window_end <= window_end:
+                self.cached_masters = cache["masters"]
+                self.previous_window_start = previous_window_start
+                self.previous_window_end = previous_window_end
+
+    def count(self, stat: str):
+        with self.stats_lock:
+            self.stats[stat] += 1
+
+    def is_modified(self) -> bool:
+        # Whether the cache must be written again, which it need not be when nothing moved or changed since it was read
+        return self.previous_window_start != self.window_start or self.previous_window_end != self.window_end \
+            or self.masters != self.cached_masters
+
+    def to_dict(self) -> dict:
+        return {
+            "window-start": self.window_start.isoformat(),
+            "window-end": self.window_end.isoformat(),
+            "masters": self.masters
+        }
+
+    def expand_between(
+            self, calendar_properties: icalendar.Calendar, components: [icalendar.cal.Component],
+            span_start: datetime, span_end: datetime
+    ) -> [CalendarEvent]:
+        calendar_icalendar: icalendar.Calendar = icalendar.Calendar()
+        calendar_icalendar.update(calendar_properties)
+        for component in components:
+            calendar_icalendar.add_component(component)
+        return [
+            CalendarEvent.from_ical_component(event) for event in recurring_ical_events.of(calendar_icalendar)
+            .between(span_start, span_end)
+        ]
+
+    def may_occur_between(self, components: [icalendar.cal.Component], span_start: datetime, span_end: datetime):
+        # A single event without recurrences can only occur around its own start and end. A day of margin on both
+        # sides covers time zones, so events far from the span are skipped without expanding them.
+        if is_recurring_master(components):
+            return True
+        component: icalendar.cal.Component = components[0]
+        start: date = to_date(component["DTSTART"].dt)
+        end: date = start
+        if "DTEND" in component:
+            end = to_date(component["DTEND"].dt)
+        elif "DURATION" in component:
+            end = to_date(component["DTSTART"].dt + component["DURATION"].dt)
+        return start <= to_date(span_end) + timedelta(days=1) and end >= to_date(span_start) - timedelta(days=1)
+
+    def expand(self, calendar_properties: icalendar.Calendar, components: [icalendar.cal.Component]) -> [CalendarEvent]:
+        # components are all the components of one uid: the event itself and any overrides of its recurrences
+        if not is_recurring_master(components):
+            self.count("single")
+            return self.expand_between(
+                calendar_properties, components, self.window_start, self.window_end
+            ) if self.may_occur_between(components, self.window_start, self.window_end) else []
+        uid: str = str(components[0]["UID"])
+        master_hash: str = get_master_hash(calendar_properties, components)
+        cached: dict = self.cached_masters.get(uid)
+
+        if cached is None or cached["hash"] != master_hash:
+            self.count("expanded")
+            occurrences: [CalendarEvent] = self.expand_between(
+                calendar_properties, components, self.window_start, self.window_end
+            ) if self.may_occur_between(components, self.window_start, self.window_end) else []
+        else:
+            occurrences = [
+                occurrence for occurrence in [CalendarEvent.from_dict(event) for event in cached["occurrences"]]
+                if time_span_contains_event(self.window_start, self.window_end, occurrence.start, occurrence.end)
+            ]
+            if self.previous_window_end < self.window_end \
+                    and self.may_occur_between(components, self.previous_window_end, self.window_end):
+                self.count("advanced")
+                cached_starts: set = set([occurrence.start for occurrence in occurrences])
+                occurrences += [
+                    occurrence for occurrence in self.expand_between(
+                        calendar_properties, components, self.previous_window_end, self.window_end
+                    ) if occurrence.start not in cached_starts
+                ]
+            else:
+                self.count("reused")
+
+        self.masters[uid] = {
+            "hash": master_hash,
+            "occurrences": [occurrence.to_dict() for occurrence in occurrences]
+        }
+        return occurrences
@@ -0,0 +1,82 @@
+import codecs
+import icalendar
+
+
+def decode_chunks(chunks, encoding: str = "utf-8"):
+    # Multibyte characters may be split across chunk boundaries, so decode incrementally
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for chunk in chunks:
+        text: str = decoder.decode(chunk)
+        if text != "":
+            yield text
+    tail: str = decoder.decode(b"", final=True)
+    if tail != "":
+        yield tail
+
+
+def split_lines(chunks):
+    remainder: str = ""
+    for chunk in chunks:
+        lines: [str] = (remainder + chunk).split("\n")
+        remainder = lines.pop()
+        for line in lines:
+            yield line.rstrip("\r")
+    if remainder != "":
+        yield remainder.rstrip("\r")
+
+
+def unfold_lines(chunks):
+    # Yields the logical content lines of an iCalendar stream, joining folded lines (RFC 5545 section 3.1)
+    current: str = ""
+    for line in split_lines(chunks):
+        if line[:1] in (" ", "\t"):
+            current += line[1:]
+            continue
+        if current != "":
+            yield current
+        current = line
+    if current != "":
+        yield current
+
+
+def is_recurring(component: icalendar.cal.Component) -> bool:
+    return any(prop in component for prop in ["RRULE", "RDATE", "RECURRENCE-ID"])
+
+
+class IcalStream:
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.header_lines: [str] = []
+
+    def properties(self) -> icalendar.Calendar:
+        # The calendar's own properties (PRODID, X-WR-TIMEZONE, ...) read so far, without any components
+        return icalendar.Calendar.from_ical("\r\n".join(["BEGIN:VCALENDAR"] + self.header_lines + ["END:VCALENDAR"]))
+
+    def vevents(self):
+        # Yields one icalendar.Event at a time. Only the lines of the component being read are held in memory.
+        component_lines: [str] = []
+        component_name: str = ""
+        depth: int = 0
+        for line in unfold_lines(self.chunks):
+            name: str = line.split(":", 1)[0].split(";", 1)[0].upper()
+            if name == "BEGIN":
+                depth += 1
+                if depth == 2:
+                    component_name = line.split(":", 1)[1].strip().upper()
+
+            if depth >= 2:
+                component_lines.append(line)
+            elif depth == 1 and name not in ("BEGIN", "END"):
+                self.header_lines.append(line)
+
+            if name == "END":
+                depth -= 1
+                if depth == 1:
+                    component_text: str = "\r\n".join(component_lines)
+                    component_lines = []
+                    if component_name == "VEVENT":
+                        yield icalendar.Event.from_ical(component_text)
+                    elif component_name == "VTIMEZONE":
+                        # Parsing a VTIMEZONE registers it for TZID lookups by the events that follow
+                        icalendar.Timezone.from_ical(component_text)
@@ -0,0 +1,295 @@
+# Behaviour of the keyset pages, the change set, the invalidation paths, the location keys, the expansion cache, the
+# published occurrences and the garbage collection of versions of the calendar sync.
+#
+# Usage: python -m pytest calendar_sync
+from datetime import date, datetime, time, timedelta, timezone
+from os import path, utime
+import random
+import json
+import sys
+
+# As when the function is built, the storage package is found next to model
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), ".."))
+sys.path.insert(0, path.dirname(path.abspath(__file__)))
+
+import icalendar
+import pytest
+
+import handler
+from model.calendar import Calendar, CalendarEvent
+from model.expansion import RecurrenceExpander
+
+START = datetime(2026, 1, 5, 18, 0)
+RECURRING_ICAL = """BEGIN:VCALENDAR
+PRODID:-//Test//Test//EN
+VERSION:2.0
+CALSCALE:GREGORIAN
+X-WR-CALNAME:Test
+X-WR-TIMEZONE:Europe/Oslo
+X-WR-CALDESC:
+BEGIN:VEVENT
+UID:weekly
+DTSTART:20260105T180000
+DTEND:20260105T200000
+RRULE:FREQ=WEEKLY;BYDAY=MO
+EXDATE:20260119T180000
+CREATED:20251201T120000Z
+SUMMARY:Weekly
+END:VEVENT
+BEGIN:VEVENT
+UID:weekly
+RECURRENCE-ID:20260126T180000
+DTSTART:20260127T190000
+DTEND:20260127T210000
+CREATED:20251201T120000Z
+SUMMARY:Weekly, moved to Tuesday
+END:VEVENT
+BEGIN:VEVENT
+UID:monthly
+DTSTART:20251215T100000
+DTEND:20251215T110000
+RRULE:FREQ=MONTHLY;BYMONTHDAY=15;COUNT=5
+CREATED:20251201T120000Z
+SUMMARY:Monthly
+END:VEVENT
+END:VCALENDAR
+"""
+
+
+@pytest.fixture(autouse=True)
+def environment(monkeypatch):
+    monkeypatch.setenv("CALENDAR_LINK", "https://calendar.example.com/basic.ics")
+    monkeypatch.setenv("EVENTS_PER_PAGE", "10")
+    for name in ["PAGE_BYTES", "PAGE_MIN_EVENTS", "MINIFY_JSON", "VERSION_RETENTION_HOURS"]:
+        monkeypatch.delenv(name, raising=False)
+
+
+def create_event(uid: str, start: datetime, summary: str = None) -> CalendarEvent:
+    return CalendarEvent(
+        uid=uid, start=start, end=start + timedelta(hours=1), created=START, summary=summary or f"Event {uid}",
+        description="", location="", rrule="", status="CONFIRMED"
+    )
+
+
+def create_calendar(events: [CalendarEvent]) -> Calendar:
+    return Calendar(
+        events=list(events), recurring_events=list(events), prod_id="-//Test//Test//EN", version="2.0",
+        scale="GREGORIAN", name="Test", timezone="Europe/Oslo", description=""
+    )
+
+
+def create_events(count: int) -> [CalendarEvent]:
+    return [create_event(f"event-{i}", START + timedelta(hours=3 * i)) for i in range(count)]
+
+
+def get_changed_pages(old_pages: dict, new_pages: dict) -> set:
+    return set([
+        page_id for page_id in set(old_pages) | set(new_pages) if old_pages.get(page_id) != new_pages.get(page_id)
+    ])
+
+
+def assert_chain(pages: dict, events: [CalendarEvent]):
+    # The pages link each other in order from the first page to the last, and hold every event once, in order
+    first: [str] = [page_id for page_id, page in pages.items() if page["prev"] is None]
+    assert len(first) == 1
+    visited: [str] = []
+    page_id: str = first[0]
+    while page_id is not None:
+        page: dict = pages[page_id]
+        assert page["page"] == page_id
+        assert page["prev"] == (visited[-1] if len(visited) > 0 else None)
+        assert 0 < page["events-in-page"] == len(page["events"]) <= page["per-page"]
+        visited.append(page_id)
+        page_id = page["next"]
+    assert sorted(visited) == sorted(pages.keys())
+    assert list(pages.keys()) == visited
+    assert [event for page_id in visited for event in pages[page_id]["events"]] == [event.to_dict() for event in events]
+
+
+@pytest.mark.parametrize("position", [0, 1, 250, 498, 500])
+def test_single_insert_changes_constant_number_of_pages(position: int):
+    events: [CalendarEvent] = create_events(500)
+    pages, anchors = handler.get_keyset_paginated_recurring_events(create_calendar(events), [])
+    assert len(pages) == 50
+
+    start: datetime = events[position].start - timedelta(minutes=30) if position < len(events) \
+        else events[-1].start + timedelta(hours=1)
+    inserted: [CalendarEvent] = sorted(events + [create_event("inserted", start)], key=lambda event: event.start)
+    new_pages, _ = handler.get_keyset_paginated_recurring_events(create_calendar(inserted), anchors)
+
+    # The page the event is inserted in, the page split from it and the link of the page after them
+    assert len(get_changed_pages(pages, new_pages)) <= 3
+    assert_chain(new_pages, inserted)
+
+
+def test_pages_stay_linked_and_complete_after_merges():
+    rand: random.Random = random.Random(0)
+    events: [CalendarEvent] = create_events(300)
+    pages, anchors = handler.get_keyset_paginated_recurring_events(create_calendar(events), [])
+    for _ in range(20):
+        # Removing most events of a range leaves pages underfull, which are merged with the page before them
+        first: int = rand.randrange(len(events))
+        removed: set = set(rand.sample(range(first, min(first + 40, len(events))), min(30, len(events) - first)))
+        events = [event for i, event in enumerate(events) if i not in removed]
+        events = sorted(events + [
+            create_event(f"added-{rand.random()}", START + timedelta(minutes=rand.randrange(60 * 24 * 40)))
+            for _ in range(rand.randrange(30))
+        ], key=lambda event: (event.start, event.uid))
+        new_pages, anchors = handler.get_keyset_paginated_recurring_events(create_calendar(events), anchors)
+        assert_chain(new_pages, events)
+        assert len(anchors) == len(new_pages)
+        pages = new_pages
+
+    manifest: dict = handler.get_pages_manifest(pages, len(events))
+    assert [page["page"] for page in manifest["pages"]] == list(pages.keys())
+    assert sum([page["events-in-page"] for page in manifest["pages"]]) == len(events)
+
+
+def test_change_set():
+    old_events: [CalendarEvent] = create_events(5)
+    new_events: [CalendarEvent] = old_events[1:4] + [
+        create_event("event-4", old_events[4].start, "Renamed"),
+        create_event("event-5", START)
+    ]
+    change_set: dict = handler.get_change_set(old_events, new_events)
+    assert [event.uid for event in change_set["added"]] == ["event-5"]
+    assert [event.uid for event in change_set["removed"]] == ["event-0"]
+    assert [(old.summary, new.summary) for old, new in change_set["modified"]] == [("Event event-4", "Renamed")]
+    assert handler.get_change_set(old_events, list(old_events)) == {"added": [], "removed": [], "modified": []}
+
+
+def test_invalidation_paths():
+    assert handler.get_invalidation_paths(["index.json", "pages/1.json"]) == ["/", "/index.json", "/pages/1.json"]
+
+    # Over the cap, the paths are grouped by directory
+    filenames: [str] = [f"pages/{i}.json" for i in range(40)] + [f"months/2026-{i:0>2}.json" for i in range(1, 13)]
+    paths: [str] = handler.get_invalidation_paths(filenames + ["index.json"])
+    assert paths == ["/", "/index.json", "/months/*", "/pages/*"]
+    assert len(paths) <= handler.MAX_INVALIDATION_PATHS
+
+    # When even the directories are too many, the whole distribution is invalidated
+    filenames = [f"indexes/days/2026-01-{i:0>2}/{j}.json" for i in range(1, 20) for j in range(2)]
+    assert handler.get_invalidation_paths(filenames) == ["/*"]
+
+
+def test_normalize_location():
+    assert handler.normalize_location("Møllergata 12") == "mollergata-12"
+    assert handler.normalize_location("Café  Blå, Ærø") == "cafe-bla-aero"
+    assert handler.normalize_location("Sørlandet") != handler.normalize_location("Srlandet")
+    assert handler.normalize_location("Ø") == "o"
+    # Names without Latin letters or digits are keyed by a hash of their spelling, regardless of casing and spacing
+    assert handler.normalize_location("Москва").startswith("location-")
+    assert handler.normalize_location("Москва") == handler.normalize_location(" москва ")
+    assert handler.normalize_location("Москва") != handler.normalize_location("Казань")
+    assert handler.normalize_location(" ") == ""
+
+
+def test_drop_ended_occurrences():
+    today: datetime = datetime.combine(date.today(), time.min)
+    calendar: Calendar = create_calendar([
+        create_event("ended", today + timedelta(hours=9)),
+        create_event("ongoing", today + timedelta(hours=11, minutes=30)),
+        create_event("upcoming", today + timedelta(hours=15)),
+        CalendarEvent(
+            uid="all-day", start=today.date(), end=today.date() + timedelta(days=1), created=START, summary="All day",
+            description="", location="", rrule="", status="CONFIRMED"
+        )
+    ])
+    calendar.drop_ended_occurrences(today + timedelta(hours=12))
+    assert [event.uid for event in calendar.recurring_events] == ["all-day", "ongoing", "upcoming"]
+    assert len(calendar.events) == 4
+
+
+def expand(expander: RecurrenceExpander) -> [CalendarEvent]:
+    calendar_icalendar: icalendar.Calendar = icalendar.Calendar.from_ical(RECURRING_ICAL)
+    calendar_properties: icalendar.Calendar = icalendar.Calendar()
+    calendar_properties.update(dict(calendar_icalendar))
+    components_by_uid: dict = {}
+    for component in calendar_icalendar.walk("vevent"):
+        components_by_uid.setdefault(str(component["UID"]), []).append(component)
+    return sorted([
+        event for components in components_by_uid.values()
+        for event in expander.expand(calendar_properties, components)
+    ], key=lambda event: (event.start, event.uid))
+
+
+@pytest.mark.parametrize("days", [0, 1, 9, 40])
+def test_advanced_cache_equals_fresh_expansion(days: int):
+    window_start: datetime = datetime(2026, 1, 1)
+    first: RecurrenceExpander = RecurrenceExpander(window_start, window_start + timedelta(days=60))
+    expand(first)
+
+    moved_start: datetime = window_start + timedelta(days=days)
+    moved_end: datetime = moved_start + timedelta(days=60)
+    advanced: RecurrenceExpander = RecurrenceExpander(moved_start, moved_end, first.to_dict())
+    fresh: RecurrenceExpander = RecurrenceExpander(moved_start, moved_end)
+    advanced_events: [CalendarEvent] = expand(advanced)
+
+    assert advanced_events == expand(fresh)
+    assert advanced.stats["expanded"] == 0
+    assert advanced.is_modified() == (days > 0)
+    # The same occurrences are cached, though overrides may come in another order
+    assert advanced.masters.keys() == fresh.masters.keys()
+    for uid, master in advanced.masters.items():
+        assert master["hash"] == fresh.masters[uid]["hash"]
+        assert sorted(master["occurrences"], key=lambda event: event["start"]) \
+            == sorted(fresh.masters[uid]["occurrences"], key=lambda event: event["start"])
+
+
+def create_version(manifest: str, hours_ago: float = None) -> dict:
+    version: dict = {"manifest": manifest, "events": f"{manifest}-events"}
+    if hours_ago is not None:
+        version["replaced"] = (datetime.now(timezone.utc) - timedelta(hours=hours_ago)).isoformat()
+    return version
+
+
+def test_retained_versions(monkeypatch):
+    monkeypatch.setenv("VERSION_RETENTION_HOURS", "24")
+    sync_state: dict = {"versions": {
+        "current": create_version("objects/v2.json"),
+        "retired": [create_version("objects/v1.json", 2), create_version("objects/v0.json", 30)]
+    }}
+    # The replaced version is retired, and versions replaced longer ago than the retention are no longer retained
+    retained: [dict] = handler.get_retained_versions(sync_state, create_version("objects/v3.json"))
+    assert [version["manifest"] for version in retained] == ["objects/v1.json", "objects/v2.json"]
+    # A version which is current again is not retired
+    retained = handler.get_retained_versions(sync_state, create_version("objects/v1.json"))
+    assert [version["manifest"] for version in retained] == ["objects/v2.json"]
+    # An unchanged version is not retired, so its replaced time is not reset
+    retained = handler.get_retained_versions(sync_state, create_version("objects/v2.json"))
+    assert [version["manifest"] for version in retained] == ["objects/v1.json"]
+
+    monkeypatch.setenv("VERSION_RETENTION_HOURS", "0")
+    assert handler.get_retained_versions(sync_state, create_version("objects/v3.json")) == []
+
+
+def put_object(storage, key: str, body: dict, hours_ago: float):
+    storage.put(key, bytes(json.dumps(body), "utf-8"), "application/json")
+    timestamp: float = (datetime.now() - timedelta(hours=hours_ago)).timestamp()
+    utime(storage.get_path(key), (timestamp, timestamp))
+
+
+@pytest.mark.parametrize("retention_hours", [0, 24])
+def test_collect_garbage(tmp_path, monkeypatch, retention_hours: int):
+    monkeypatch.setenv("STORAGE_PATH", str(tmp_path))
+    monkeypatch.setenv("VERSION_RETENTION_HOURS", str(retention_hours))
+    storage = handler.get_storage()
+    for version in ["current", "retained", "old"]:
+        put_object(storage, f"objects/{version}.json", {"files": {"events.json": f"objects/{version}-events.json"}}, 48)
+        put_object(storage, f"objects/{version}-events.json", {}, 48)
+    # Written by a sync which has yet to swap manifest.json
+    put_object(storage, "objects/pending.json", {}, 0)
+
+    referenced_keys: set = {"objects/current.json", "objects/current-events.json"} \
+        | handler.get_version_keys(create_version("objects/retained.json"))
+    assert handler.get_version_keys(create_version("objects/deleted.json")) == set()
+    result: dict = handler.collect_garbage(handler.list_existing_objects(handler.VERSIONED_PREFIX), referenced_keys)
+
+    # The current and retained versions are never collected, however old their objects are. Unreferenced objects are
+    # only collected once they are older than the retention.
+    deleted: set = {"objects/old.json", "objects/old-events.json"}
+    if retention_hours == 0:
+        deleted.add("objects/pending.json")
+    assert set([deleted_object["Key"] for deleted_object in result["deleted-objects"]]) == deleted
+    assert set([existing["Key"] for existing in handler.list_existing_objects(handler.VERSIONED_PREFIX)]) \
+        == referenced_keys | ({"objects/pending.json"} - deleted)
@@ -0,0 +1,106 @@
+# Parsing a calendar from a stream of chunks gives the same calendar as parsing it whole, wherever the chunks are split.
+#
+# Usage: python -m pytest calendar_sync
+from datetime import date, datetime, timedelta
+from os import path
+import sys
+
+sys.path.insert(0, path.dirname(path.abspath(__file__)))
+
+import pytest
+
+from model.calendar import Calendar
+from model.expansion import RecurrenceExpander
+from model.ical_stream import decode_chunks
+
+
+def get_ical(tzid: str) -> str:
+    # CRLF line endings, lines folded with spaces and tabs, multibyte characters, a VALARM nested in an event before
+    # some of its properties, and a VTIMEZONE whose TZID is only known from the calendar itself
+    day: str = (date.today() + timedelta(days=3)).strftime("%Y%m%d")
+    lines: [str] = [
+        "BEGIN:VCALENDAR",
+        "PRODID:-//Test//Test//EN",
+        "VERSION:2.0",
+        "CALSCALE:GREGORIAN",
+        "X-WR-CALNAME:Tøst",
+        "X-WR-TIMEZONE:Europe/Oslo",
+        "X-WR-CALDESC:Kalender for møter på Ærø",
+        "BEGIN:VTIMEZONE",
+        f"TZID:{tzid}",
+        "BEGIN:STANDARD",
+        "DTSTART:19700101T000000",
+        "TZOFFSETFROM:+0300",
+        "TZOFFSETTO:+0300",
+        "END:STANDARD",
+        "END:VTIMEZONE",
+        "BEGIN:VEVENT",
+        "UID:weekly",
+        f"DTSTART;TZID={tzid}:{day}T180000",
+        f"DTEND;TZID={tzid}:{day}T200000",
+        "RRULE:FREQ=WEEKLY;COUNT=6",
+        "CREATED:20251201T120000Z",
+        "SUMMARY:Ukentlig møte",
+        "DESCRIPTION:En lang beskrivelse som brettes over flere linjer\\, med æ\\, ø og",
+        "  å midt i\\, slik at tegn på flere byte kan deles mellom biter av strømmen",
+        "\t og linjer brettes med tabulator.",
+        "BEGIN:VALARM",
+        "ACTION:DISPLAY",
+        "DESCRIPTION:Påminnelse",
+        "TRIGGER:-PT15M",
+        "END:VALARM",
+        "LOCATION:Møllergata 12",
+        "END:VEVENT",
+    ] + [
+        line for i in range(20) for line in [
+            "BEGIN:VEVENT",
+            f"UID:single-{i}",
+            f"DTSTART:{day}T{10 + i % 8:0>2}0000",
+            f"DTEND:{day}T{11 + i % 8:0>2}0000",
+            "CREATED:20251201T120000Z",
+            f"SUMMARY:Arrangement {i} på Sørlandet",
+            "END:VEVENT",
+        ]
+    ] + [
+        "BEGIN:VEVENT",
+        "UID:weekly",
+        f"RECURRENCE-ID;TZID={tzid}:{(date.today() + timedelta(days=10)).strftime('%Y%m%d')}T180000",
+        f"DTSTART;TZID={tzid}:{(date.today() + timedelta(days=11)).strftime('%Y%m%d')}T190000",
+        f"DTEND;TZID={tzid}:{(date.today() + timedelta(days=11)).strftime('%Y%m%d')}T210000",
+        "CREATED:20251201T120000Z",
+        "SUMMARY:Ukentlig møte, flyttet",
+        "END:VEVENT",
+        "END:VCALENDAR",
+    ]
+    return "\r\n".join(lines) + "\r\n"
+
+
+def split(body: bytes, chunk_size: int) -> [bytes]:
+    return [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 64, 4096])
+@pytest.mark.parametrize("expanded", [False, True])
+def test_stream_equals_whole(chunk_size: int, expanded: bool):
+    # Timezones are registered for the whole process, so the stream is parsed first, with a TZID of its own
+    ical: str = get_ical(f"Custom/Three-{chunk_size}-{expanded}")
+    window_start: datetime = datetime.combine(date.today(), datetime.min.time())
+    streamed: Calendar = Calendar.from_ical_stream(
+        decode_chunks(split(bytes(ical, "utf-8"), chunk_size)),
+        RecurrenceExpander(window_start, window_start + timedelta(days=90)) if expanded else None
+    )
+    whole: Calendar = Calendar.from_ical(
+        ical, RecurrenceExpander(window_start, window_start + timedelta(days=90)) if expanded else None
+    )
+
+    assert streamed.to_dict() == whole.to_dict()
+    assert streamed.events == whole.events
+    assert streamed.recurring_events == whole.recurring_events
+    assert len(whole.events) == 22
+    assert len([event for event in whole.recurring_events if event.uid == "weekly"]) == 6
+
+    weekly = [event for event in streamed.events if event.uid == "weekly"][0]
+    assert weekly.start.utcoffset() == timedelta(hours=3)
+    assert weekly.location == "Møllergata 12"
+    assert weekly.description.startswith("En lang beskrivelse som brettes over flere linjer, med æ, ø og å midt i")
+    assert weekly.description.endswith("biter av strømmen og linjer brettes med tabulator.")
@@ -19,7 +19,7 @@ class CalendarDiffStack(Stack):
     def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
-        build.build_lambda("calendar_diff")
+        build.build_lambda("calendar_diff", ["storage"])
 
         cal_diff_function_id: str = f"{environ['PROJECT_NAME']}-calendar-diff-lambda"
 
@@ -100,7 +100,8 @@ class CalendarDiffStack(Stack):
         self.calendar_diff_function.add_event_source(
             event_sources.SqsEventSource(
                 self.calendar_diff_queue,
-                batch_size=1
+                batch_size=10,
+                report_batch_item_failures=True
             )
         )
         for topic in self.topics:
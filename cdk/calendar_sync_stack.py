@@ -13,6 +13,7 @@ from aws_cdk import (
     aws_sns as sns,
     RemovalPolicy
 )
+from build_utils import build
 
 
 class CalendarSyncStack(Stack):
@@ -27,6 +28,9 @@ class CalendarSyncStack(Stack):
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
+        # The image is built by CDK from the directory of the function
+        build.copy_shared_packages("calendar_sync", ["storage"])
+
         function_id: str = f"{environ['PROJECT_NAME']}-calendar-sync-lambda"
         rule_id: str = f"{environ['PROJECT_NAME']}-calendar-sync-lambda-trigger-rule"
 
@@ -70,6 +74,20 @@ class CalendarSyncStack(Stack):
                 "DISTRIBUTION_ID": distribution.distribution_id,
                 "BUCKET_NAME": bucket.bucket_name,
                 "EVENTS_PER_PAGE": environ["EVENTS_PER_PAGE"],
+                "PAGINATION": environ["PAGINATION"],
+                "PAGE_BYTES": environ["PAGE_BYTES"],
+                "PAGE_MIN_EVENTS": environ["PAGE_MIN_EVENTS"],
+                "ICAL_STREAMING": environ["ICAL_STREAMING"],
+                "SYNC_CONCURRENCY": environ["SYNC_CONCURRENCY"],
+                "EXPANSION_CACHE": environ["EXPANSION_CACHE"],
+                "MINIFY_JSON": environ["MINIFY_JSON"],
+                "ARTIFACT_ENCODINGS": environ["ARTIFACT_ENCODINGS"],
+                "CACHE_CONTROL": environ["CACHE_CONTROL"],
+                "EXPORTS": environ["EXPORTS"],
+                "SNAPSHOT_CACHE": environ["SNAPSHOT_CACHE"],
+                "METRICS": environ["METRICS"],
+                "PUBLISH_LAYOUT": environ["PUBLISH_LAYOUT"],
+                "VERSION_RETENTION_HOURS": environ["VERSION_RETENTION_HOURS"],
                 "EVENTS_CHANGED_TOPIC_ARN": events_changed_topic.topic_arn,
                 "TZ": environ["TZ"]
             }
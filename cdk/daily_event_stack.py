@@ -21,7 +21,7 @@ class DailyEventStack(Stack):
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
-        build.build_lambda("daily_event")
+        build.build_lambda("daily_event", ["storage"])
 
         daily_event_function_id: str = f"{environ['PROJECT_NAME']}-daily-event-lambda"
         rule_id: str = f"{environ['PROJECT_NAME']}-daily-event-lambda-trigger-rule"
@@ -44,6 +44,7 @@ class DailyEventStack(Stack):
             environment={
                 "TZ": environ["TZ"],
                 "BUCKET_NAME": events_bucket.bucket_name,
+                "PUBLISH_LAYOUT": environ["PUBLISH_LAYOUT"],
                 "DAILY_EVENT_TOPIC_ARN": self.daily_event_topic.topic_arn
             }
         )
@@ -1,6 +1,7 @@
 from constructs import Construct
 from os import environ
 from aws_cdk import (
+    Duration,
     Stack,
     aws_lambda,
     aws_lambda_event_sources as event_sources,
@@ -33,8 +34,9 @@ class DiscordNotifyStack(Stack):
             fifo=True,
             content_based_deduplication=False,
             deduplication_scope=sqs.DeduplicationScope.MESSAGE_GROUP,
+            # Messages deferred by the rate limit of Discord are received again, so they are given more receives
             dead_letter_queue=sqs.DeadLetterQueue(
-                max_receive_count=2,
+                max_receive_count=5,
                 queue=sqs.Queue(
                     self, "DiscordNotifyDLQ",
                     queue_name="DiscordNotifyDLQ.fifo",
@@ -55,15 +57,21 @@ class DiscordNotifyStack(Stack):
             runtime=aws_lambda.Runtime.PYTHON_3_9,
             handler="handler.handler",
             code=aws_lambda.Code.from_asset("./discord_notify/build.zip"),
+            # Not longer than the default visibility timeout of the queue
+            timeout=Duration.seconds(30),
             environment={
                 "TZ": environ["TZ"],
-                "DISCORD_WEBHOOK_URL": environ["DISCORD_WEBHOOK_URL"]
+                "DISCORD_WEBHOOK_URL": environ["DISCORD_WEBHOOK_URL"],
+                "DISCORD_POOL_SIZE": environ["DISCORD_POOL_SIZE"],
+                "DISCORD_CONNECT_TIMEOUT": environ["DISCORD_CONNECT_TIMEOUT"],
+                "DISCORD_READ_TIMEOUT": environ["DISCORD_READ_TIMEOUT"]
             }
         )
 
         self.discord_notify_function.add_event_source(
             event_sources.SqsEventSource(
                 self.discord_notify_queue,
-                batch_size=1
+                batch_size=10,
+                report_batch_item_failures=True
             )
         )
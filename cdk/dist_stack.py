@@ -18,6 +18,7 @@ class DistStack(Stack):
         distribution_id: str = f"{environ['PROJECT_NAME']}-calendar-sync-events-distribution"
         bucket_id: str = f"{environ['PROJECT_NAME']}-calendar-sync-events-bucket"
         response_headers_policy_id: str = f"{environ['PROJECT_NAME']}-calendar-sync-events-distribution-rhp"
+        private_function_id: str = f"{environ['PROJECT_NAME']}-calendar-sync-events-distribution-private"
 
         self.bucket = s3.Bucket(
             scope=self,
@@ -29,13 +30,23 @@ class DistStack(Stack):
             auto_delete_objects=True,
         )
 
+        origin = origins.S3Origin(self.bucket)
+        # The sync state and the expansion cache are kept under private/ in the bucket, and are only read by the sync
+        private_function = cf.Function(
+            scope=self,
+            id=private_function_id,
+            code=cf.FunctionCode.from_inline(
+                "function handler(event) { return { statusCode: 404, statusDescription: 'Not Found' }; }"
+            )
+        )
+
         self.distribution = cf.Distribution(
             scope=self,
             id=distribution_id,
             default_behavior=cf.BehaviorOptions(
                 allowed_methods=cf.AllowedMethods.ALLOW_GET_HEAD,
                 cached_methods=cf.CachedMethods.CACHE_GET_HEAD,
-                origin=origins.S3Origin(self.bucket),
+                origin=origin,
                 origin_request_policy=cf.OriginRequestPolicy.CORS_S3_ORIGIN,
                 response_headers_policy=cf.ResponseHeadersPolicy(
                     scope=self,
@@ -53,6 +64,16 @@ class DistStack(Stack):
                     )
                 )
             ),
+            additional_behaviors={
+                "private/*": cf.BehaviorOptions(
+                    allowed_methods=cf.AllowedMethods.ALLOW_GET_HEAD,
+                    origin=origin,
+                    function_associations=[cf.FunctionAssociation(
+                        function=private_function,
+                        event_type=cf.FunctionEventType.VIEWER_REQUEST
+                    )]
+                )
+            },
             default_root_object="index.json",
             domain_names=[environ["DOMAIN_NAME"]],
             certificate=certificate,
@@ -14,7 +14,24 @@ default_optional_env_vars = {
     "ENABLE_CORS_ALLOWED_SECONDARY_DOMAIN": str(False),
     "CORS_ALLOWED_SECONDARY_DOMAIN": "http://localhost:8000",
     "TZ": "Europe/Oslo",
-    "EVENTS_PER_PAGE": "10"
+    "EVENTS_PER_PAGE": "10",
+    "PAGINATION": "offset",
+    "PAGE_BYTES": "0",
+    "PAGE_MIN_EVENTS": "1",
+    "ICAL_STREAMING": str(False),
+    "SYNC_CONCURRENCY": "8",
+    "EXPANSION_CACHE": str(True),
+    "MINIFY_JSON": str(False),
+    "ARTIFACT_ENCODINGS": "",
+    "CACHE_CONTROL": "",
+    "EXPORTS": "",
+    "SNAPSHOT_CACHE": "memory",
+    "METRICS": str(False),
+    "PUBLISH_LAYOUT": "paths",
+    "VERSION_RETENTION_HOURS": "24",
+    "DISCORD_POOL_SIZE": "1",
+    "DISCORD_CONNECT_TIMEOUT": "3.05",
+    "DISCORD_READ_TIMEOUT": "10"
 }
 
 
@@ -1,15 +1,13 @@
 import json
-import boto3
 from os import environ
 from datetime import datetime, timedelta
-
-sns_client = boto3.client('sns')
-s3_client = boto3.client('s3')
+from storage.object_store import ObjectStore, NoSuchKey, open_object_store
+from storage.clients import get_client
 
 
 def notify_event_is_tomorrow(calendar_event: dict):
     print(f"Notifying event tomorrow: {calendar_event['uid']}")
-    return sns_client.publish(
+    return get_client("sns").publish(
         TopicArn=environ["DAILY_EVENT_TOPIC_ARN"],
         Message=str(json.dumps({
             "event": calendar_event
@@ -18,31 +16,55 @@ def notify_event_is_tomorrow(calendar_event: dict):
     )
 
 
-def get_file_from_s3(filename: str):
-    return s3_client.get_object(
-        Bucket=environ['BUCKET_NAME'],
-        Key=filename,
-    )['Body'].read().decode("utf-8")
+def get_storage() -> ObjectStore:
+    return open_object_store(lambda: get_client("s3"))
+
+
+def get_published_files() -> dict:
+    # In the versioned layout, files are stored under keys derived from their content. manifest.json points at the
+    # current version, which holds the key of each file.
+    if environ.get("PUBLISH_LAYOUT", "paths") != "versioned":
+        return {}
+    root_manifest: dict = json.loads(get_storage().read("manifest.json"))
+    return json.loads(get_storage().read(root_manifest["version"]))["files"]
+
+
+def get_published_file(filename: str, files: dict):
+    return get_storage().read(files.get(filename, filename))
 
 
-def get_all_recurring_events() -> [dict]:
-    index_json: str = get_file_from_s3("index.json")
+def get_all_recurring_events(files: dict) -> [dict]:
+    index_json: str = get_published_file("index.json", files)
     index_dict: dict = json.loads(index_json)
     return index_dict["events"]
 
 
+def get_tomorrow() -> str:
+    return (datetime.now() + timedelta(days=1)).date().isoformat()
+
+
 def datetime_is_tomorrow(datetime_str: str) -> bool:
-    tomorrow: datetime = datetime.now() + timedelta(days=1)
-    return datetime.fromisoformat(datetime_str).date() == tomorrow.date()
+    return datetime.fromisoformat(datetime_str).date().isoformat() == get_tomorrow()
+
+
+def get_events_tomorrow() -> [dict]:
+    # The day index only holds the events starting on that day, so the full index.json is only read as a fallback
+    files: dict = get_published_files()
+    try:
+        return json.loads(get_published_file(f"indexes/days/{get_tomorrow()}.json", files))["events"]
+    except NoSuchKey:
+        print(f"Day index for {get_tomorrow()} was not found. Reading index.json")
+        return [
+            calendar_event for calendar_event in get_all_recurring_events(files)
+            if datetime_is_tomorrow(calendar_event["start"])
+        ]
 
 
 def handler(event, _):
     try:
-        recurring_events: [dict] = get_all_recurring_events()
-        for calendar_event in recurring_events:
-            if datetime_is_tomorrow(calendar_event["start"]):
-                notify_event_is_tomorrow(calendar_event)
-    except s3_client.exceptions.NoSuchKey:
+        for calendar_event in get_events_tomorrow():
+            notify_event_is_tomorrow(calendar_event)
+    except NoSuchKey:
         print(f"index.json was not found. Skipping daily events check")
         return False
 
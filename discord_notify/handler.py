@@ -1,13 +1,55 @@
 import rrule_parser.rrule_parser as rrule_parser
-from discord_webhook import DiscordWebhook
 from os import environ
+import random
 import json
+import time
 from datetime import datetime
-from html2text import HTML2Text
+
+MAX_CONTENT_LENGTH = 2000
+# A line holding a zero width space, which Discord shows as an empty line between the notifications of a message
+MESSAGE_SEPARATOR = "\n\u200b\n"
+MAX_SEND_ATTEMPTS = 5
+# Responses of 429 Too Many Requests are retried apart from other errors, as waiting for the rate limit is expected
+MAX_RATE_LIMITED_ATTEMPTS = 10
+RETRY_BASE_SECONDS = 0.5
+# Left to respond to the event source, rather than waiting for the rate limit until the function times out
+DEADLINE_MARGIN_SECONDS = 2
 
 webhook_url: str = environ["DISCORD_WEBHOOK_URL"]
-html_parser = HTML2Text()
-html_parser.ignore_links = True
+html_parser = None
+session = None
+# The rate limit bucket of the webhook as of its last response, kept while the container is warm
+rate_limit: dict = {"remaining": None, "reset": 0.0}
+
+
+def get_html_parser():
+    # Created on first use, so importing the handler stays cheap
+    global html_parser
+    if html_parser is None:
+        from html2text import HTML2Text
+        html_parser = HTML2Text()
+        html_parser.ignore_links = True
+    return html_parser
+
+
+def get_session():
+    # Created on first use and kept while the container is warm, so its connections to Discord are reused across
+    # messages and invocations instead of each message opening a new connection
+    global session
+    if session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        adapter: HTTPAdapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=int(environ.get("DISCORD_POOL_SIZE", "1")), max_retries=0
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+    return session
+
+
+def get_timeout() -> (float, float):
+    return float(environ.get("DISCORD_CONNECT_TIMEOUT", "3.05")), float(environ.get("DISCORD_READ_TIMEOUT", "10"))
 
 
 def build_time_string(start: str, end: str):
@@ -40,13 +82,71 @@ def build_time_changed_string(old_event: dict, new_event: dict):
            f"{build_time_string(new_event['start'], new_event['end'])}"
 
 
-def send_message_to_discord(message_text: str):
-    print(f"Sending message to discord")
-    webhook: DiscordWebhook = DiscordWebhook(
-        url=webhook_url,
-        content=message_text
-    )
-    return webhook.execute()
+class RateLimitDeadline(Exception):
+
+    def __init__(self, seconds: float):
+        super().__init__(f"Rate limited by Discord for {seconds:.1f} s, past the timeout of the function")
+
+
+def sleep_before_deadline(seconds: float, deadline: float):
+    if deadline is not None and time.monotonic() + seconds > deadline:
+        raise RateLimitDeadline(seconds)
+    time.sleep(seconds)
+
+
+def wait_for_rate_limit(deadline: float):
+    # Waits for the bucket to reset once Discord has reported no remaining requests, rather than sending into a 429
+    if rate_limit["remaining"] != 0:
+        return
+    seconds: float = rate_limit["reset"] - time.monotonic()
+    if seconds > 0:
+        print(f"Waiting {seconds:.2f} s for the Discord rate limit")
+        sleep_before_deadline(seconds, deadline)
+
+
+def update_rate_limit(response):
+    if "X-RateLimit-Remaining" in response.headers and "X-RateLimit-Reset-After" in response.headers:
+        rate_limit["remaining"] = int(response.headers["X-RateLimit-Remaining"])
+        rate_limit["reset"] = time.monotonic() + float(response.headers["X-RateLimit-Reset-After"])
+    if response.status_code == 429:
+        # retry_after of the body is more precise than the Retry-After header, which is rounded up to seconds
+        try:
+            retry_after: float = float(response.json()["retry_after"])
+        except (ValueError, KeyError, TypeError):
+            retry_after = float(response.headers.get("Retry-After", 1))
+        rate_limit["remaining"] = 0
+        rate_limit["reset"] = max(rate_limit["reset"], time.monotonic() + retry_after)
+
+
+def send_message_to_discord(message_text: str, deadline: float = None):
+    # Retried when rate limited, for as long as the deadline allows, and with exponential backoff and full jitter on
+    # connection errors and server errors
+    import requests
+    attempt: int = 0
+    rate_limited_attempt: int = 0
+    while True:
+        wait_for_rate_limit(deadline)
+        try:
+            response = get_session().post(webhook_url, json={"content": message_text}, timeout=get_timeout())
+        except requests.RequestException:
+            attempt += 1
+            if attempt == MAX_SEND_ATTEMPTS:
+                raise
+            sleep_before_deadline(random.uniform(0, RETRY_BASE_SECONDS * 2 ** attempt), deadline)
+            continue
+        update_rate_limit(response)
+        if response.status_code < 300:
+            return response
+        if response.status_code == 429:
+            print(f"Rate limited by Discord: {response.text}")
+            rate_limited_attempt += 1
+            if rate_limited_attempt == MAX_RATE_LIMITED_ATTEMPTS:
+                raise Exception(f"Rate limited by Discord {rate_limited_attempt} times: {response.text}")
+            continue
+        attempt += 1
+        if response.status_code < 500 or attempt == MAX_SEND_ATTEMPTS:
+            raise Exception(f"Discord responded with status code {response.status_code}: {response.text}")
+        sleep_before_deadline(random.uniform(0, RETRY_BASE_SECONDS * 2 ** attempt), deadline)
 
 
 def truncate_content(content: str, max_length: int) -> str:
@@ -55,14 +155,9 @@ def truncate_content(content: str, max_length: int) -> str:
     return content
 
 
-def process_new_event_message(message: dict):
+def render_new_event_message(message: dict) -> str:
     location_line: str = f"\n**Sted:** {message['event']['location']}" if message['event']['location'] != "" else ""
-    rrule_str: str = ""
-    if message['event']['rrule'] != "":
-        try:
-            rrule_str = rrule_parser.from_ical(message['event']['rrule'])
-        except Exception:
-            rrule_str = message['event']['rrule']
+    rrule_str: str = rrule_parser.humanize_many([message['event']['rrule']])[0]
     rrule_line: str = f"\n**Gjentakelse:** {rrule_str}" if rrule_str != "" else ""
     content: str = f":calendar_spiral: Et nytt arrangement har blitt opprettet :calendar_spiral:" \
                    f"\n" \
@@ -72,21 +167,15 @@ def process_new_event_message(message: dict):
                    f"{location_line}" \
                    f"{rrule_line}" \
                    f"\n" \
-                   f"\n{html_parser.handle(message['event']['description'])}"
+                   f"\n{get_html_parser().handle(message['event']['description'])}"
 
-    content = truncate_content(content, 2000)
-    return send_message_to_discord(content)
+    return truncate_content(content, MAX_CONTENT_LENGTH)
 
 
-def process_deleted_event_message(message: dict):
+def render_deleted_event_message(message: dict) -> str:
     location_line: str = f"\n~~**Sted:** {message['event']['location']}~~" if message['event']['location'] != "" else ""
 
-    rrule_str: str = ""
-    if message['event']['rrule'] != "":
-        try:
-            rrule_str = rrule_parser.from_ical(message['event']['rrule'])
-        except Exception:
-            rrule_str = message['event']['rrule']
+    rrule_str: str = rrule_parser.humanize_many([message['event']['rrule']])[0]
     rrule_line: str = f"~~\n**Gjentakelse:** {rrule_str}~~" if rrule_str != "" else ""
 
     content: str = f":calendar_spiral: Et arrangement har blitt slettet :calendar_spiral:" \
@@ -97,10 +186,9 @@ def process_deleted_event_message(message: dict):
                    f"{location_line}" \
                    f"{rrule_line}" \
                    f"\n" \
-                   f"\n{html_parser.handle(message['event']['description'])}"
+                   f"\n{get_html_parser().handle(message['event']['description'])}"
 
-    content = truncate_content(content, 2000)
-    return send_message_to_discord(content)
+    return truncate_content(content, MAX_CONTENT_LENGTH)
 
 
 change_descriptions = {
@@ -112,7 +200,7 @@ change_descriptions = {
 }
 
 
-def process_updated_event_message(message: dict):
+def render_updated_event_message(message: dict) -> str:
     old_event: dict = message['old_event']
     new_event: dict = message['new_event']
 
@@ -139,19 +227,7 @@ def process_updated_event_message(message: dict):
     if old_event['location'] != "" or new_event['location'] != "":
         location_line = f"\n**Sted:** {location_line}"
 
-    new_rrl: str = new_event['rrule']
-    if new_rrl != "":
-        try:
-            new_rrl = rrule_parser.from_ical(new_rrl)
-        except Exception:
-            pass
-
-    old_rrl: str = old_event['rrule']
-    if old_rrl != "":
-        try:
-            old_rrl = rrule_parser.from_ical(old_rrl)
-        except Exception:
-            pass
+    new_rrl, old_rrl = rrule_parser.humanize_many([new_event['rrule'], old_event['rrule']])
 
     rrule_line: str = new_rrl
     if old_event['rrule'] != "" and old_event['rrule'] != new_event['rrule']:
@@ -159,7 +235,7 @@ def process_updated_event_message(message: dict):
     if old_event['rrule'] != "" or new_event['rrule'] != "":
         rrule_line = f"\n**Gjentakelse:** {rrule_line}"
 
-    description_line: str = f"\n{html_parser.handle(new_event['description'])}"
+    description_line: str = f"\n{get_html_parser().handle(new_event['description'])}"
 
     content: str = f"{message_title}" \
                    f"\n" \
@@ -173,19 +249,13 @@ def process_updated_event_message(message: dict):
                    f"\n" \
                    f"{description_line}"
 
-    content = truncate_content(content, 2000)
-    return send_message_to_discord(content)
+    return truncate_content(content, MAX_CONTENT_LENGTH)
 
 
-def process_event_is_tomorrow_message(message: dict):
+def render_event_is_tomorrow_message(message: dict) -> str:
     location_line: str = f"\n**Sted:** {message['event']['location']}" if message['event']['location'] != "" else ""
 
-    rrl: str = message['event']['rrule']
-    if rrl != "":
-        try:
-            rrl = rrule_parser.from_ical(rrl)
-        except Exception:
-            pass
+    rrl: str = rrule_parser.humanize_many([message['event']['rrule']])[0]
 
     rrule_line: str = f"\n**Gjentakelse:** {rrl}" if message['event']['rrule'] != "" else ""
     content: str = f"@here" \
@@ -197,31 +267,114 @@ def process_event_is_tomorrow_message(message: dict):
                    f"{location_line}" \
                    f"{rrule_line}" \
                    f"\n" \
-                   f"\n{html_parser.handle(message['event']['description'])}"
-    content = truncate_content(content, 2000)
-    return send_message_to_discord(content)
+                   f"\n{get_html_parser().handle(message['event']['description'])}"
+    return truncate_content(content, MAX_CONTENT_LENGTH)
 
 
-message_handlers = {
-    "new_calendar_event": process_new_event_message,
-    "updated_calendar_event": process_updated_event_message,
-    "deleted_calendar_event": process_deleted_event_message,
-    "event_is_tomorrow": process_event_is_tomorrow_message
+message_renderers = {
+    "new_calendar_event": render_new_event_message,
+    "updated_calendar_event": render_updated_event_message,
+    "deleted_calendar_event": render_deleted_event_message,
+    "event_is_tomorrow": render_event_is_tomorrow_message
 }
 
 
-def process_record(record: dict):
+def get_message_group_id(record: dict) -> str:
+    return record.get('attributes', {}).get('MessageGroupId')
+
+
+def render_record(record: dict) -> str:
     record_body = json.loads(record['body'])
-    message_group_id = record['attributes']['MessageGroupId']
+    message_group_id = get_message_group_id(record)
 
-    if message_group_id not in message_handlers.keys():
-        raise Exception(f"No message handler found for MessageGroupId {message_group_id}")
+    if message_group_id not in message_renderers.keys():
+        raise Exception(f"No message renderer found for MessageGroupId {message_group_id}")
 
     record_message = json.loads(record_body['Message'])
-    return message_handlers[message_group_id](record_message)
+    return message_renderers[message_group_id](record_message)
+
+
+def pack_notifications(contents: [str]) -> [(int, int)]:
+    # Consecutive notifications share a Discord message as long as they fit in one, returning the start and end of the
+    # notifications of each message
+    bounds: [(int, int)] = []
+    start: int = 0
+    length: int = 0
+    for i, content in enumerate(contents):
+        if i > start and length + len(MESSAGE_SEPARATOR) + len(content) > MAX_CONTENT_LENGTH:
+            bounds.append((start, i))
+            start, length = i, 0
+        length += len(content) if i == start else len(MESSAGE_SEPARATOR) + len(content)
+    if start < len(contents):
+        bounds.append((start, len(contents)))
+    return bounds
+
+
+def get_deadline(context) -> float:
+    if context is None:
+        return None
+    return time.monotonic() + context.get_remaining_time_in_millis() / 1000 - DEADLINE_MARGIN_SECONDS
 
 
 def handler(event, context):
     print(f"Processing event: {event}")
-    for record in event['Records']:
-        process_record(record)
+    response = {
+        "messages_sent": 0,
+        "notifications_sent": 0,
+        # Time of the request of each sent message, from connecting until the response, excluding rate limit waits
+        "request_milliseconds": [],
+        "errors": [],
+        "batchItemFailures": []
+    }
+
+    records: [dict] = event['Records']
+    # The queue is FIFO, so once a record has failed, the later records of its message group are failed along with it
+    # and retried after it. Records of other message groups are still sent.
+    failed: [bool] = [False] * len(records)
+    failed_groups: set = set()
+
+    def fail(i: int):
+        failed[i] = True
+        failed_groups.add(get_message_group_id(records[i]))
+
+    # The index and content of each rendered record
+    rendered: [(int, str)] = []
+    for i, record in enumerate(records):
+        if get_message_group_id(record) in failed_groups:
+            fail(i)
+            continue
+        try:
+            rendered.append((i, render_record(record)))
+        except Exception as error:
+            response['errors'] = response['errors'] + [str(error)]
+            fail(i)
+
+    deadline: float = get_deadline(context)
+    while True:
+        # Packed again after each message, leaving out the records of the groups which have failed since
+        for i, _ in rendered:
+            if get_message_group_id(records[i]) in failed_groups:
+                fail(i)
+        rendered = [(i, content) for i, content in rendered if not failed[i]]
+        if len(rendered) == 0:
+            break
+        end: int = pack_notifications([content for _, content in rendered])[0][1]
+        try:
+            sent = send_message_to_discord(MESSAGE_SEPARATOR.join([content for _, content in rendered[:end]]), deadline)
+        except Exception as error:
+            response['errors'] = response['errors'] + [str(error)]
+            for i, _ in rendered[:end]:
+                fail(i)
+        else:
+            response['request_milliseconds'].append(round(sent.elapsed.total_seconds() * 1000, 1))
+            response['messages_sent'] += 1
+            response['notifications_sent'] += end
+        rendered = rendered[end:]
+
+    rrule_cache = rrule_parser.from_ical.cache_info()
+    response['rrule_cache'] = {"hits": rrule_cache.hits, "misses": rrule_cache.misses}
+    response['batchItemFailures'] = [
+        {"itemIdentifier": record["messageId"]} for i, record in enumerate(records) if failed[i]
+    ]
+    print(response)
+    return response
@@ -1,5 +1,8 @@
 from icalendar import vRecur
 from datetime import datetime, date, time
+from functools import lru_cache
+
+RRULE_CACHE_SIZE = 256
 
 frequencies = {
     "SECONDLY": "sekund",
@@ -202,10 +205,32 @@ process_funcs: dict = {
 }
 
 
-def from_ical(ical_string: str):
+def humanize(ical_string: str) -> str:
     rrule_dict: dict = vRecur.from_ical(ical_string)
+    # Only the properties of the rule are formatted, in the order of process_funcs
     result_array: [str] = [
-        process_funcs[prop](rrule_dict) for prop in process_funcs.keys()
+        process_funcs[prop](rrule_dict) for prop in process_funcs.keys() if prop in rrule_dict
     ]
     result_str: str = ", ".join(list(filter(lambda res: res != "", result_array)))
     return result_str if len(result_str) < 2 else f"{result_str[0].upper()}{result_str[1:]}"
+
+
+# The same few rules recur in most messages, so each distinct rule is only parsed and formatted once while the container
+# is warm. Hits and misses are counted by from_ical.cache_info().
+@lru_cache(maxsize=RRULE_CACHE_SIZE)
+def from_ical(ical_string: str) -> str:
+    return humanize(ical_string)
+
+
+def humanize_many(ical_strings: [str]) -> [str]:
+    # Humanizes each rule in order, returning a rule as it is when it cannot be parsed, and an empty rule as ""
+    result: [str] = []
+    for ical_string in ical_strings:
+        if ical_string == "":
+            result.append("")
+            continue
+        try:
+            result.append(from_ical(ical_string))
+        except Exception:
+            result.append(ical_string)
+    return result
@@ -0,0 +1,166 @@
+# Behaviour of the packing of notifications, the failure of message groups and the rate limits of the Discord
+# notifier, against a fake session in place of Discord.
+#
+# Usage: python -m pytest discord_notify
+from datetime import timedelta
+from os import environ, path
+import importlib.util
+import json
+import sys
+import time
+
+sys.path.insert(0, path.dirname(path.abspath(__file__)))
+
+import pytest
+
+# Every Lambda has a module named handler, so the notifier is loaded under its own name
+environ.setdefault("DISCORD_WEBHOOK_URL", "https://discord.example.com/api/webhooks/test")
+spec = importlib.util.spec_from_file_location(
+    "discord_notify_handler", path.join(path.dirname(path.abspath(__file__)), "handler.py")
+)
+handler = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(handler)
+
+
+class FakeResponse:
+
+    def __init__(self, status_code: int, body: dict = None, headers: dict = None):
+        self.status_code: int = status_code
+        self.body: dict = body or {}
+        self.headers: dict = headers or {}
+        self.text: str = json.dumps(self.body)
+        self.elapsed: timedelta = timedelta(milliseconds=5)
+
+    def json(self) -> dict:
+        return self.body
+
+
+class FakeSession:
+    # Responds to each post with the response respond returns for its content, recording the content and the time of
+    # each post
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.posts: [(float, str)] = []
+
+    def post(self, url: str, json: dict, timeout: (float, float)) -> FakeResponse:
+        self.posts.append((time.monotonic(), json["content"]))
+        return self.respond(json["content"])
+
+
+class FakeContext:
+
+    def __init__(self, remaining_milliseconds: int):
+        self.remaining_milliseconds: int = remaining_milliseconds
+
+    def get_remaining_time_in_millis(self) -> int:
+        return self.remaining_milliseconds
+
+
+@pytest.fixture(autouse=True)
+def rate_limit(monkeypatch):
+    # The rate limit is kept while the container is warm, so each test starts with a fresh one
+    monkeypatch.setattr(handler, "rate_limit", {"remaining": None, "reset": 0.0})
+
+
+def use_session(monkeypatch, respond) -> FakeSession:
+    session: FakeSession = FakeSession(respond)
+    monkeypatch.setattr(handler, "session", session)
+    return session
+
+
+def create_record(message_id: str, group_id: str, summary: str, description: str = "") -> dict:
+    event: dict = {
+        "summary": summary, "start": "2026-01-05T18:00:00", "end": "2026-01-05T20:00:00", "location": "",
+        "rrule": "", "description": description
+    }
+    return {
+        "messageId": message_id,
+        "body": json.dumps({"Message": json.dumps({"event": event})}),
+        "attributes": {"MessageGroupId": group_id}
+    }
+
+
+def test_pack_notifications():
+    contents: [str] = ["a" * 900, "b" * 900, "c" * 300, "d" * 2000, "e" * 10, "f" * 10]
+    bounds: [(int, int)] = handler.pack_notifications(contents)
+    assert bounds == [(0, 2), (2, 3), (3, 4), (4, 6)]
+    # Each message fits in one Discord message, and holds the notifications in order
+    for start, end in bounds:
+        assert len(handler.MESSAGE_SEPARATOR.join(contents[start:end])) <= handler.MAX_CONTENT_LENGTH
+    assert [i for start, end in bounds for i in range(start, end)] == list(range(len(contents)))
+    assert handler.pack_notifications([]) == []
+
+
+def test_failed_group_fails_its_later_records(monkeypatch):
+    session: FakeSession = use_session(
+        monkeypatch, lambda content: FakeResponse(400 if "Failing" in content else 204)
+    )
+    # Long enough that each notification is sent in a message of its own
+    description: str = "x" * 1500
+    records: [dict] = [
+        create_record("0", "new_calendar_event", "Failing", description),
+        create_record("1", "deleted_calendar_event", "Deleted", description),
+        create_record("2", "new_calendar_event", "After the failure", description),
+        create_record("3", "unknown_group", "Not rendered"),
+        create_record("4", "deleted_calendar_event", "Deleted again", description),
+        create_record("5", "unknown_group", "After the render failure"),
+    ]
+    response: dict = handler.handler({"Records": records}, None)
+
+    # The records after a failed record of their group are failed without being sent, while other groups are sent
+    assert response["batchItemFailures"] == [{"itemIdentifier": message_id} for message_id in ["0", "2", "3", "5"]]
+    assert response["messages_sent"] == 2
+    assert response["notifications_sent"] == 2
+    assert len(response["errors"]) == 2
+    sent: [str] = [content for _, content in session.posts]
+    assert len(sent) == 3
+    assert "Failing" in sent[0] and "**Deleted**" in sent[1] and "Deleted again" in sent[2]
+
+
+def test_short_notifications_share_a_message(monkeypatch):
+    session: FakeSession = use_session(monkeypatch, lambda content: FakeResponse(204))
+    records: [dict] = [create_record(str(i), "new_calendar_event", f"Event {i}") for i in range(5)]
+    response: dict = handler.handler({"Records": records}, None)
+    assert response["messages_sent"] == 1
+    assert response["notifications_sent"] == 5
+    assert response["batchItemFailures"] == []
+    assert session.posts[0][1].count(handler.MESSAGE_SEPARATOR) == 4
+
+
+def test_rate_limited_message_is_sent_after_retry_after(monkeypatch):
+    responses: [FakeResponse] = [
+        # retry_after of the body is used rather than the Retry-After header, which is rounded up to seconds
+        FakeResponse(429, {"retry_after": 0.2}, {"Retry-After": "1"}),
+        # No requests remain of the bucket, so the next message waits for it to reset rather than being rate limited
+        FakeResponse(204, headers={"X-RateLimit-Remaining": "0", "X-RateLimit-Reset-After": "0.2"}),
+        FakeResponse(204),
+    ]
+    session: FakeSession = use_session(monkeypatch, lambda content: responses.pop(0))
+    records: [dict] = [
+        create_record(str(i), "new_calendar_event", f"Event {i}", "x" * 1500) for i in range(2)
+    ]
+    response: dict = handler.handler({"Records": records}, FakeContext(60000))
+
+    assert response["batchItemFailures"] == []
+    assert response["messages_sent"] == 2
+    times: [float] = [posted for posted, _ in session.posts]
+    assert len(times) == 3
+    assert 0.2 <= times[1] - times[0] < 1
+    assert 0.2 <= times[2] - times[1] < 1
+
+
+def test_rate_limit_past_the_deadline_fails_the_records(monkeypatch):
+    session: FakeSession = use_session(monkeypatch, lambda content: FakeResponse(429, {"retry_after": 30}))
+    records: [dict] = [create_record("0", "new_calendar_event", "Event")]
+    started: float = time.monotonic()
+    # The deadline is half a second away once the margin is left to respond
+    response: dict = handler.handler(
+        {"Records": records}, FakeContext(int((handler.DEADLINE_MARGIN_SECONDS + 0.5) * 1000))
+    )
+
+    # The records are failed to be retried, rather than waiting past the timeout of the function
+    assert time.monotonic() - started < 1
+    assert len(session.posts) == 1
+    assert response["batchItemFailures"] == [{"itemIdentifier": "0"}]
+    assert "past the timeout of the function" in response["errors"][0]
@@ -0,0 +1,22 @@
+import threading
+
+# The AWS clients of the function, by service name, kept while the container is warm
+clients: dict = {}
+clients_lock = threading.Lock()
+
+
+def get_client(service_name: str, max_pool_connections: int = 10, before_call=None):
+    # boto3 is imported and clients are created on first use, so they are not paid for by invocations not using them.
+    # Clients are thread safe once created, but creating them is not. before_call is registered on the client when it
+    # is created, and called before each of its calls.
+    with clients_lock:
+        if service_name not in clients:
+            import boto3
+            from botocore.config import Config
+            clients[service_name] = boto3.client(
+                service_name,
+                config=Config(max_pool_connections=max_pool_connections)
+            )
+            if before_call is not None:
+                clients[service_name].meta.events.register("before-call", before_call)
+        return clients[service_name]
@@ -0,0 +1,297 @@
+from abc import ABC, abstractmethod
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from os import environ, path, makedirs, remove, replace, walk
+import hashlib
+import random
+import gzip
+import json
+import time
+import uuid
+
+# S3 returns at most 1000 keys per ListObjectsV2 request, and DeleteObjects accepts at most 1000 keys
+MAX_DELETE_KEYS = 1000
+MAX_PUT_ATTEMPTS = 4
+RETRY_BASE_SECONDS = 0.1
+RETRYABLE_ERROR_CODES = ["SlowDown", "InternalError", "ServiceUnavailable", "RequestTimeout", "RequestTimeTooSkewed"]
+# Stored next to the objects of the filesystem backend, holding the headers S3 would store with each object
+METADATA_DIRECTORY = ".metadata"
+
+
+class NoSuchKey(Exception):
+
+    def __init__(self, key: str):
+        super().__init__(f"The specified key does not exist: {key}")
+        self.key: str = key
+
+
+class NotModified(Exception):
+
+    def __init__(self, key: str):
+        super().__init__(f"The object is unchanged since it was last read: {key}")
+        self.key: str = key
+
+
+def decode_body(body: bytes, content_encoding: str) -> bytes:
+    if content_encoding == "gzip":
+        return gzip.decompress(body)
+    return body
+
+
+class ObjectStore(ABC):
+    # The objects the handlers read and write, with the same keys, headers and ETags whether they are stored in S3 or
+    # on the local filesystem. Each call is timed and counted as Storage<Call> in metrics, which may be any object with
+    # the add and add_seconds methods of calendar_sync's Metrics. Safe to use from several threads.
+
+    def __init__(self, metrics=None):
+        self.metrics = metrics
+
+    def timed(self, call: str):
+        if self.metrics is None:
+            return nullcontext()
+        return self.timed_call(call)
+
+    @contextmanager
+    def timed_call(self, call: str):
+        started: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.metrics.add(f"Storage{call}Calls", 1)
+            self.metrics.add_seconds(f"Storage{call}", time.perf_counter() - started)
+
+    def get(self, key: str, if_none_match: str = None) -> dict:
+        # Returns the stored body along with ETag, ContentType, ContentEncoding, CacheControl and Metadata. Raises
+        # NoSuchKey if the object does not exist, and NotModified if its ETag is if_none_match.
+        with self.timed("Get"):
+            return self.get_object(key, if_none_match)
+
+    def read(self, key: str) -> str:
+        stored: dict = self.get(key)
+        return decode_body(stored["Body"], stored.get("ContentEncoding") or "").decode("utf-8")
+
+    def put(
+            self, key: str, body, content_type: str, metadata: dict = None, content_encoding: str = None,
+            cache_control: str = None
+    ) -> dict:
+        # Retried with exponential backoff and full jitter when the error is transient. body is bytes or a file, which
+        # is read from the start on each attempt.
+        for attempt in range(MAX_PUT_ATTEMPTS):
+            if hasattr(body, "seek"):
+                body.seek(0)
+            try:
+                with self.timed("Put"):
+                    return self.put_object(key, body, content_type, metadata or {}, content_encoding, cache_control)
+            except Exception as error:
+                if attempt == MAX_PUT_ATTEMPTS - 1 or not self.is_retryable(error):
+                    raise
+                if self.metrics is not None:
+                    self.metrics.add("StorageRetries", 1)
+                time.sleep(random.uniform(0, RETRY_BASE_SECONDS * 2 ** attempt))
+
+    def list(self, prefix: str):
+        # Yields each object with the prefix in order of its key, as {"Key", "ETag", "Size", "LastModified"}, one
+        # listing at a time
+        continuation: str = None
+        while True:
+            with self.timed("List"):
+                objects, continuation = self.list_objects(prefix, continuation)
+            yield from objects
+            if continuation is None:
+                return
+
+    def delete(self, keys: [str]) -> dict:
+        # Deleted in requests of at most 1000 keys. Keys which do not exist are deleted as well, as in S3.
+        deleted: [str] = []
+        errors: [dict] = []
+        for i in range(0, len(keys), MAX_DELETE_KEYS):
+            with self.timed("Delete"):
+                chunk_deleted, chunk_errors = self.delete_objects(keys[i:i + MAX_DELETE_KEYS])
+            deleted += chunk_deleted
+            errors += chunk_errors
+        return {"deleted": deleted, "errors": errors}
+
+    @abstractmethod
+    def get_object(self, key: str, if_none_match: str) -> dict:
+        pass
+
+    @abstractmethod
+    def put_object(
+            self, key: str, body, content_type: str, metadata: dict, content_encoding: str, cache_control: str
+    ) -> dict:
+        pass
+
+    @abstractmethod
+    def list_objects(self, prefix: str, continuation: str) -> (list, str):
+        pass
+
+    @abstractmethod
+    def delete_objects(self, keys: [str]) -> ([str], [dict]):
+        pass
+
+    def is_retryable(self, error: Exception) -> bool:
+        return False
+
+
+class S3ObjectStore(ObjectStore):
+
+    def __init__(self, client, bucket_name: str, metrics=None):
+        super().__init__(metrics)
+        self.client = client
+        self.bucket_name: str = bucket_name
+
+    def get_object(self, key: str, if_none_match: str) -> dict:
+        from botocore.exceptions import ClientError
+        try:
+            response: dict = self.client.get_object(
+                Bucket=self.bucket_name,
+                Key=key,
+                **({"IfNoneMatch": if_none_match} if if_none_match is not None else {})
+            )
+        except self.client.exceptions.NoSuchKey:
+            raise NoSuchKey(key)
+        except ClientError as error:
+            if error.response["ResponseMetadata"]["HTTPStatusCode"] != 304:
+                raise error
+            raise NotModified(key)
+        return dict(response, Body=response["Body"].read())
+
+    def put_object(
+            self, key: str, body, content_type: str, metadata: dict, content_encoding: str, cache_control: str
+    ) -> dict:
+        extra_args: dict = {}
+        if content_encoding is not None and content_encoding != "identity":
+            extra_args["ContentEncoding"] = content_encoding
+        if cache_control:
+            extra_args["CacheControl"] = cache_control
+        response: dict = self.client.put_object(
+            Bucket=self.bucket_name,
+            Key=key,
+            Body=body,
+            ContentType=content_type,
+            Metadata=metadata,
+            **extra_args
+        )
+        return {"ETag": response["ETag"]}
+
+    def list_objects(self, prefix: str, continuation: str) -> (list, str):
+        response: dict = self.client.list_objects_v2(
+            Bucket=self.bucket_name,
+            Prefix=prefix,
+            **({"ContinuationToken": continuation} if continuation is not None else {})
+        )
+        if response.get("IsTruncated", False):
+            return response.get("Contents", []), response["NextContinuationToken"]
+        return response.get("Contents", []), None
+
+    def delete_objects(self, keys: [str]) -> ([str], [dict]):
+        response: dict = self.client.delete_objects(
+            Bucket=self.bucket_name,
+            Delete={
+                "Objects": [{"Key": key} for key in keys]
+            }
+        )
+        return [deleted["Key"] for deleted in response.get("Deleted", [])], response.get("Errors", [])
+
+    def is_retryable(self, error: Exception) -> bool:
+        from botocore.exceptions import ClientError, HTTPClientError
+        if isinstance(error, HTTPClientError):
+            return True
+        if not isinstance(error, ClientError):
+            return False
+        return error.response.get("Error", {}).get("Code") in RETRYABLE_ERROR_CODES \
+            or error.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0) >= 500
+
+
+class FileObjectStore(ObjectStore):
+    # Stores each object as a file under the directory, at the path of its key, so the published files can be served
+    # and inspected as they are. A key's headers are stored in .metadata at the same path.
+
+    def __init__(self, directory: str, metrics=None):
+        super().__init__(metrics)
+        self.directory: str = directory
+
+    def get_path(self, key: str) -> str:
+        return path.join(self.directory, *key.split("/"))
+
+    def get_metadata_path(self, key: str) -> str:
+        return path.join(self.directory, METADATA_DIRECTORY, *f"{key}.json".split("/"))
+
+    def get_object(self, key: str, if_none_match: str) -> dict:
+        try:
+            with open(self.get_metadata_path(key), "rb") as file:
+                headers: dict = json.load(file)
+            with open(self.get_path(key), "rb") as file:
+                body: bytes = file.read()
+        except FileNotFoundError:
+            raise NoSuchKey(key)
+        if if_none_match is not None and if_none_match == headers["ETag"]:
+            raise NotModified(key)
+        return dict(headers, Body=body, ContentLength=len(body))
+
+    def put_object(
+            self, key: str, body, content_type: str, metadata: dict, content_encoding: str, cache_control: str
+    ) -> dict:
+        body = body if isinstance(body, bytes) else body.read()
+        etag: str = f"\"{hashlib.md5(body).hexdigest()}\""
+        headers: dict = {"ETag": etag, "ContentType": content_type, "Metadata": metadata}
+        if content_encoding is not None and content_encoding != "identity":
+            headers["ContentEncoding"] = content_encoding
+        if cache_control:
+            headers["CacheControl"] = cache_control
+        # The headers are written last, as only objects with headers are listed
+        self.write_file(self.get_path(key), body)
+        self.write_file(self.get_metadata_path(key), bytes(json.dumps(headers), "utf-8"))
+        return {"ETag": etag}
+
+    def write_file(self, file_path: str, content: bytes):
+        # Written next to the file and renamed, so a reader never sees a partially written file
+        makedirs(path.dirname(file_path), exist_ok=True)
+        partial_path: str = f"{file_path}.{uuid.uuid4().hex}.partial"
+        with open(partial_path, "wb") as file:
+            file.write(content)
+        replace(partial_path, file_path)
+
+    def list_objects(self, prefix: str, continuation: str) -> (list, str):
+        # The whole listing is returned at once, as there is no limit to the number of keys of a directory
+        keys: [str] = []
+        for directory, directories, filenames in walk(self.directory):
+            relative_directory: str = path.relpath(directory, self.directory).replace(path.sep, "/")
+            if relative_directory == ".":
+                directories[:] = [name for name in directories if name != METADATA_DIRECTORY]
+                relative_directory = ""
+            keys += [
+                f"{relative_directory}/{filename}".lstrip("/") for filename in filenames
+                if not filename.endswith(".partial")
+            ]
+        objects: [dict] = []
+        for key in sorted([key for key in keys if key.startswith(prefix)]):
+            try:
+                with open(self.get_metadata_path(key), "rb") as file:
+                    headers: dict = json.load(file)
+                objects.append({
+                    "Key": key,
+                    "ETag": headers["ETag"],
+                    "Size": path.getsize(self.get_path(key)),
+                    "LastModified": datetime.fromtimestamp(path.getmtime(self.get_path(key)), timezone.utc)
+                })
+            except FileNotFoundError:
+                continue
+        return objects, None
+
+    def delete_objects(self, keys: [str]) -> ([str], [dict]):
+        for key in keys:
+            for file_path in [self.get_path(key), self.get_metadata_path(key)]:
+                try:
+                    remove(file_path)
+                except FileNotFoundError:
+                    pass
+        return keys, []
+
+
+def open_object_store(get_s3_client, metrics=None) -> ObjectStore:
+    # Objects are stored in the directory STORAGE_PATH when it is set, e.g. to run the functions without AWS, and in
+    # the bucket BUCKET_NAME otherwise. get_s3_client is only called for S3, so boto3 is not loaded for the filesystem.
+    if environ.get("STORAGE_PATH", "") != "":
+        return FileObjectStore(environ["STORAGE_PATH"], metrics)
+    return S3ObjectStore(get_s3_client(), environ["BUCKET_NAME"], metrics)